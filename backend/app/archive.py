@@ -0,0 +1,139 @@
+import re
+import json
+import zlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Conversation, ConversationArchive
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def archive_cutoff(now=None):
+    """Turns created before this are moved to the archive."""
+    return (now or timezone.now()) - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+
+
+def _month_of(created_at):
+    return created_at.date().replace(day=1)
+
+
+def _write_segment(user_id, month, rows):
+    turns = [
+        [row['id'], row['user_text'], row['llm_response'], row['created_at'].isoformat()]
+        for row in rows
+    ]
+    raw = json.dumps(turns, ensure_ascii=False, separators=(',', ':')).encode()
+    ConversationArchive.objects.create(
+        user_id=user_id,
+        month=month,
+        first_id=turns[0][0],
+        last_id=turns[-1][0],
+        turn_count=len(turns),
+        raw_bytes=len(raw),
+        segment=zlib.compress(raw, settings.ARCHIVE_COMPRESSION_LEVEL)
+    )
+    return len(raw)
+
+
+def archive_conversations(older_than=None, batch_size=2000):
+    """
+    Move conversations created before older_than (default: archive_cutoff())
+    into compressed per-user-month ConversationArchive segments, batch_size
+    rows per transaction. Embeddings are not archived, so archived turns
+    drop out of semantic retrieval. Cleared turns are left to the purger.
+    Returns the number of turns archived.
+    """
+    older_than = older_than or archive_cutoff()
+    archived = 0
+    while True:
+        rows = list(
+            Conversation.objects.filter(
+                created_at__lt=older_than,
+                user__isnull=False,
+                id__gt=F('user__conversations_cleared_through')
+            ).order_by('user_id', 'id').values(
+                'id', 'user_id', 'user_text', 'llm_response', 'created_at'
+            )[:batch_size]
+        )
+        if not rows:
+            break
+
+        groups = {}
+        for row in rows:
+            groups.setdefault((row['user_id'], _month_of(row['created_at'])), []).append(row)
+
+        raw_bytes = 0
+        with transaction.atomic():
+            for (user_id, month), group in groups.items():
+                raw_bytes += _write_segment(user_id, month, group)
+            # No relations point at Conversation: a single DELETE ... WHERE id IN (...)
+            Conversation.objects.filter(id__in=[row['id'] for row in rows]).delete()
+
+        archived += len(rows)
+        metrics.increment('archive.turns', len(rows))
+        metrics.increment('archive.segments', len(groups))
+        metrics.increment('archive.raw_bytes', raw_bytes)
+
+    if archived:
+        logger.info(f"Archived {archived} conversation turns older than {older_than:%Y-%m-%d}")
+    return archived
+
+
+def _segment_turns(archive):
+    return json.loads(zlib.decompress(archive.segment))
+
+
+def archived_turns(user, since=None, until=None):
+    """
+    The user's archived turns, newest first, as dicts shaped like the
+    conversation API rows (plus 'archived': True). Cleared turns are skipped.
+    """
+    archives = ConversationArchive.objects.filter(
+        user=user, last_id__gt=user.conversations_cleared_through
+    )
+    if since is not None:
+        archives = archives.filter(month__gte=_month_of(since))
+    if until is not None:
+        archives = archives.filter(month__lte=_month_of(until))
+
+    for archive in archives.order_by('-last_id'):
+        for turn_id, user_text, llm_response, created_at in reversed(_segment_turns(archive)):
+            if turn_id <= user.conversations_cleared_through:
+                continue
+            if since is not None or until is not None:
+                created = parse_datetime(created_at)
+                if (since is not None and created < since) or (until is not None and created >= until):
+                    continue
+            yield {
+                'id': turn_id,
+                'user_text': user_text,
+                'llm_response': llm_response,
+                'created_at': created_at,
+                'archived': True,
+            }
+
+
+def search_archived(user, query, limit=20):
+    """
+    Archived turns containing every word of query (case-insensitive),
+    newest first. The archive has no full-text index, so segments are
+    decompressed and scanned; only used when a search asks for it.
+    """
+    terms = [term.lower() for term in re.findall(r"\w+", query)]
+    if not terms or limit <= 0:
+        return []
+
+    results = []
+    for turn in archived_turns(user):
+        text = f"{turn['user_text'] or ''} {turn['llm_response'] or ''}".lower()
+        if all(term in text for term in terms):
+            results.append(turn)
+            if len(results) == limit:
+                break
+    return results
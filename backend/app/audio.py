@@ -0,0 +1,357 @@
+import io
+import os
+import struct
+import binascii
+import threading
+import tempfile
+import subprocess
+from contextlib import contextmanager
+import numpy as np
+from .formats import FORMATS, sniff_format
+
+# Compact STT input format: 16 kHz, mono, 16-bit signed PCM
+TARGET_SAMPLE_RATE = 16000
+TARGET_SAMPLE_WIDTH = 2
+
+SAMPLE_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioBufferFull(Exception):
+    """Raised when an utterance exceeds the buffer's max_bytes."""
+
+
+class AudioBuffer:
+    """
+    Growable byte buffer for one connection's incoming audio, reused across
+    utterances. Chunks are copied in place into a bytearray that keeps its
+    capacity between utterances, and readers get read-only memoryviews of it.
+    Memory is only allocated once audio arrives and can be handed back with
+    release(); max_bytes bounds a single utterance.
+
+    clear() while a reader is still active (e.g. the worker thread of a
+    cancelled utterance) switches to fresh memory instead of overwriting
+    bytes that are being read.
+    """
+
+    __slots__ = ('_data', '_length', '_readers', '_lock', 'max_bytes')
+
+    MIN_GROWTH = 64 * 1024
+
+    def __init__(self, capacity=256 * 1024, max_bytes=None):
+        self._data = bytearray(capacity)
+        self._length = 0
+        self._readers = 0
+        self._lock = threading.Lock()
+        self.max_bytes = max_bytes
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def append(self, chunk):
+        """Copy a bytes-like chunk to the end of the buffer."""
+        size = len(chunk)
+        with self._lock:
+            end = self._length + size
+            if self.max_bytes is not None and end > self.max_bytes:
+                raise AudioBufferFull(f"Audio exceeds {self.max_bytes} bytes")
+            if end > len(self._data):
+                # Grow into new memory: views handed out earlier stay valid
+                capacity = max(end, 2 * len(self._data), self.MIN_GROWTH)
+                if self.max_bytes is not None:
+                    capacity = min(capacity, self.max_bytes)
+                grown = bytearray(capacity)
+                grown[:self._length] = memoryview(self._data)[:self._length]
+                self._data = grown
+            self._data[self._length:end] = chunk
+            self._length = end
+
+    def append_base64(self, text):
+        """Decode a base64 chunk from the JSON protocol and append it."""
+        self.append(binascii.a2b_base64(text))
+
+    def clear(self):
+        with self._lock:
+            if self._readers:
+                self._data = bytearray(len(self._data))
+                self._readers = 0
+            self._length = 0
+
+    def release(self):
+        """Drop the contents and the allocated memory (active readers keep theirs)."""
+        with self._lock:
+            self._data = bytearray()
+            self._length = 0
+            self._readers = 0
+
+    @contextmanager
+    def reading(self):
+        """Yield a read-only view of the current contents."""
+        with self._lock:
+            data = self._data
+            view = memoryview(data)[:self._length].toreadonly()
+            self._readers += 1
+        try:
+            yield view
+        finally:
+            view.release()
+            with self._lock:
+                if self._data is data and self._readers:
+                    self._readers -= 1
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable file object over a bytes-like object, without copying it."""
+
+    def __init__(self, buffer, name="audio"):
+        super().__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def readinto(self, target):
+        chunk = self._view[self._position:self._position + len(target)]
+        target[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+
+def parse_wav(view):
+    """
+    Locate the PCM data of a WAV file without copying it.
+    Returns (pcm_view, sample_width, channels, frame_rate), or None when the
+    input is not plain integer PCM WAV.
+    """
+    view = memoryview(view).cast('B')
+    if len(view) < 12 or view[:4] != b'RIFF' or view[8:12] != b'WAVE':
+        return None
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        (size,) = struct.unpack_from('<I', view, offset + 4)
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack_from('<HHIIHH', view, offset + 8)
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            audio_format, channels, frame_rate, _, _, bits = fmt
+            sample_width = bits // 8
+            if audio_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE) or sample_width not in SAMPLE_DTYPES:
+                return None
+            # Streamed WAV (e.g. ffmpeg writing to a pipe) leaves the size unset
+            end = len(view) if size in (0, 0xFFFFFFFF) else min(len(view), offset + 8 + size)
+            pcm = view[offset + 8:end]
+            pcm = pcm[:len(pcm) - len(pcm) % (sample_width * channels)]
+            return pcm, sample_width, channels, frame_rate
+        offset += 8 + size + (size & 1)
+    return None
+
+
+def _run_ffmpeg(view, fmt, output_args):
+    """
+    Run ffmpeg on an in-memory payload and return its stdout. Input is piped
+    from the view without copying; the demuxer is given when the format is
+    known so ffmpeg does not have to probe. MP4 can keep its index (moov)
+    at the end, which needs a seekable input, so it goes through a temp file.
+    """
+    demuxer = ['-f', FORMATS[fmt][1]] if fmt in FORMATS else []
+    command = [FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error']
+
+    if fmt == 'mp4':
+        with tempfile.NamedTemporaryFile(suffix='.m4a') as temp_file:
+            temp_file.write(view)
+            temp_file.flush()
+            return subprocess.run(
+                command + ['-i', temp_file.name] + output_args + ['pipe:1'],
+                capture_output=True,
+                check=True
+            ).stdout
+
+    return subprocess.run(
+        command + demuxer + ['-i', 'pipe:0'] + output_args + ['pipe:1'],
+        input=view,
+        capture_output=True,
+        check=True
+    ).stdout
+
+
+def decode_audio(view, fmt=None, pcm_format=None):
+    """
+    Decode audio to 16-bit PCM by the cheapest path for its format: raw PCM
+    (pcm_format given) and PCM WAV are used in place, anything else is
+    decoded by ffmpeg without a temporary file (except MP4).
+    Returns (pcm_view, sample_width, channels, frame_rate).
+    """
+    view = memoryview(view).cast('B')
+    if pcm_format is not None:
+        frame_bytes = TARGET_SAMPLE_WIDTH * pcm_format.channels
+        pcm = view[:len(view) - len(view) % frame_bytes]
+        return pcm, TARGET_SAMPLE_WIDTH, pcm_format.channels, pcm_format.sample_rate
+
+    if fmt is None:
+        fmt = sniff_format(view)
+    if fmt == 'wav':
+        wav = parse_wav(view)
+        if wav is not None:
+            return wav
+
+    wav = parse_wav(_run_ffmpeg(view, fmt, ['-f', 'wav', '-acodec', 'pcm_s16le']))
+    if wav is None:
+        raise ValueError("ffmpeg did not produce PCM audio")
+    return wav
+
+
+def transcode_to_flac(view, fmt=None, sample_rate=TARGET_SAMPLE_RATE):
+    """Re-encode audio an engine cannot take as is into mono FLAC (lossless, compact)."""
+    return _run_ffmpeg(
+        memoryview(view).cast('B'), fmt,
+        ['-ac', '1', '-ar', str(sample_rate), '-f', 'flac']
+    )
+
+
+def lowpass_taps(cutoff, num_taps=63):
+    """
+    Windowed-sinc FIR low-pass taps. cutoff is in cycles per sample (0..0.5).
+    """
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+def resample(samples, src_rate, dst_rate):
+    """
+    Resample a mono float32 signal. Downsampling low-passes at the new
+    Nyquist frequency first so speech does not alias. Integer ratios
+    (48k/16k, 32k/16k) only evaluate the filter at the kept samples, as one
+    matrix-vector product over a strided window view; other ratios are
+    filtered and then interpolated.
+    """
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+
+    if dst_rate > src_rate:
+        out_length = int(len(samples) * dst_rate / src_rate)
+        positions = np.arange(out_length) * (src_rate / dst_rate)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+    taps = lowpass_taps(0.5 * dst_rate / src_rate * 0.95)
+    half = len(taps) // 2
+    padded = np.pad(samples, (half, half))
+
+    if src_rate % dst_rate == 0:
+        windows = np.lib.stride_tricks.sliding_window_view(padded, len(taps))[::src_rate // dst_rate]
+        return windows @ taps[::-1]
+
+    filtered = np.convolve(padded, taps, mode='valid')
+    out_length = int(len(samples) * dst_rate / src_rate)
+    positions = np.arange(out_length) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(len(filtered)), filtered).astype(np.float32)
+
+
+def pcm_to_mono_float(raw, sample_width, channels):
+    """Decode interleaved PCM bytes into a mono float32 signal scaled to the int16 range."""
+    samples = np.frombuffer(raw, dtype=SAMPLE_DTYPES[sample_width])
+    if sample_width == 1:
+        # 8-bit WAV is unsigned
+        samples = samples.astype(np.float32) - 128.0
+    scale = 32768.0 / (1 << (8 * sample_width - 1))
+
+    # Downmix by summing strided channel views (much faster than mean(axis=1))
+    frames = len(samples) // channels
+    mono = samples[0:frames * channels:channels].astype(np.float32)
+    for channel in range(1, channels):
+        mono += samples[channel:frames * channels:channels]
+    mono *= np.float32(scale / channels)
+    return mono
+
+
+def normalize_pcm(raw, sample_width, channels, frame_rate, sample_rate=TARGET_SAMPLE_RATE):
+    """
+    Convert interleaved PCM (any bytes-like, read without copying) to
+    16 kHz mono 16-bit PCM bytes.
+    """
+    mono = pcm_to_mono_float(raw, sample_width, channels)
+    mono = resample(mono, frame_rate, sample_rate)
+    return np.clip(np.rint(mono), -32768, 32767).astype(np.int16).tobytes()
+
+
+def to_audio_data(pcm, sample_rate=TARGET_SAMPLE_RATE):
+    """Wrap normalized PCM for speech_recognition without writing a WAV file."""
+    import speech_recognition as sr
+
+    return sr.AudioData(pcm, sample_rate, TARGET_SAMPLE_WIDTH)
+
+
+def frame_rms(pcm, sample_rate=TARGET_SAMPLE_RATE, frame_ms=20):
+    """RMS energy of consecutive frames of 16-bit mono PCM."""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frame = int(sample_rate * frame_ms / 1000)
+    frames = len(samples) // frame
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    blocks = samples[:frames * frame].reshape(frames, frame).astype(np.float32)
+    return np.sqrt(np.mean(blocks * blocks, axis=1))
+
+
+def split_on_silence(pcm, sample_rate=TARGET_SAMPLE_RATE, max_segment_seconds=25.0,
+                     min_segment_seconds=5.0, overlap_seconds=0.5, frame_ms=20):
+    """
+    Split long 16-bit mono PCM into segments no longer than max_segment_seconds.
+
+    Each cut is placed at the latest of the quietest points (smoothed frame
+    energy) between min_segment_seconds and max_segment_seconds after the
+    previous cut, so words are not split. Segments after the first start overlap_seconds
+    early so a word straddling a cut is heard whole by one of them.
+    Returns a list of PCM byte strings in order.
+    """
+    bytes_per_second = sample_rate * TARGET_SAMPLE_WIDTH
+    total_seconds = len(pcm) / bytes_per_second
+    if total_seconds <= max_segment_seconds:
+        return [pcm]
+
+    energy = frame_rms(pcm, sample_rate, frame_ms)
+    # Smooth over ~200 ms so a short gap between syllables is not taken for a pause
+    window = max(1, 200 // frame_ms)
+    smoothed = np.convolve(energy, np.ones(window, dtype=np.float32) / window, mode='same')
+
+    frames_per_second = 1000 / frame_ms
+    cuts = [0]
+    while (len(energy) - cuts[-1]) / frames_per_second > max_segment_seconds:
+        lo = cuts[-1] + int(min_segment_seconds * frames_per_second)
+        hi = cuts[-1] + int(max_segment_seconds * frames_per_second)
+        candidates = smoothed[lo:hi]
+        # Latest point that is about as quiet as the quietest one, so segments stay long
+        quiet = candidates.min() + 0.05 * (np.median(candidates) - candidates.min())
+        cuts.append(lo + int(np.flatnonzero(candidates <= quiet)[-1]))
+
+    frame_bytes = int(sample_rate * frame_ms / 1000) * TARGET_SAMPLE_WIDTH
+    overlap_bytes = int(overlap_seconds * sample_rate) * TARGET_SAMPLE_WIDTH
+    bounds = [cut * frame_bytes for cut in cuts] + [len(pcm)]
+    return [
+        pcm[(max(0, start - overlap_bytes) if i else start):end]
+        for i, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
@@ -4,7 +4,30 @@ from django.conf import settings
 from django.http import JsonResponse
 from rest_framework_simplejwt.tokens import UntypedToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
 from .models import User
+from .revocation import revocation_set
+
+def validate_token(token):
+    """
+    Validate a JWT (signature, expiry) and check that it was not revoked.
+    Returns the token; raises TokenError otherwise.
+    """
+    validated = UntypedToken(token)
+    # Bloom filter first: tokens that were never revoked skip the blacklist tables
+    if revocation_set.is_revoked(validated.get(api_settings.JTI_CLAIM)):
+        raise TokenError('Token is blacklisted')
+    return validated
+
+class RevocationCheckingJWTAuthentication(JWTAuthentication):
+    """DRF JWT authentication that also rejects revoked tokens"""
+
+    def get_validated_token(self, raw_token):
+        validated = super().get_validated_token(raw_token)
+        if revocation_set.is_revoked(validated.get(api_settings.JTI_CLAIM)):
+            raise InvalidToken('Token is blacklisted')
+        return validated
 
 def jwt_required(f):
     """
@@ -31,8 +54,8 @@ def jwt_required(f):
         token = auth_header.split(' ')[1]
         
         try:
-            # Validate token using simple-jwt
-            UntypedToken(token)
+            # Validate token using simple-jwt and the revocation set
+            validate_token(token)
             
             # Decode token to get user information
             decoded_token = jwt.decode(
@@ -85,8 +108,8 @@ def get_user_from_token(token):
     Returns User object or None if invalid.
     """
     try:
-        # Validate token using simple-jwt
-        UntypedToken(token)
+        # Validate token using simple-jwt and the revocation set
+        validate_token(token)
         
         # Decode token to get user information
         decoded_token = jwt.decode(
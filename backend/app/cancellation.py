@@ -0,0 +1,51 @@
+import threading
+
+
+class UtteranceCancelled(Exception):
+    """Raised inside a worker thread when the utterance it serves was cancelled."""
+
+
+class CancelToken:
+    """
+    Thread-safe cancellation flag shared between a consumer and the worker
+    threads processing one utterance.
+
+    Blocking code checks the flag between steps with raise_if_cancelled(), and
+    can register callbacks (e.g. closing an open HTTP stream) that run as soon
+    as the utterance is cancelled so upstream requests are aborted.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """Mark the utterance as cancelled and run the registered callbacks once."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        """Register a callback; it runs immediately if already cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise UtteranceCancelled()
@@ -0,0 +1,209 @@
+import re
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from . import upstream
+
+logger = logging.getLogger(__name__)
+
+# Where recording forwards to when the process has no override configured
+DEFAULT_TARGETS = {
+    'groq': 'https://api.groq.com',
+    'openai': 'https://api.openai.com/v1',
+    'google': 'http://www.google.com/speech-api/v2/recognize',
+}
+
+_BOUNDARY = re.compile(rb'boundary=([^;\s]+)')
+
+
+def request_key(method, path, content_type, body):
+    """Stable key of a provider request: multipart boundaries are ignored and JSON is compared by content."""
+    if content_type.startswith('multipart/'):
+        match = _BOUNDARY.search(content_type.encode())
+        if match:
+            body = body.replace(match.group(1).strip(b'"'), b'BOUNDARY')
+    elif content_type.startswith('application/json') and body:
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True).encode()
+        except ValueError:
+            pass
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), body):
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+class Cassette:
+    """Recorded provider responses by request_key, stored as one JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.interactions = {}
+        self.missing = set()
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        cassette = cls(path)
+        with open(path) as f:
+            cassette.interactions = json.load(f)['interactions']
+        return cassette
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({'version': 1, 'interactions': self.interactions}, f, indent=1, sort_keys=True)
+
+    @property
+    def misses(self):
+        """Distinct requests that had no recording."""
+        return len(self.missing)
+
+    def get(self, key):
+        return self.interactions.get(key)
+
+    def put(self, key, interaction):
+        with self._lock:
+            self.interactions[key] = interaction
+            self.recorded += 1
+
+
+class CassetteServer:
+    """
+    Local HTTP server standing in for the Groq, OpenAI and Google speech
+    endpoints (under /groq, /openai and /google), installed in this process
+    with upstream.set_endpoints.
+
+    Replaying, it answers from the cassette and returns 502 for requests it
+    has no recording of; with replay_latency the recorded upstream time is
+    slept first. Recording, it forwards each request to the endpoint that
+    was configured before start() and stores the response.
+    """
+
+    def __init__(self, cassette, record=False, replay_latency=False):
+        self.cassette = cassette
+        self.record = record
+        self.replay_latency = replay_latency
+        self.targets = dict(DEFAULT_TARGETS)
+        self._server = None
+        self._thread = None
+        self._previous = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.targets.update({name: upstream.endpoint(name) for name in DEFAULT_TARGETS if upstream.endpoint(name)})
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server._handle(self)
+
+            def do_POST(self):
+                server._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='cassette-server', daemon=True)
+        self._thread.start()
+        self._previous = upstream.set_endpoints(**{name: f'{self.url}/{name}' for name in DEFAULT_TARGETS})
+
+    def stop(self):
+        if self._server is None:
+            return
+        upstream.set_endpoints(**self._previous)
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        if self.record:
+            self.cassette.save()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _forward(self, provider, rest, method, headers, body):
+        request = urllib.request.Request(
+            self.targets[provider].rstrip('/') + rest, data=body if method == 'POST' else None, method=method
+        )
+        for name in ('Content-Type', 'Authorization', 'Accept'):
+            if headers.get(name):
+                request.add_header(name, headers[name])
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=settings.UPSTREAM_TIMEOUT_SECONDS) as response:
+                status, content_type, payload = response.status, response.headers.get('Content-Type', ''), response.read()
+        except urllib.error.HTTPError as e:
+            status, content_type, payload = e.code, e.headers.get('Content-Type', ''), e.read()
+        return {
+            'status': status,
+            'content_type': content_type,
+            'body': base64.b64encode(payload).decode(),
+            'elapsed': round(time.perf_counter() - start, 4),
+        }
+
+    def _read_body(self, handler):
+        if handler.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(handler.rfile.readline().split(b';')[0], 16)
+                chunk = handler.rfile.read(size + 2)[:size]
+                if not size:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        length = int(handler.headers.get('Content-Length') or 0)
+        return handler.rfile.read(length) if length else b''
+
+    def _handle(self, handler):
+        url = urlsplit(handler.path)
+        provider, _, rest = url.path.lstrip('/').partition('/')
+        rest = ('/' + rest if rest else '') + (f'?{url.query}' if url.query else '')
+        body = self._read_body(handler)
+        content_type = handler.headers.get('Content-Type', '')
+        key = request_key(handler.command, handler.path, content_type, body)
+
+        interaction = self.cassette.get(key)
+        if interaction is None and self.record and provider in self.targets:
+            try:
+                interaction = self._forward(provider, rest, handler.command, handler.headers, body)
+                self.cassette.put(key, interaction)
+            except Exception as e:
+                logger.warning(f"Recording {handler.command} {handler.path} failed: {e}")
+        elif interaction is not None and self.replay_latency:
+            time.sleep(interaction['elapsed'])
+
+        if interaction is None:
+            self.cassette.missing.add(key)
+            payload = json.dumps({'error': f'no recording of {handler.command} {handler.path}'}).encode()
+            status, content_type = 502, 'application/json'
+        else:
+            payload = base64.b64decode(interaction['body'])
+            status, content_type = interaction['status'], interaction['content_type']
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
@@ -1,25 +1,45 @@
-import json
+import time
+import uuid
+import base64
+import binascii
+import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 import logging
 from urllib.parse import parse_qs
-from .models import User, Conversation
+from django.conf import settings
+from .models import Conversation
 from .stt import (
-    speech_to_text, 
-    generate_response,
     speech_to_text_google,
     generate_response_groq,
     generate_response_with_history
 )
 from .auth_utils import get_user_from_token
+from .cancellation import CancelToken, UtteranceCancelled
+from .persistence import conversation_writer
+from .retrieval import retrieve_relevant_turns
+from .speculation import Speculation
+from .metrics import metrics
+from .audio import AudioBufferFull
+from .formats import PcmFormat
+from .tts import text_to_speech
+from .scheduler import upstream_scheduler, SchedulerFull
+from .messages import negotiate_codec, DecodeError
+from .session import ConnectionSession, idle_reaper
+from .purge import user_group
 
 logger = logging.getLogger(__name__)
 
 class AudioConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.user = None
-        
+        # All per-connection state lives in one compact slotted object
+        self.session = ConnectionSession(
+            history_size=settings.RETRIEVAL_RECENT_TURNS,
+            stable_partials=settings.SPECULATIVE_STABLE_PARTIALS,
+            max_audio_bytes=settings.AUDIO_MAX_UTTERANCE_BYTES
+        )
+
     async def connect(self):
         """Accept WebSocket connection and authenticate user"""
         try:
@@ -30,22 +50,26 @@ class AudioConsumer(AsyncWebsocketConsumer):
             
             if token:
                 # Authenticate user with token
-                self.user = await self.get_user_from_token_async(token)
+                self.session.user = await self.get_user_from_token_async(token)
                 
-                if self.user:
-                    await self.accept()
-                    logger.info(f"WebSocket connection established for user: {self.user.email}")
+                if self.session.user:
+                    self.session.codec, subprotocol = negotiate_codec(self.scope)
+                    await self.accept(subprotocol=subprotocol)
+                    idle_reaper.register(self)
+                    await self.channel_layer.group_add(user_group(self.session.user.id), self.channel_name)
+                    logger.info(f"WebSocket connection established for user: {self.session.user.email}")
                     
                     # Send confirmation message
-                    await self.send(text_data=json.dumps({
+                    await self.send_message({
                         'type': 'connection_established',
                         'message': 'WebSocket connected successfully',
                         'user': {
-                            'id': self.user.id,
-                            'name': self.user.name,
-                            'email': self.user.email
-                        }
-                    }))
+                            'id': self.session.user.id,
+                            'name': self.session.user.name,
+                            'email': self.session.user.email
+                        },
+                        'format': self.session.codec.name
+                    })
                 else:
                     # Invalid token
                     await self.close(code=4001)
@@ -61,138 +85,485 @@ class AudioConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        idle_reaper.unregister(self)
+        if self.session.user:
+            await self.channel_layer.group_discard(user_group(self.session.user.id), self.channel_name)
+        if self.cancel_utterance():
+            logger.info("Cancelled in-flight utterance on disconnect")
+        self.cancel_speculation()
         logger.info(f"WebSocket disconnected with code: {close_code}")
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages"""
+        self.session.touch()
+        codec = self.session.codec
+        if bytes_data is not None and not codec.binary:
+            # Binary frames are raw audio chunks of the current utterance
+            try:
+                self.session.recording.append(bytes_data)
+            except AudioBufferFull:
+                await self.reject_oversized_audio()
+            return
+
         try:
-            data = json.loads(text_data)
+            data = codec.decode(text_data if bytes_data is None else bytes_data)
             message_type = data.get('type')
             
             if message_type == 'audio_data':
                 await self.handle_audio_data(data)
+            elif message_type == 'audio_chunk':
+                await self.handle_audio_chunk(data)
+            elif message_type == 'audio_end':
+                await self.handle_audio_end(data)
             elif message_type == 'start_recording':
                 await self.handle_start_recording()
             elif message_type == 'stop_recording':
                 await self.handle_stop_recording()
+            elif message_type == 'cancel':
+                await self.handle_cancel()
+            elif message_type == 'partial_transcript':
+                await self.handle_partial_transcript(data)
             else:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': f'Unknown message type: {message_type}'
-                }))
+                })
                 
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+        except DecodeError as e:
+            await self.send_message({
                 'type': 'error',
-                'message': 'Invalid JSON format'
-            }))
+                'message': str(e)
+            })
         except Exception as e:
             logger.error(f"Error handling message: {str(e)}")
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': f'Server error: {str(e)}'
-            }))
+            })
+
+    async def send_message(self, message):
+        """Encode a message with the connection's codec and send it"""
+        frame = self.session.codec.encode(message)
+        if self.session.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def send_static(self, name):
+        """Send one of the pre-encoded messages in app.messages.STATIC_MESSAGES"""
+        frame = self.session.codec.static(name)
+        if self.session.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
 
     async def handle_start_recording(self):
         """Handle start recording signal"""
-        await self.send(text_data=json.dumps({
-            'type': 'recording_started',
-            'message': 'Recording started successfully'
-        }))
+        await self.send_static('recording_started')
 
     async def handle_stop_recording(self):
         """Handle stop recording signal"""
-        await self.send(text_data=json.dumps({
-            'type': 'recording_stopped',
-            'message': 'Recording stopped successfully'
-        }))
+        await self.send_static('recording_stopped')
+
+    async def handle_cancel(self):
+        """Handle an explicit request to abort the in-flight utterance"""
+        cancelled = self.cancel_utterance()
+        self.cancel_speculation()
+        await self.send_static('utterance_cancelled' if cancelled else 'no_utterance')
+
+    def cancel_utterance(self):
+        """
+        Cancel the in-flight utterance, if any.
+        Returns True when there was something to cancel.
+        """
+        task, cancel_token = self.session.utterance_task, self.session.cancel_token
+        self.session.utterance_task = None
+        self.session.cancel_token = None
+
+        if cancel_token:
+            # Aborts upstream HTTP requests held by the worker thread
+            cancel_token.cancel()
+        if task and not task.done():
+            task.cancel()
+            return True
+        return False
+
+    async def handle_partial_transcript(self, data):
+        """
+        Handle an interim transcript from a streaming recognizer. With
+        SPECULATIVE_LLM enabled, a stable partial at a likely endpoint starts
+        the LLM request before the final transcript is known.
+        """
+        if not settings.SPECULATIVE_LLM or not self.session.user:
+            return
+
+        text = data.get('text') or ''
+        # The user kept talking: the running speculation answers the wrong question
+        if self.session.speculation and not self.session.speculation.matches(text):
+            self.discard_speculation()
+
+        ready = self.session.partials.update(
+            text,
+            stable=bool(data.get('stable')),
+            endpoint_likely=bool(data.get('endpoint_likely'))
+        )
+        if ready and not self.session.speculation:
+            cancel_token = CancelToken()
+            task = asyncio.create_task(self.speculate(text, cancel_token))
+            self.session.speculation = Speculation(text, task, cancel_token)
+            metrics.increment('speculation.started')
+
+    async def speculate(self, text, cancel_token):
+        """Generate the answer for a partial transcript"""
+        conversation_history = await self.get_conversation_history(text)
+        return await upstream_scheduler.run(
+            self.session.user, generate_response_with_history, text, conversation_history, cancel_token=cancel_token
+        )
+
+    async def take_speculative_response(self, user_text):
+        """
+        Return the speculative answer when it was started from the same text
+        as the final transcript, otherwise cancel it and return None.
+        """
+        speculation, self.session.speculation = self.session.speculation, None
+        self.session.partials.reset()
+        if speculation is None:
+            return None
+
+        if not speculation.matches(user_text):
+            speculation.cancel()
+            self.record_speculation_outcome(hit=False)
+            return None
+
+        final_ready_at = time.monotonic()
+        try:
+            llm_response = await speculation.task
+        except asyncio.CancelledError:
+            speculation.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Speculative response failed: {e}")
+            self.record_speculation_outcome(hit=False)
+            return None
+
+        self.record_speculation_outcome(hit=True)
+        metrics.observe('speculation.latency_saved_seconds', speculation.latency_saved(final_ready_at))
+        return llm_response
+
+    def discard_speculation(self):
+        """Cancel a speculation whose partial transcript diverged"""
+        if self.session.speculation:
+            self.session.speculation.cancel()
+            self.session.speculation = None
+            self.record_speculation_outcome(hit=False)
+
+    def cancel_speculation(self):
+        """Cancel the speculation without counting it (user cancelled or left)"""
+        if self.session.speculation:
+            self.session.speculation.cancel()
+            self.session.speculation = None
+            metrics.increment('speculation.cancelled')
+        self.session.partials.reset()
+
+    def record_speculation_outcome(self, hit):
+        metrics.increment('speculation.hits' if hit else 'speculation.misses')
+        hits = metrics.counter('speculation.hits')
+        total = hits + metrics.counter('speculation.misses')
+        metrics.set_gauge('speculation.hit_rate', round(hits / total, 4))
 
     async def handle_audio_data(self, data):
-        """Process audio data and convert to text"""
+        """Handle a complete utterance sent as one base64 message"""
+        audio_data = data.get('audio_data')
+        if not audio_data:
+            await self.send_static('no_audio_data')
+            return
+
+        self.session.recording.clear()
+        if await self.append_base64_chunk(audio_data):
+            await self.start_utterance(data)
+
+    async def handle_audio_chunk(self, data):
+        """Append a base64 audio chunk of the current utterance"""
+        await self.append_base64_chunk(data.get('audio_data') or '')
+
+    async def handle_audio_end(self, data):
+        """The chunks received so far (JSON or binary) form a complete utterance"""
+        if not len(self.session.recording):
+            await self.send_static('no_audio_data')
+            return
+
+        await self.start_utterance(data)
+
+    async def append_base64_chunk(self, audio_data):
         try:
-            audio_data = data.get('audio_data')
-            if not audio_data:
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': 'No audio data provided'
-                }))
-                return
+            if isinstance(audio_data, (bytes, bytearray)):
+                # Binary formats (msgpack) carry the audio as raw bytes
+                self.session.recording.append(audio_data)
+            else:
+                self.session.recording.append_base64(audio_data)
+            return True
+        except AudioBufferFull:
+            await self.reject_oversized_audio()
+            return False
+        except binascii.Error:
+            self.session.recording.clear()
+            await self.send_static('invalid_base64')
+            return False
+
+    async def reject_oversized_audio(self):
+        """Drop an utterance that grew past AUDIO_MAX_UTTERANCE_BYTES"""
+        self.session.recording.clear()
+        await self.send_static('audio_too_large')
+
+    async def start_utterance(self, data):
+        """Start processing the recorded audio, superseding any in-flight utterance"""
+        # Barge-in: the user spoke again, so the previous answer is no longer wanted
+        if self.cancel_utterance():
+            logger.info("Previous utterance superseded by new audio")
+
+        # Hand the recorded audio to the pipeline and record into the other buffer
+        audio_buffer = self.session.swap_buffers()
 
+        self.session.cancel_token = CancelToken()
+        self.session.utterance_task = asyncio.create_task(
+            self.process_utterance(audio_buffer, data, self.session.cancel_token, PcmFormat.from_message(data))
+        )
+
+    async def process_utterance(self, audio_buffer, data, cancel_token, pcm_format=None):
+        """Process audio data and convert to text"""
+        try:
             # Convert audio to text
-            user_text, llm_response = await self.convert_audio_to_text(audio_data)
+            user_text, llm_response = await self.convert_audio_to_text(audio_buffer, cancel_token, pcm_format)
             
             if user_text:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'transcription',
                     'text': user_text,
                     'llm_response': llm_response,
                     'timestamp': data.get('timestamp')
-                }))
+                })
+                # Persist after the reply has gone out
+                self.record_turn(user_text, llm_response)
+                if llm_response and data.get('tts', settings.TTS_ENABLED):
+                    await self.send_speech(llm_response, data, cancel_token)
             else:
-                await self.send(text_data=json.dumps({
-                    'type': 'transcription',
-                    'text': '',
-                    'llm_response': '',
-                    'message': 'No speech detected in audio'
-                }))
-                
+                await self.send_static('no_speech')
+
+        except UtteranceCancelled:
+            logger.info("Utterance cancelled before completion")
         except Exception as e:
             logger.error(f"Error processing audio: {str(e)}")
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': f'Error processing audio: {str(e)}'
-            }))
+            })
+        finally:
+            # The idle timer starts when the reply has gone out
+            self.session.touch()
+            if self.session.cancel_token is cancel_token:
+                self.session.utterance_task = None
+                self.session.cancel_token = None
+
+    async def send_speech(self, text, data, cancel_token):
+        """
+        Stream the spoken answer as tts_audio chunks. Answers spoken before
+        come from the TTS cache and start streaming without synthesis.
+        """
+        try:
+            audio, audio_format, cached = await upstream_scheduler.run(self.session.user, text_to_speech, text)
+        except Exception as e:
+            logger.error(f"Error synthesizing speech: {e}")
+            await self.send_message({'type': 'error', 'message': f'Error synthesizing speech: {e}'})
+            return
+
+        audio = memoryview(audio)
+        chunk_bytes = settings.TTS_STREAM_CHUNK_BYTES
+        chunks = max(1, -(-len(audio) // chunk_bytes))
+        for seq in range(chunks):
+            # Barge-in stops the answer mid-stream
+            cancel_token.raise_if_cancelled()
+            chunk = audio[seq * chunk_bytes:(seq + 1) * chunk_bytes]
+            await self.send_message({
+                'type': 'tts_audio',
+                'format': audio_format,
+                'seq': seq,
+                'final': seq == chunks - 1,
+                'cached': cached,
+                # Binary formats (msgpack) carry the audio as raw bytes
+                'audio_data': bytes(chunk) if self.session.codec.binary else base64.b64encode(chunk).decode(),
+                'timestamp': data.get('timestamp')
+            })
 
     @database_sync_to_async
     def get_user_from_token_async(self, token):
         """Async wrapper for token authentication"""
         return get_user_from_token(token)
     
+    async def get_conversation_history(self, user_text):
+        """
+        Build the LLM context: past turns most relevant to user_text
+        followed by the latest few turns of the conversation
+        """
+        if self.session.history is None:
+            self.session.load_history(await self.load_conversation_history())
+        recent_turns = list(self.session.history)
+
+        try:
+            relevant_turns = await database_sync_to_async(retrieve_relevant_turns, thread_sensitive=False)(
+                self.session.user, user_text, exclude=recent_turns
+            )
+        except Exception as e:
+            # Retrieval is an enhancement; fall back to the recent window
+            logger.error(f"Error retrieving relevant turns: {e}")
+            relevant_turns = []
+
+        return relevant_turns + recent_turns
+
     @database_sync_to_async
-    def convert_audio_to_text(self, audio_data):
-        """Convert base64 audio data to text using speech recognition"""
+    def load_conversation_history(self):
+        """Load the most recent conversations of the user from the database"""
+        recent_conversations = Conversation.objects.visible_to(
+            self.session.user
+        ).defer('embedding').order_by('-created_at')[:settings.RETRIEVAL_RECENT_TURNS]
+
+        # Convert to list format for the LLM function
+        return [{
+            'user_text': conv.user_text,
+            'llm_response': conv.llm_response
+        } for conv in reversed(recent_conversations)]
+
+    def record_turn(self, user_text, llm_response):
+        """Queue the conversation for the background writer and update local history"""
+        if not self.session.user:
+            # No authenticated user - this shouldn't happen with required auth
+            logger.warning("No authenticated user for conversation")
+            return
+
+        if self.session.history is not None:
+            self.session.history.append({
+                'user_text': user_text,
+                'llm_response': llm_response
+            })
+        conversation_writer.enqueue(self.session.user, user_text, llm_response)
+        logger.debug(f"Conversation queued for user {self.session.user.email}")
+
+    async def transcribe(self, audio_buffer, cancel_token, pcm_format=None):
+        """Transcribe on the inference tier when offloading is enabled, otherwise in this process"""
+        if settings.INFERENCE_OFFLOAD:
+            return await self.transcribe_remote(audio_buffer, cancel_token, pcm_format)
+        return await upstream_scheduler.run(
+            self.session.user, self.transcribe_buffer, audio_buffer, cancel_token, pcm_format
+        )
+
+    async def transcribe_remote(self, audio_buffer, cancel_token, pcm_format=None):
+        """
+        Send the utterance to the inference workers over the channel layer and
+        wait for the transcript to come back on this socket's channel.
+        """
+        # The channel layer serializes the message, so the audio is copied once here
+        with audio_buffer.reading() as audio_view:
+            audio = bytes(audio_view)
+
+        utterance_id = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.session.pending_inference is None:
+            self.session.pending_inference = {}
+        self.session.pending_inference[utterance_id] = future
+        cancel_token.on_cancel(lambda: loop.call_soon_threadsafe(future.cancel))
+
+        try:
+            await self.channel_layer.send(settings.INFERENCE_CHANNEL, {
+                'type': 'transcribe.utterance',
+                'utterance_id': utterance_id,
+                'reply_channel': self.channel_name,
+                'audio': audio,
+                'pcm_format': pcm_format.as_dict() if pcm_format else None,
+                'deadline': time.time() + settings.INFERENCE_TIMEOUT_SECONDS,
+            })
+            metrics.increment('inference.dispatched')
+            reply = await asyncio.wait_for(future, settings.INFERENCE_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            if cancel_token.cancelled:
+                raise UtteranceCancelled()
+            raise
+        except asyncio.TimeoutError:
+            metrics.increment('inference.timeouts')
+            raise RuntimeError('Inference workers did not answer in time')
+        finally:
+            self.session.pending_inference.pop(utterance_id, None)
+
+        if reply.get('error'):
+            raise RuntimeError(reply['error'])
+        return reply['text']
+
+    async def inference_transcript(self, event):
+        """Transcript from an inference worker (channel layer message)"""
+        pending = self.session.pending_inference or {}
+        future = pending.get(event['utterance_id'])
+        if future is None or future.done():
+            # Late answer for an utterance that was cancelled or timed out
+            metrics.increment('inference.late_replies')
+            return
+        future.set_result(event)
+
+    async def conversations_cleared(self, event):
+        """The user cleared their conversations (channel layer message from app.purge)"""
+        if self.session.user:
+            self.session.user.conversations_cleared_through = event['through_id']
+        # Reloaded, without the cleared turns, on the next utterance
+        self.session.history = None
+
+    @staticmethod
+    def transcribe_buffer(audio_buffer, cancel_token, pcm_format=None):
+        """Run speech recognition on a read-only view of the buffer (no copy)"""
+        with audio_buffer.reading() as audio_view:
+            return speech_to_text_google(audio_view, cancel_token=cancel_token, pcm_format=pcm_format)
+
+    async def convert_audio_to_text(self, audio_buffer, cancel_token, pcm_format=None):
+        """
+        Convert the recorded audio to text using speech recognition.
+
+        Upstream calls run on the fair-share scheduler's slots, outside the
+        shared database thread, so that a cancelled utterance frees the
+        consumer immediately; the worker thread stops at its next
+        cancellation check.
+        """
         try:
             # Use the speech_to_text_google function which now handles WebM conversion
-            user_text = speech_to_text_google(audio_data)
-            print("Speech to Text: ", user_text)
+            user_text = await self.transcribe(audio_buffer, cancel_token, pcm_format)
+            cancel_token.raise_if_cancelled()
+            logger.debug(f"Speech to Text: {user_text}")
 
             # Get conversation history for authenticated users
             conversation_history = []
-            if self.user:
-                # Get recent conversations for context (last 10)
-                recent_conversations = Conversation.objects.filter(
-                    user=self.user
-                ).order_by('-created_at')[:10]
-                
-                # Convert to list format for the LLM function
-                conversation_history = [{
-                    'user_text': conv.user_text,
-                    'llm_response': conv.llm_response
-                } for conv in reversed(recent_conversations)]
-                
-                # Generate response with conversation history context
-                llm_response = generate_response_with_history(user_text, conversation_history)
-                print(f"Response with history for user {self.user.email}: ", llm_response)
+            if self.session.user:
+                # Reuse the answer speculated from the partial transcript when it matches
+                llm_response = await self.take_speculative_response(user_text)
+
+                if llm_response is None:
+                    conversation_history = await self.get_conversation_history(user_text)
+
+                    # Generate response with conversation history context
+                    llm_response = await upstream_scheduler.run(
+                        self.session.user, generate_response_with_history,
+                        user_text, conversation_history, cancel_token=cancel_token
+                    )
+                logger.debug(f"Response with history for user {self.session.user.email}: {llm_response}")
             else:
                 # For anonymous users, use simple response without history
-                llm_response = generate_response_groq(user_text)
-                print("Response (anonymous): ", llm_response)
-
-            # Save the conversation to the database with authenticated user
-            conversation = None
-            if self.user:
-                conversation = Conversation.objects.create(
-                    user=self.user, 
-                    user_text=user_text, 
-                    llm_response=llm_response
+                llm_response = await upstream_scheduler.run(
+                    self.session.user, generate_response_groq, user_text, cancel_token=cancel_token
                 )
-                print(f"Conversation saved for user {self.user.email}: ", conversation)
-            else:
-                # No authenticated user - this shouldn't happen with required auth
-                print("Warning: No authenticated user for conversation")
-            
+                logger.debug(f"Response (anonymous): {llm_response}")
+
+            # Nothing is persisted for an utterance that was cancelled mid-flight
+            cancel_token.raise_if_cancelled()
+
             return user_text, llm_response
-                
+
+        except (UtteranceCancelled, SchedulerFull):
+            raise
         except Exception as e:
             logger.error(f"Error in speech to text conversion: {e}")
             return "", ""
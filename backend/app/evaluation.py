@@ -0,0 +1,155 @@
+import os
+import re
+import time
+import logging
+import tracemalloc
+from dataclasses import dataclass
+from .audio import decode_audio
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {'.wav', '.webm', '.ogg', '.m4a', '.mp4', '.mp3', '.flac', '.aac'}
+
+
+@dataclass
+class Fixture:
+    """One corpus recording: the audio bytes, its reference transcript and its length in seconds."""
+    name: str
+    audio: bytes
+    reference: str
+    duration: float = None
+
+
+def normalize_words(text):
+    """Lowercased words without punctuation, as WER is scored on."""
+    return re.findall(r"[\w']+", (text or '').lower())
+
+
+def word_errors(reference, hypothesis):
+    """Word-level edit distance (substitutions + deletions + insertions) and the reference word count."""
+    ref, hyp = normalize_words(reference), normalize_words(hypothesis)
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word)
+            ))
+        previous = current
+    return previous[-1], len(ref)
+
+
+def audio_duration(audio):
+    """Length of a recording in seconds, or None if it cannot be decoded here."""
+    try:
+        pcm, sample_width, channels, frame_rate = decode_audio(audio)
+    except Exception as e:
+        logger.warning(f"Could not decode fixture for its duration: {e}")
+        return None
+    return len(pcm) / (sample_width * channels * frame_rate)
+
+
+def load_corpus(directory):
+    """
+    Fixtures of a corpus directory: every audio file with a reference
+    transcript next to it under the same name with a .txt extension.
+    """
+    fixtures = []
+    for entry in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(entry)
+        reference_path = os.path.join(directory, stem + '.txt')
+        if extension.lower() not in AUDIO_EXTENSIONS or not os.path.exists(reference_path):
+            continue
+        with open(os.path.join(directory, entry), 'rb') as f:
+            audio = f.read()
+        with open(reference_path) as f:
+            reference = f.read().strip()
+        fixtures.append(Fixture(entry, audio, reference, audio_duration(audio)))
+    return fixtures
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def evaluate_engine(name, kind, call, fixtures, repeat=1, warm=True, measure_memory=True):
+    """
+    Run every fixture through call repeat times and summarize the run.
+
+    kind 'stt' calls call(audio) and scores the transcript against the
+    reference (corpus WER: all edits over all reference words) and against
+    the audio length (real-time factor: processing time over audio time).
+    kind 'llm' calls call(reference) and only measures latency. With warm,
+    the first fixture is run once untimed so client setup is not measured.
+
+    Peak memory is what tracemalloc sees allocated by Python in one more,
+    untimed call with the largest fixture, since tracing slows the calls
+    down (and, live, every call is a paid request).
+    """
+    def run(fixture):
+        return call(fixture.audio if kind == 'stt' else fixture.reference)
+
+    latencies = []
+    edits = words = 0
+    audio_seconds = processing_seconds = 0.0
+    failures = []
+
+    if warm and fixtures:
+        try:
+            run(fixtures[0])
+        except Exception:
+            pass
+
+    for fixture in fixtures:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                output = run(fixture)
+            except Exception as e:
+                failures.append({'fixture': fixture.name, 'error': f'{type(e).__name__}: {e}'})
+                continue
+            elapsed = time.perf_counter() - start
+            latencies.append(elapsed)
+            if kind != 'stt':
+                continue
+            fixture_edits, fixture_words = word_errors(fixture.reference, output)
+            edits += fixture_edits
+            words += fixture_words
+            if fixture.duration:
+                audio_seconds += fixture.duration
+                processing_seconds += elapsed
+
+    peak = None
+    if measure_memory and fixtures:
+        largest = max(fixtures, key=lambda fixture: len(fixture.audio if kind == 'stt' else fixture.reference))
+        tracemalloc.start()
+        try:
+            try:
+                run(largest)
+            except Exception:
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    for elapsed in latencies:
+        metrics.observe(f'bench.{name}.seconds', elapsed)
+
+    return {
+        'engine': name,
+        'kind': kind,
+        'runs': len(latencies) + len(failures),
+        'errors': len(failures),
+        'wer': round(edits / words, 4) if kind == 'stt' and words else None,
+        'rtf': round(processing_seconds / audio_seconds, 4) if audio_seconds else None,
+        'latency_ms': {
+            label: round(percentile(latencies, pct) * 1000, 1)
+            for label, pct in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+        } if latencies else None,
+        'peak_memory_mib': round(peak / 2 ** 20, 2) if peak is not None else None,
+        'failures': failures,
+    }
@@ -0,0 +1,107 @@
+import struct
+from .metrics import metrics
+
+# Container/codec formats recognized by sniff_format: file extension and
+# ffmpeg demuxer of each
+FORMATS = {
+    'wav': ('wav', 'wav'),
+    'webm': ('webm', 'matroska'),
+    'ogg': ('ogg', 'ogg'),
+    'mp4': ('m4a', 'mp4'),
+    'mp3': ('mp3', 'mp3'),
+    'flac': ('flac', 'flac'),
+    'aac': ('aac', 'aac'),
+    # Headerless 16-bit little-endian PCM, declared by the client
+    'pcm': ('pcm', 's16le'),
+}
+
+# What each STT engine takes as is. Whisper accepts these uploads directly
+# (with the right file extension); Google Web Speech is fed PCM through
+# speech_recognition, which WAV and raw PCM provide without decoding.
+ENGINE_INPUTS = {
+    'whisper': {'wav', 'webm', 'ogg', 'mp4', 'mp3', 'flac'},
+    'google': {'wav', 'pcm'},
+}
+
+
+class PcmFormat:
+    """Parameters of headerless 16-bit PCM announced by a client."""
+
+    __slots__ = ('sample_rate', 'channels')
+
+    def __init__(self, sample_rate=16000, channels=1):
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+
+    @classmethod
+    def from_message(cls, data):
+        """The PCM format declared in an audio message ('format': 'pcm_s16le'), or None."""
+        if (data.get('format') or '').lower() not in ('pcm', 'pcm_s16le'):
+            return None
+        return cls(data.get('sample_rate') or 16000, data.get('channels') or 1)
+
+    def as_dict(self):
+        return {'format': 'pcm_s16le', 'sample_rate': self.sample_rate, 'channels': self.channels}
+
+
+def sniff_format(view):
+    """
+    Identify the container of an audio payload from its leading bytes.
+    Returns a key of FORMATS, or None when unknown.
+    """
+    head = bytes(memoryview(view)[:12])
+    if len(head) < 4:
+        return None
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        # EBML header: WebM / Matroska
+        return 'webm'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[4:8] == b'ftyp':
+        return 'mp4'
+    if head[:3] == b'ID3':
+        return 'mp3'
+    if head[0] == 0xFF:
+        # MPEG audio frame sync: layer bits 00 are AAC (ADTS), 01 is MP3
+        layer = (head[1] >> 1) & 0x03
+        if head[1] & 0xE0 == 0xE0 and layer == 0 and head[1] & 0xF0 == 0xF0:
+            return 'aac'
+        if head[1] & 0xE0 == 0xE0 and layer == 1:
+            return 'mp3'
+    return None
+
+
+def wav_header(data_size, sample_rate, channels, sample_width=2):
+    """44-byte RIFF header for PCM data of data_size bytes."""
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, byte_rate, channels * sample_width, sample_width * 8,
+        b'data', data_size
+    )
+
+
+def input_format(view, pcm_format=None):
+    """The format of a payload: declared raw PCM, else sniffed from its bytes."""
+    fmt = 'pcm' if pcm_format is not None else sniff_format(view)
+    metrics.increment(f'audio.input_format.{fmt or "unknown"}')
+    return fmt
+
+
+def plan_conversion(fmt, engine):
+    """
+    Cheapest way to give input of format fmt to engine:
+      'passthrough' - the engine takes it as is
+      'wrap'        - raw PCM only needs a WAV header (no decoding)
+      'transcode'   - decode/re-encode with ffmpeg
+    """
+    if fmt in ENGINE_INPUTS[engine]:
+        return 'passthrough'
+    if fmt == 'pcm':
+        return 'wrap'
+    return 'transcode'
@@ -0,0 +1,190 @@
+import math
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .cancellation import CancelToken, UtteranceCancelled
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Provider:
+    """
+    An LLM backend the router can send a request to.
+
+    complete is called as complete(messages, cancel_token=token) and returns
+    the answer text. It must stop early (raising UtteranceCancelled) once the
+    token is cancelled, which is how hedged losers are aborted.
+    """
+
+    def __init__(self, name, complete):
+        self.name = name
+        self.complete = complete
+
+
+class ProviderStats:
+    """Rolling latency/error EWMA and a latency window for p95 of one provider."""
+
+    def __init__(self, alpha=0.2, window=100, reprobe_after=30.0):
+        self.alpha = alpha
+        self.reprobe_after = reprobe_after
+        self.last_sample_at = None
+        self.latency = None
+        self.error_rate = 0.0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_success(self, seconds):
+        with self._lock:
+            self.latency = seconds if self.latency is None else self.alpha * seconds + (1 - self.alpha) * self.latency
+            self.error_rate = (1 - self.alpha) * self.error_rate
+            self.recent.append(seconds)
+            self.last_sample_at = time.monotonic()
+
+    def record_error(self):
+        with self._lock:
+            self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+            self.last_sample_at = time.monotonic()
+
+    def score(self, error_penalty):
+        """
+        Expected cost of a request. Providers without samples, or whose last
+        sample is older than reprobe_after, go first so a provider that was
+        slow once gets measured again instead of being avoided forever.
+        """
+        with self._lock:
+            if self.last_sample_at is None or time.monotonic() - self.last_sample_at > self.reprobe_after:
+                return 0.0
+            if self.latency is None:
+                # Has only ever failed: last until it is due for a reprobe
+                return math.inf
+            return self.latency * (1 + error_penalty * self.error_rate)
+
+    def p95(self):
+        with self._lock:
+            if len(self.recent) < 10:
+                return None
+            values = sorted(self.recent)
+            return values[int(math.ceil(0.95 * len(values))) - 1]
+
+
+class LLMRouter:
+    """
+    Latency-aware router over several LLM providers.
+
+    Each request goes to the provider with the lowest latency EWMA (inflated
+    by its error EWMA). If it fails, the next provider is tried. With hedging
+    enabled, a second request is fired at the next provider once the first
+    has taken longer than its own p95, and whichever answers first wins; the
+    other one is cancelled.
+    """
+
+    def __init__(self, providers, hedge=False, hedge_min_delay=1.0, error_penalty=4.0, alpha=0.2,
+                 reprobe_after=30.0, max_workers=32):
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider")
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.error_penalty = error_penalty
+        self.stats = {
+            provider.name: ProviderStats(alpha=alpha, reprobe_after=reprobe_after)
+            for provider in self.providers
+        }
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-router')
+
+    def ranked(self):
+        """Providers ordered from currently fastest to slowest."""
+        return sorted(self.providers, key=lambda provider: self.stats[provider.name].score(self.error_penalty))
+
+    def hedge_delay(self, provider):
+        p95 = self.stats[provider.name].p95()
+        return max(self.hedge_min_delay, p95) if p95 is not None else self.hedge_min_delay
+
+    def complete(self, messages, cancel_token=None):
+        """Return the first successful answer for messages."""
+        order = self.ranked()
+        attempts = {}
+        next_index = 0
+        last_error = None
+        hedge_at = None
+        hedged = None
+
+        def launch():
+            nonlocal next_index
+            provider = order[next_index]
+            next_index += 1
+            attempt_token = CancelToken()
+            if cancel_token is not None:
+                cancel_token.on_cancel(attempt_token.cancel)
+            future = self._executor.submit(self._attempt, provider, messages, attempt_token)
+            attempts[future] = (provider, attempt_token)
+            return provider
+
+        primary = launch()
+        if self.hedge and next_index < len(order):
+            hedge_at = time.monotonic() + self.hedge_delay(primary)
+
+        try:
+            while attempts:
+                timeout = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+                done, _ = wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    # The primary is slower than usual: race it against the next provider
+                    hedge_at = None
+                    hedged = launch()
+                    metrics.increment('llm.hedges')
+                    logger.info(f"Hedging {primary.name} with {hedged.name}")
+                    continue
+
+                for future in done:
+                    provider, _ = attempts.pop(future)
+                    try:
+                        answer = future.result()
+                    except UtteranceCancelled:
+                        if cancel_token is not None and cancel_token.cancelled:
+                            raise
+                        continue
+                    except Exception as e:
+                        last_error = e
+                        logger.warning(f"LLM provider {provider.name} failed: {e}")
+                        if not attempts and next_index < len(order):
+                            hedge_at = None
+                            failover = launch()
+                            metrics.increment('llm.failovers')
+                            logger.info(f"Failing over from {provider.name} to {failover.name}")
+                        continue
+
+                    if provider is hedged:
+                        metrics.increment('llm.hedge_wins')
+                    return answer
+        finally:
+            # Abort whatever is still running (hedged losers)
+            for _, attempt_token in attempts.values():
+                attempt_token.cancel()
+
+        if cancel_token is not None and cancel_token.cancelled:
+            raise UtteranceCancelled()
+        raise last_error or RuntimeError("No LLM provider produced an answer")
+
+    def _attempt(self, provider, messages, cancel_token):
+        stats = self.stats[provider.name]
+        metrics.increment(f'llm.requests.{provider.name}')
+        start = time.monotonic()
+        try:
+            answer = provider.complete(messages, cancel_token=cancel_token)
+        except UtteranceCancelled:
+            raise
+        except Exception:
+            stats.record_error()
+            metrics.increment(f'llm.errors.{provider.name}')
+            raise
+
+        elapsed = time.monotonic() - start
+        stats.record_success(elapsed)
+        metrics.observe(f'llm.latency_seconds.{provider.name}', elapsed)
+        metrics.set_gauge(f'llm.ewma_latency_seconds.{provider.name}', round(stats.latency, 4))
+        return answer
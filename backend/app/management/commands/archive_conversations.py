@@ -0,0 +1,27 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from app.archive import archive_conversations
+
+
+class Command(BaseCommand):
+    help = "Move old conversations into compressed per-user-month archive segments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--vacuum', action='store_true',
+            help="Run VACUUM afterwards so SQLite returns the freed pages to the filesystem"
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        archived = archive_conversations(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(f"Archived {archived} conversation turns created before {cutoff:%Y-%m-%d}")
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
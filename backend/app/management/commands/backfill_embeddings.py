@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.retrieval import backfill_embeddings
+
+
+class Command(BaseCommand):
+    help = (
+        "Embed the stored conversations that have no embedding of the configured "
+        "engine and dimension (e.g. after changing EMBEDDING_ENGINE), then exit"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMBEDDING_BATCH_SIZE)
+        parser.add_argument('--user', type=int, help="Only this user's conversations")
+
+    def handle(self, *args, **options):
+        done = backfill_embeddings(options['user'], batch_size=options['batch_size'])
+        self.stdout.write(f"Embedded {done} conversations")
@@ -0,0 +1,145 @@
+import os
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from app import upstream
+from app.cassette import Cassette, CassetteServer
+from app.evaluation import load_corpus, evaluate_engine
+from app.stt import LLM_PROVIDERS, warm_up
+from app.transcription import ENGINES
+
+
+def _engine_call(name):
+    if name in ENGINES:
+        return 'stt', lambda audio: ENGINES[name](audio, None)
+    complete = LLM_PROVIDERS[name][0]
+    return 'llm', lambda text: complete([{'role': 'user', 'content': text}])
+
+
+def _cell(value, scale=1, digits=3):
+    return '-' if value is None else f'{value * scale:.{digits}f}'
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a corpus of audio fixtures (audio files with a .txt reference transcript "
+        "next to them) through STT and LLM engines and report WER, real-time factor, "
+        "latency percentiles and peak memory"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help="Directory of audio fixtures and their .txt references")
+        parser.add_argument(
+            '--engines', default=','.join(ENGINES),
+            help=f"Comma separated engines: STT {', '.join(ENGINES)}; LLM {', '.join(LLM_PROVIDERS)} "
+                 "(prompted with the reference transcripts, latency only)"
+        )
+        parser.add_argument('--repeat', type=int, default=1, help="Runs per fixture and engine")
+        parser.add_argument(
+            '--cassette',
+            help="Recorded provider responses: replayed without network, or written with --record"
+        )
+        parser.add_argument('--record', action='store_true', help="Call the real providers and record their responses")
+        parser.add_argument(
+            '--replay-latency', action='store_true',
+            help="Wait the recorded upstream time before each replayed response"
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help="Do not warm the engines up before timing, so the first call pays for imports and client setup"
+        )
+        parser.add_argument('--json', dest='json_path', help="Also write the results as JSON to this file ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['engines'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in ENGINES and name not in LLM_PROVIDERS]
+        if unknown:
+            raise CommandError(f"Unknown engines: {', '.join(unknown)}")
+        if options['record'] and not options['cassette']:
+            raise CommandError("--record needs --cassette")
+
+        if not os.path.isdir(options['corpus']):
+            raise CommandError(f"{options['corpus']} is not a directory")
+        fixtures = load_corpus(options['corpus'])
+        if not fixtures:
+            raise CommandError(f"No audio fixtures with a .txt reference in {options['corpus']}")
+
+        server = None
+        if options['cassette']:
+            if options['record']:
+                cassette = Cassette.load(options['cassette']) if os.path.exists(options['cassette']) else Cassette(options['cassette'])
+            else:
+                if not os.path.exists(options['cassette']):
+                    raise CommandError(f"Cassette {options['cassette']} does not exist, record it with --record")
+                cassette = Cassette.load(options['cassette'])
+                # The SDK clients refuse to start without a key; the replay server ignores it
+                for _, key_setting in LLM_PROVIDERS.values():
+                    os.environ.setdefault(key_setting, 'replay')
+            server = CassetteServer(cassette, record=options['record'], replay_latency=options['replay_latency'])
+            server.start()
+
+        # SDK retries would send a missing recording (or a failed call) several
+        # times and count each attempt; bench clients are built without them
+        no_retries = override_settings(UPSTREAM_MAX_RETRIES=0)
+        no_retries.enable()
+        upstream.set_endpoints()
+        try:
+            # Imports and client setup would otherwise land in the first call's latency and peak memory
+            warm_up_seconds = {} if options['cold'] else warm_up(names)
+            results = [
+                evaluate_engine(name, *_engine_call(name), fixtures, repeat=options['repeat'], warm=not options['cold'])
+                for name in names
+            ]
+        finally:
+            if server is not None:
+                server.stop()
+            no_retries.disable()
+            upstream.set_endpoints()
+
+        report = {
+            'corpus': options['corpus'],
+            'fixtures': len(fixtures),
+            'audio_seconds': round(sum(fixture.duration or 0 for fixture in fixtures), 2),
+            'mode': 'live' if server is None else ('record' if options['record'] else 'replay'),
+            'warm_up_seconds': {name: round(seconds, 3) for name, seconds in warm_up_seconds.items()},
+            'results': results,
+        }
+        if server is not None:
+            report['cassette'] = {
+                'path': options['cassette'],
+                'recorded': cassette.recorded,
+                'misses': cassette.misses,
+            }
+
+        self._write_table(report)
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def _write_table(self, report):
+        self.stdout.write(
+            f"{report['fixtures']} fixtures, {report['audio_seconds']} s of audio, {report['mode']} mode"
+        )
+        header = f"{'engine':<10} {'kind':<4} {'runs':>5} {'errors':>6} {'WER':>7} {'RTF':>7} " \
+                 f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'peak MiB':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in report['results']:
+            latency = result['latency_ms'] or {}
+            self.stdout.write(
+                f"{result['engine']:<10} {result['kind']:<4} {result['runs']:>5} {result['errors']:>6} "
+                f"{_cell(result['wer']):>7} {_cell(result['rtf']):>7} "
+                + ' '.join(f"{_cell(latency.get(label), digits=1):>9}" for label in ('p50', 'p95', 'p99', 'max'))
+                + f" {_cell(result['peak_memory_mib'], digits=2):>9}"
+            )
+            for failure in result['failures'][:3]:
+                self.stderr.write(f"  {result['engine']} {failure['fixture']}: {failure['error']}")
+
+        cassette = report.get('cassette')
+        if cassette and cassette['misses']:
+            self.stderr.write(
+                f"{cassette['misses']} requests had no recording in {cassette['path']}; "
+                "record them with --record"
+            )
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.revocation import prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired tokens from the JWT outstanding and blacklist tables in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.TOKEN_PRUNE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = prune_expired_tokens(options['batch_size'])
+        self.stdout.write(f"Deleted {deleted} expired tokens")
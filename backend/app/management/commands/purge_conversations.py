@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.purge import ConversationPurger
+
+
+class Command(BaseCommand):
+    help = "Delete the conversations of pending clears in batches, then exit"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.PURGE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=settings.PURGE_BATCH_PAUSE_SECONDS)
+
+    def handle(self, *args, **options):
+        purger = ConversationPurger(batch_size=options['batch_size'], pause=options['pause'])
+        done = purger.run_pending()
+        self.stdout.write(f"Completed {done} conversation purges")
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.transcription import TranscriptionWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Process queued batch transcription jobs until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.TRANSCRIPTION_WORKERS)
+
+    def handle(self, *args, **options):
+        pool = TranscriptionWorkerPool(
+            workers=options['workers'],
+            poll_interval=settings.TRANSCRIPTION_POLL_INTERVAL,
+            max_attempts=settings.TRANSCRIPTION_MAX_ATTEMPTS
+        )
+        self.stdout.write(f"Processing transcription jobs with {options['workers']} workers")
+        pool.run_forever()
@@ -0,0 +1,11 @@
+from django.conf import settings
+from channels.management.commands.runworker import Command as ChannelsRunWorkerCommand
+
+
+class Command(ChannelsRunWorkerCommand):
+    """channels' runworker, run as a worker process: main.asgi skips the web processes' background threads."""
+
+    def handle(self, *args, **options):
+        # Set before the application (main.asgi) is imported by the command
+        settings.PROCESS_ROLE = 'worker'
+        super().handle(*args, **options)
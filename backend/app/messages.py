@@ -0,0 +1,141 @@
+import json
+from urllib.parse import parse_qs
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON backend
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class DecodeError(ValueError):
+    """An inbound frame is not a valid message for the connection's format."""
+
+
+class JsonCodec:
+    """Standard library JSON over text frames (the original protocol)."""
+
+    name = 'json'
+    label = 'JSON'
+    binary = False
+
+    def __init__(self):
+        self._static = {}
+
+    def encode(self, message):
+        return json.dumps(message)
+
+    def decode(self, frame):
+        try:
+            return _as_message(json.loads(frame))
+        except ValueError:
+            raise DecodeError(f"Invalid {self.label} format")
+
+    def static(self, name):
+        """A fixed message from STATIC_MESSAGES, encoded once per process."""
+        frame = self._static.get(name)
+        if frame is None:
+            frame = self._static[name] = self.encode(STATIC_MESSAGES[name])
+        return frame
+
+
+class OrjsonCodec(JsonCodec):
+    """Same JSON text frames, encoded and parsed by orjson."""
+
+    name = 'orjson'
+
+    def encode(self, message):
+        return orjson.dumps(message).decode()
+
+    def decode(self, frame):
+        try:
+            return _as_message(orjson.loads(frame))
+        except ValueError:
+            raise DecodeError(f"Invalid {self.label} format")
+
+
+class MsgpackCodec(JsonCodec):
+    """
+    MessagePack over binary frames. Audio travels as raw bytes in the
+    audio_data field instead of base64; every binary frame is a message.
+    Text frames are still read as JSON.
+    """
+
+    name = 'msgpack'
+    label = 'MessagePack'
+    binary = True
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, frame):
+        if isinstance(frame, str):
+            return JSON_CODEC.decode(frame)
+        try:
+            return _as_message(msgpack.unpackb(frame, raw=False))
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError):
+            raise DecodeError(f"Invalid {self.label} format")
+
+
+def _as_message(value):
+    if not isinstance(value, dict):
+        raise ValueError("message is not an object")
+    return value
+
+
+# Messages that never change, pre-encoded once per codec
+STATIC_MESSAGES = {
+    'recording_started': {'type': 'recording_started', 'message': 'Recording started successfully'},
+    'recording_stopped': {'type': 'recording_stopped', 'message': 'Recording stopped successfully'},
+    'utterance_cancelled': {'type': 'utterance_cancelled', 'message': 'Utterance cancelled'},
+    'no_utterance': {'type': 'utterance_cancelled', 'message': 'No utterance in progress'},
+    'no_audio_data': {'type': 'error', 'message': 'No audio data provided'},
+    'invalid_base64': {'type': 'error', 'message': 'Invalid base64 audio data'},
+    'audio_too_large': {
+        'type': 'error',
+        'message': f'Audio exceeds the maximum of {settings.AUDIO_MAX_UTTERANCE_BYTES} bytes per utterance'
+    },
+    'no_speech': {'type': 'transcription', 'text': '', 'llm_response': '', 'message': 'No speech detected in audio'},
+}
+
+JSON_CODEC = OrjsonCodec() if orjson is not None else JsonCodec()
+
+# Codecs by format name; only those whose library is installed
+CODECS = {'json': JsonCodec()}
+if orjson is not None:
+    CODECS['orjson'] = JSON_CODEC
+if msgpack is not None:
+    CODECS['msgpack'] = MsgpackCodec()
+
+SUBPROTOCOL_PREFIX = 'sts.'
+
+
+def default_codec():
+    return CODECS.get(settings.WS_MESSAGE_FORMAT, JSON_CODEC)
+
+
+def negotiate_codec(scope):
+    """
+    Pick the message codec of a websocket connection.
+
+    The client asks for a format with ?format=<name>, or by offering
+    subprotocols named sts.<name> (the first supported one wins and has to
+    be echoed back in the handshake). Returns (codec, subprotocol or None);
+    unknown formats fall back to the server default.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode())
+    requested = query.get('format', [None])[0]
+    if requested in CODECS:
+        return CODECS[requested], None
+
+    for subprotocol in scope.get('subprotocols') or ():
+        name = subprotocol[len(SUBPROTOCOL_PREFIX):] if subprotocol.startswith(SUBPROTOCOL_PREFIX) else None
+        if name in CODECS:
+            return CODECS[name], subprotocol
+
+    return default_codec(), None
@@ -0,0 +1,78 @@
+from django.db import migrations
+
+# SQLite: external-content FTS5 table kept in sync by triggers, so every
+# insert (including bulk_create) updates the index incrementally. Updates
+# reindex a row only when its text changes, not when e.g. its embedding is set.
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE app_conversation_fts USING fts5(
+        user_text, llm_response,
+        content='app_conversation', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER app_conversation_fts_ai AFTER INSERT ON app_conversation BEGIN
+        INSERT INTO app_conversation_fts(rowid, user_text, llm_response)
+        VALUES (new.id, new.user_text, new.llm_response);
+    END
+    """,
+    """
+    CREATE TRIGGER app_conversation_fts_ad AFTER DELETE ON app_conversation BEGIN
+        INSERT INTO app_conversation_fts(app_conversation_fts, rowid, user_text, llm_response)
+        VALUES ('delete', old.id, old.user_text, old.llm_response);
+    END
+    """,
+    """
+    CREATE TRIGGER app_conversation_fts_au AFTER UPDATE OF user_text, llm_response ON app_conversation BEGIN
+        INSERT INTO app_conversation_fts(app_conversation_fts, rowid, user_text, llm_response)
+        VALUES ('delete', old.id, old.user_text, old.llm_response);
+        INSERT INTO app_conversation_fts(rowid, user_text, llm_response)
+        VALUES (new.id, new.user_text, new.llm_response);
+    END
+    """,
+    # Index the rows that already exist
+    "INSERT INTO app_conversation_fts(app_conversation_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS app_conversation_fts_au",
+    "DROP TRIGGER IF EXISTS app_conversation_fts_ad",
+    "DROP TRIGGER IF EXISTS app_conversation_fts_ai",
+    "DROP TABLE IF EXISTS app_conversation_fts",
+]
+
+# PostgreSQL: GIN index over the same tsvector expression used by app.search,
+# maintained by the database on every insert.
+POSTGRES_FORWARD = [
+    """
+    CREATE INDEX app_conversation_search_gin ON app_conversation USING GIN (
+        to_tsvector('english', coalesce(user_text, '') || ' ' || coalesce(llm_response, ''))
+    )
+    """,
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS app_conversation_search_gin",
+]
+
+
+def run_statements(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_alter_user_managers_user_date_joined_user_first_name_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_statements({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
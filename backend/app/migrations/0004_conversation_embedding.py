@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_conversation_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
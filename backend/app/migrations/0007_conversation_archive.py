@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_conversation_purge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationArchive',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('month', models.DateField()),
+                ('first_id', models.IntegerField()),
+                ('last_id', models.IntegerField()),
+                ('turn_count', models.PositiveIntegerField()),
+                ('raw_bytes', models.PositiveIntegerField()),
+                ('segment', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_archives', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'month'], name='app_convers_user_id_3b3999_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_conversation_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='conversations_cleared_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -10,6 +10,12 @@ class User(AbstractUser):
     email = models.EmailField(unique=True, null=False, blank=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Conversations up to this id were cleared; they stay hidden while
+    # app.purge deletes them in the background
+    conversations_cleared_through = models.IntegerField(default=0)
+    # When the last clear happened: turns still queued for writing from
+    # before then are dropped by app.persistence instead of written
+    conversations_cleared_at = models.DateTimeField(null=True, blank=True)
 
     # Use email as the unique identifier
     USERNAME_FIELD = 'email'
@@ -34,14 +40,117 @@ class User(AbstractUser):
     class Meta:
         db_table = 'app_user'
 
+class ConversationQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """The user's conversations that have not been cleared."""
+        return self.filter(user=user, id__gt=user.conversations_cleared_through)
+
+
 # Create your models here.
 class Conversation(models.Model):
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     user_text = models.TextField(null=True, blank=True)
     llm_response = models.TextField(null=True, blank=True)
+    # float32 vector of the turn for semantic retrieval (see app.retrieval)
+    embedding = models.BinaryField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ConversationQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.user_text} - {self.llm_response}"
+
+class ConversationArchive(models.Model):
+    """
+    Compressed segment of a user's conversations from one month, moved out
+    of the Conversation table once they are old (see app.archive)
+    """
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_archives')
+    # First day of the month the turns were created in
+    month = models.DateField()
+    first_id = models.IntegerField()
+    last_id = models.IntegerField()
+    turn_count = models.PositiveIntegerField()
+    raw_bytes = models.PositiveIntegerField()
+    # zlib-compressed JSON list of [id, user_text, llm_response, created_at]
+    segment = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'month']),
+        ]
+
+    def __str__(self):
+        return f"Archive of user {self.user_id} for {self.month:%Y-%m} ({self.turn_count} turns)"
+
+class ConversationPurge(models.Model):
+    """Background deletion of the conversations a user cleared (see app.purge)"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_purges')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    # Every conversation of the user with an id up to this one is deleted
+    through_id = models.IntegerField()
+    total = models.PositiveIntegerField(default=0)
+    deleted = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f"Purge {self.id} of user {self.user_id} ({self.status})"
+
+class TranscriptionJob(models.Model):
+    """An uploaded recording queued for batch transcription (see app.transcription)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transcription_jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    engine = models.CharField(max_length=32, default='google')
+    filename = models.CharField(max_length=255, blank=True, default='')
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    size = models.PositiveIntegerField(default=0)
+    # The upload itself; dropped once the job is done or has failed for good
+    audio = models.BinaryField(null=True, blank=True)
+    text = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['user', '-created_at']),
+        ]
+
     def __str__(self):
-        return f"{self.user_text} - {self.llm_response}"
\ No newline at end of file
+        return f"Transcription {self.id} ({self.status})"
@@ -0,0 +1,259 @@
+import time
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.db import close_old_connections, transaction, DataError, IntegrityError
+from django.utils import timezone
+from .models import User, Conversation
+from .metrics import metrics
+from .retrieval import backfill_embeddings, embed_conversations, vector_indexes
+
+logger = logging.getLogger(__name__)
+
+# Failures that retrying the same row cannot fix (ValueError: Django refused
+# the row itself, e.g. its user instance was deleted in this process)
+REJECTED_ROW_ERRORS = (IntegrityError, DataError, ValueError)
+
+
+class ConversationWriter:
+    """
+    Write-behind queue for Conversation rows.
+
+    Turns are queued in memory and a single background thread inserts them
+    with bulk_create, either once batch_size rows are waiting or after
+    flush_interval seconds. Pending rows are flushed on interpreter shutdown.
+
+    Each turn is stamped with the time it was queued (queued_at). Turns of
+    a user who cleared their conversations since then are dropped when
+    their batch is written, whichever worker queued them.
+
+    A batch the database rejects (REJECTED_ROW_ERRORS, e.g. a turn of a
+    user deleted since it was queued) is retried row by row and the rows
+    that still fail are logged and dropped. Any other failure is taken as
+    transient: the batch goes back to the front of the queue and is retried
+    after an exponential backoff of retry_backoff up to max_backoff seconds.
+
+    While the queue is idle, the thread also embeds stored turns that have
+    no embedding yet, one batch of one user at a time
+    (VectorIndexRegistry.next_backfill).
+    """
+
+    def __init__(self, batch_size=100, flush_interval=1.0, retry_backoff=0.5, max_backoff=30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._failures = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def enqueue(self, user, user_text, llm_response):
+        """Queue a conversation turn for insertion and return the unsaved instance."""
+        conversation = Conversation(
+            user=user,
+            user_text=user_text,
+            llm_response=llm_response
+        )
+        conversation.queued_at = timezone.now()
+
+        with self._cond:
+            if not self._closed:
+                self._pending.append(conversation)
+                self._ensure_started()
+                if len(self._pending) >= self.batch_size:
+                    self._cond.notify()
+                return conversation
+
+        # Shutting down: nobody is left to flush, so write through
+        conversation.save()
+        return conversation
+
+    def discard(self, user_id):
+        """
+        Drop the user's turns queued in this process without writing them;
+        returns how many were dropped. Turns queued elsewhere, or already
+        taken for writing, are dropped by the write itself.
+        """
+        with self._cond:
+            kept = [conversation for conversation in self._pending if conversation.user_id != user_id]
+            dropped = len(self._pending) - len(kept)
+            self._pending[:] = kept
+        return dropped
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self, retries=3, timeout=None):
+        """
+        Write every queued row now, on the calling thread. Gives up after
+        retries transient failures in a row or timeout seconds, leaving the
+        rest queued for the background thread. Returns True if the queue
+        was drained.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        failures = 0
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch:
+                return True
+            if self._write(batch):
+                failures = 0
+            else:
+                failures += 1
+                delay = self._retry_delay()
+                if failures > retries or (deadline is not None and time.monotonic() + delay > deadline):
+                    logger.warning(f"Flush gave up with {self.pending_count()} conversations still queued")
+                    return False
+                time.sleep(delay)
+            if deadline is not None and time.monotonic() > deadline:
+                return self.pending_count() == 0
+
+    def close(self, timeout=10.0):
+        """Stop the background thread after it has drained the queue."""
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+            self._cond.notify()
+
+        if thread is not None:
+            thread.join(timeout)
+        # Anything still queued (thread never started or timed out) is written here
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run,
+                name='conversation-writer',
+                daemon=True
+            )
+            self._thread.start()
+
+    def _retry_delay(self):
+        return min(self.max_backoff, self.retry_backoff * 2 ** max(self._failures - 1, 0))
+
+    def _take_batch(self):
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._pending) >= self.batch_size,
+                    timeout=self.flush_interval
+                )
+                batch = self._take_batch()
+                if not batch and self._closed:
+                    return
+
+            if batch and not self._write(batch):
+                if self._closed:
+                    # close() flushes what is left with bounded retries
+                    return
+                with self._cond:
+                    self._cond.wait(self._retry_delay())
+            elif not batch:
+                self._backfill()
+
+    def _backfill(self):
+        """Embed one batch of a user's stored turns that have no embedding."""
+        pending = vector_indexes.next_backfill()
+        if pending is None:
+            return
+        user_id, cleared_through = pending
+        try:
+            if backfill_embeddings(user_id, cleared_through, max_batches=1):
+                # Possibly more left: back in the queue, after the other users
+                vector_indexes.request_backfill(user_id, cleared_through)
+        except Exception as e:
+            # Retried the next time the user's index is loaded
+            logger.warning(f"Failed to backfill embeddings of user {user_id}: {e}")
+        finally:
+            close_old_connections()
+
+    def _write(self, batch):
+        """Insert a batch; returns False if it was put back for a retry."""
+        try:
+            embed_conversations([c for c in batch if c.embedding is None])
+        except Exception as e:
+            # Saved without one and embedded later by the backfill
+            logger.warning(f"Failed to embed {len(batch)} conversations: {e}")
+
+        try:
+            written, remaining = self._insert(batch), []
+        except REJECTED_ROW_ERRORS as e:
+            logger.warning(f"Batch of {len(batch)} conversations rejected, writing them one by one: {e}")
+            written, remaining = self._write_rows(batch)
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} conversations, will retry: {e}")
+            written, remaining = [], batch
+        finally:
+            close_old_connections()
+
+        if written:
+            vector_indexes.add_conversations(written)
+        if not remaining:
+            self._failures = 0
+            return True
+
+        self._failures += 1
+        for conversation in remaining:
+            # A failed insert may have handed out ids that were rolled back
+            conversation.pk = None
+        with self._cond:
+            # Keep insertion order by putting the rows back at the front
+            self._pending[:0] = remaining
+        return False
+
+    def _insert(self, rows):
+        """
+        bulk_create the rows, except those queued before their user's last
+        clear; returns the rows written. The clear times are read in the
+        insert's transaction, with the users locked where the database
+        supports it, so a clear committing meanwhile is not missed.
+        """
+        with transaction.atomic():
+            cleared_at = dict(
+                User.objects.select_for_update()
+                .filter(id__in={row.user_id for row in rows}, conversations_cleared_at__isnull=False)
+                .values_list('id', 'conversations_cleared_at')
+            )
+            kept = [
+                row for row in rows
+                if row.user_id not in cleared_at or row.queued_at > cleared_at[row.user_id]
+            ]
+            Conversation.objects.bulk_create(kept)
+        if len(kept) < len(rows):
+            metrics.increment('conversations.discarded', len(rows) - len(kept))
+        return kept
+
+    def _write_rows(self, batch):
+        """Insert rows one at a time, dropping those the database rejects. Returns (written, unwritten)."""
+        written = []
+        for index, conversation in enumerate(batch):
+            conversation.pk = None
+            try:
+                written += self._insert([conversation])
+            except REJECTED_ROW_ERRORS as e:
+                logger.error(f"Dropping conversation turn of user {conversation.user_id}: {e}")
+                metrics.increment('conversations.dropped')
+            except Exception as e:
+                logger.error(f"Failed to write conversations, will retry: {e}")
+                return written, batch[index:]
+        return written, []
+
+
+conversation_writer = ConversationWriter(
+    batch_size=settings.CONVERSATION_WRITE_BATCH_SIZE,
+    flush_interval=settings.CONVERSATION_WRITE_FLUSH_INTERVAL
+)
+
+# Durability on shutdown: drain the queue before the interpreter exits
+atexit.register(conversation_writer.close)
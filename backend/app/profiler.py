@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from .metrics import metrics
+
+# Pipeline stage of a sample: the innermost frame on its stack whose
+# function is listed here names the stage
+STAGE_FUNCTIONS = {
+    'append_base64_chunk': 'audio_ingest',
+    'append_base64': 'audio_ingest',
+    'decode_audio': 'audio_decode',
+    'transcode_to_flac': 'audio_decode',
+    'normalize_pcm': 'audio_decode',
+    'split_on_silence': 'audio_decode',
+    'speech_to_text': 'stt',
+    'transcribe_google': 'stt',
+    'transcribe_segments_google': 'stt',
+    'recognize_google': 'stt',
+    'get_conversation_history': 'retrieval',
+    'load_conversation_history': 'retrieval',
+    'retrieve_relevant_turns': 'retrieval',
+    'generate_response': 'llm',
+    'generate_response_groq': 'llm',
+    'generate_response_with_history': 'llm',
+    'complete_groq': 'llm',
+    'complete_openai': 'llm',
+    '_collect_stream': 'llm',
+    'speculate': 'llm',
+    'text_to_speech': 'tts',
+    'send_speech': 'tts',
+    'send_message': 'ws_send',
+    'receive': 'ws_receive',
+}
+
+# Without a matching frame, threads are tagged by what they are for
+THREAD_STAGES = (
+    ('upstream-slot', 'upstream'),
+    ('llm-router', 'llm'),
+    ('stt-segment', 'stt'),
+    ('transcription-', 'batch_transcription'),
+    ('conversation-writer', 'persistence'),
+    ('conversation-purger', 'persistence'),
+)
+
+# Leaf frames of threads that are blocked waiting rather than working
+IDLE_FRAMES = {
+    ('threading', 'wait'),
+    ('threading', 'Condition.wait'),
+    ('threading', 'Event.wait'),
+    ('threading', '_wait_for_tstate_lock'),
+    ('selectors', 'select'),
+    ('selectors', 'EpollSelector.select'),
+    ('selectors', 'KqueueSelector.select'),
+    ('queue', 'get'),
+    ('queue', 'Queue.get'),
+    ('queue', 'SimpleQueue.get'),
+    ('thread', '_worker'),
+}
+
+
+def _frame_label(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _is_idle(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    name = getattr(code, 'co_qualname', code.co_name)
+    return (module, name) in IDLE_FRAMES or (module, code.co_name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for this worker process.
+
+    While running, a daemon thread snapshots the Python stack of every other
+    thread (sys._current_frames) every interval seconds and counts the
+    collapsed stacks, root first, prefixed by the pipeline stage. Nothing is
+    hooked into the code being profiled, so the profiler costs nothing while
+    it is off and one stack walk per thread and interval while it is on.
+    One profile runs at a time; the last result is kept until the next start.
+    """
+
+    def __init__(self, max_depth=64):
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._result = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, interval=0.005, include_idle=False):
+        """Profile for seconds in the background; returns False if a profile is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self._stop.clear()
+            self._result = {
+                'status': 'running',
+                'seconds': seconds,
+                'interval': interval,
+                'include_idle': include_idle,
+                'started_at': time.time(),
+                'samples': 0,
+                'stacks': Counter(),
+                'stages': Counter(),
+            }
+            self._thread = threading.Thread(
+                target=self._run, args=(self._result, seconds, interval, include_idle),
+                name='sampling-profiler', daemon=True
+            )
+            self._thread.start()
+            metrics.increment('profiler.runs')
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _stage(self, frames, thread_name):
+        for code in reversed(frames):
+            stage = STAGE_FUNCTIONS.get(code.co_name)
+            if stage:
+                return stage
+        for prefix, stage in THREAD_STAGES:
+            if thread_name.startswith(prefix):
+                return stage
+        return 'other'
+
+    def _run(self, result, seconds, interval, include_idle):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        stacks, stages = result['stacks'], result['stages']
+        samples = 0
+        overhead = 0.0
+
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            tick = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if not include_idle and _is_idle(frame.f_code):
+                    continue
+                codes = []
+                while frame is not None and len(codes) < self.max_depth:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                sampled.append((self._stage(codes, names.get(thread_id, '')), codes))
+            # Do not keep the last sampled stack alive until the next tick
+            frame = None
+            with self._lock:
+                for stage, codes in sampled:
+                    stacks[(stage,) + tuple(_frame_label(code) for code in codes)] += 1
+                    stages[stage] += 1
+                samples += 1
+                result['samples'] = samples
+            overhead += time.perf_counter() - tick
+            self._stop.wait(interval)
+
+        with self._lock:
+            result['sampling_seconds'] = round(overhead, 4)
+            result['status'] = 'done'
+        metrics.observe('profiler.sampling_seconds', overhead)
+
+    def result(self, collapsed=True, limit=None):
+        """
+        The current or last profile: counts per stage and the stacks in
+        collapsed format ("stage;outer;...;inner count" lines, most
+        frequent first), ready for flamegraph tools.
+        """
+        with self._lock:
+            if self._result is None:
+                return None
+            result = dict(self._result)
+            stacks = result.pop('stacks').most_common(limit)
+            stages = dict(result.pop('stages').most_common())
+
+        result['stages'] = stages
+        if collapsed:
+            result['collapsed'] = '\n'.join(f"{';'.join(stack)} {count}" for stack, count in stacks)
+        return result
+
+
+profiler = SamplingProfiler()
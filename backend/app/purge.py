@@ -0,0 +1,208 @@
+import time
+import logging
+import threading
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+from .models import User, Conversation, ConversationArchive, ConversationPurge
+from .metrics import metrics
+from .persistence import conversation_writer
+from .retrieval import vector_indexes
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    """Channel layer group of a user's open websockets."""
+    return f'user-{user_id}'
+
+
+def purge_as_dict(purge):
+    return {
+        'id': purge.id,
+        'status': purge.status,
+        'total': purge.total,
+        'deleted': purge.deleted,
+        'created_at': purge.created_at.isoformat(),
+        'started_at': purge.started_at.isoformat() if purge.started_at else None,
+        'finished_at': purge.finished_at.isoformat() if purge.finished_at else None,
+    }
+
+
+def clear_conversations(user):
+    """
+    Hide every conversation of the user now and queue their deletion.
+
+    Moves the user's conversations_cleared_through marker to the newest
+    conversation, which every read path filters on, and records a
+    ConversationPurge for the background purger. Returns the purge.
+
+    Turns spoken before the clear that are still queued for writing, in
+    any worker, are dropped by their writer (conversations_cleared_at).
+    """
+    # Those this worker holds are dropped right away, without waiting on
+    # the database
+    conversation_writer.discard(user.id)
+
+    with transaction.atomic():
+        # Locked first: a writer inserting this user's turns (which locks the
+        # row too) either commits before the marker is read or sees the clear
+        previous = User.objects.select_for_update().values_list(
+            'conversations_cleared_through', flat=True
+        ).get(id=user.id)
+        through_id = max(
+            Conversation.objects.filter(user=user).aggregate(last=Max('id'))['last'] or 0,
+            ConversationArchive.objects.filter(user=user).aggregate(last=Max('last_id'))['last'] or 0,
+            previous
+        )
+        total = Conversation.objects.filter(user=user, id__gt=previous, id__lte=through_id).count()
+        # Segments only ever hold turns above the marker of their time
+        total += ConversationArchive.objects.filter(
+            user=user, first_id__gt=previous
+        ).aggregate(turns=Sum('turn_count'))['turns'] or 0
+        cleared_at = timezone.now()
+        User.objects.filter(id=user.id).update(
+            conversations_cleared_through=through_id, conversations_cleared_at=cleared_at
+        )
+        user.conversations_cleared_through = through_id
+        user.conversations_cleared_at = cleared_at
+        purge = ConversationPurge.objects.create(user=user, through_id=through_id, total=total)
+        transaction.on_commit(conversation_purger.notify)
+
+    vector_indexes.discard(user.id)
+    metrics.increment('purge.requested')
+
+    # Open sockets of the user drop their cached history
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        try:
+            async_to_sync(channel_layer.group_send)(user_group(user.id), {
+                'type': 'conversations.cleared',
+                'through_id': through_id,
+            })
+        except Exception as e:
+            logger.warning(f"Could not notify websockets of user {user.id} about the clear: {e}")
+
+    return purge
+
+
+class ConversationPurger:
+    """
+    Thread that deletes cleared conversations in batches of batch_size rows,
+    pausing between batches so other writers get the database (SQLite has a
+    single write lock). Progress is saved on the ConversationPurge row after
+    every batch; deleting is idempotent, so a purge interrupted by a restart
+    is picked up again after stale_after seconds.
+    """
+
+    def __init__(self, batch_size=500, pause=0.05, poll_interval=30.0, stale_after=300.0):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='conversation-purger', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self):
+        """A purge was queued: start on it instead of waiting for the next poll."""
+        self._wake.set()
+
+    def claim_next(self):
+        """Mark the oldest pending (or abandoned) purge as running and return it, or None."""
+        stale = timezone.now() - timedelta(seconds=self.stale_after)
+        ConversationPurge.objects.filter(
+            status=ConversationPurge.RUNNING, started_at__lt=stale
+        ).update(status=ConversationPurge.PENDING)
+
+        for purge_id in ConversationPurge.objects.filter(
+            status=ConversationPurge.PENDING
+        ).order_by('id').values_list('id', flat=True)[:5]:
+            claimed = ConversationPurge.objects.filter(id=purge_id, status=ConversationPurge.PENDING).update(
+                status=ConversationPurge.RUNNING,
+                started_at=timezone.now()
+            )
+            if claimed:
+                return ConversationPurge.objects.get(id=purge_id)
+        return None
+
+    def process(self, purge):
+        start = time.monotonic()
+        while not self._stop.is_set():
+            ids = list(
+                Conversation.objects.filter(user_id=purge.user_id, id__lte=purge.through_id)
+                .order_by('id').values_list('id', flat=True)[:self.batch_size]
+            )
+            if not ids:
+                break
+            # No relations point at Conversation, so this is a single
+            # DELETE ... WHERE id IN (...) without loading the rows
+            deleted, _ = Conversation.objects.filter(id__in=ids).delete()
+            purge.deleted += deleted
+            # Keep the lease fresh while the purge is making progress
+            ConversationPurge.objects.filter(id=purge.id).update(deleted=purge.deleted, started_at=timezone.now())
+            metrics.increment('purge.rows_deleted', deleted)
+            if self.pause:
+                time.sleep(self.pause)
+        else:
+            # Stopping: the purge resumes from where it is on the next start
+            ConversationPurge.objects.filter(id=purge.id).update(status=ConversationPurge.PENDING)
+            return
+
+        # Archived segments are a few compact rows per month; they go in one statement
+        archives = ConversationArchive.objects.filter(user_id=purge.user_id, last_id__lte=purge.through_id)
+        purge.deleted += archives.aggregate(turns=Sum('turn_count'))['turns'] or 0
+        metrics.increment('purge.archives_deleted', archives.delete()[0])
+
+        purge.status = ConversationPurge.DONE
+        purge.finished_at = timezone.now()
+        ConversationPurge.objects.filter(id=purge.id).update(
+            status=purge.status, deleted=purge.deleted, finished_at=purge.finished_at
+        )
+        metrics.increment('purge.completed')
+        metrics.observe('purge.seconds', time.monotonic() - start)
+
+    def run_pending(self):
+        """Process every pending purge on the calling thread; returns how many were done."""
+        done = 0
+        while not self._stop.is_set():
+            purge = self.claim_next()
+            if purge is None:
+                return done
+            self.process(purge)
+            done += 1
+        return done
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Conversation purge failed: {e}")
+            finally:
+                close_old_connections()
+            self._wake.wait(self.poll_interval)
+
+
+conversation_purger = ConversationPurger(
+    batch_size=settings.PURGE_BATCH_SIZE,
+    pause=settings.PURGE_BATCH_PAUSE_SECONDS
+)
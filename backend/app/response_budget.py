@@ -0,0 +1,63 @@
+import re
+from django.conf import settings
+
+# End of a sentence: terminal punctuation, optionally closed by a quote/bracket
+SENTENCE_END_RE = re.compile(r"""[.!?]['")\]]?(?=\s|$)""")
+
+
+class ResponseBudget:
+    """
+    Length budget for an answer that is going to be spoken.
+
+    The budget is a target speaking duration; it is converted into words via
+    the speaking rate and into a max_completion_tokens cap via the average
+    tokens per word, plus an allowance for the hidden reasoning tokens of
+    reasoning models.
+    """
+
+    def __init__(self, target_seconds=20.0, words_per_second=2.5, tokens_per_word=1.4,
+                 reasoning_tokens=512, headroom=1.5):
+        self.target_seconds = target_seconds
+        self.words_per_second = words_per_second
+        self.tokens_per_word = tokens_per_word
+        self.reasoning_tokens = reasoning_tokens
+        self.headroom = headroom
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            target_seconds=settings.RESPONSE_TARGET_SECONDS,
+            words_per_second=settings.RESPONSE_WORDS_PER_SECOND,
+            tokens_per_word=settings.RESPONSE_TOKENS_PER_WORD,
+            reasoning_tokens=settings.RESPONSE_REASONING_TOKENS,
+        )
+
+    @property
+    def words(self):
+        """Words that fit in the target speaking duration."""
+        return max(1, int(self.target_seconds * self.words_per_second))
+
+    def max_completion_tokens(self, reasoning=False):
+        """
+        Hard token cap for the provider. It leaves headroom above the word
+        budget so the stream can normally stop at a sentence boundary first.
+        """
+        tokens = int(self.words * self.tokens_per_word * self.headroom)
+        return tokens + (self.reasoning_tokens if reasoning else 0)
+
+
+def last_sentence_end(text):
+    """Index just after the last complete sentence in text, or 0 if there is none."""
+    end = 0
+    for match in SENTENCE_END_RE.finditer(text):
+        end = match.end()
+    return end
+
+
+def trim_to_sentence(text):
+    """Drop a trailing incomplete sentence (e.g. after hitting the token cap)."""
+    end = last_sentence_end(text)
+    return text[:end] if end else text
+
+
+response_budget = ResponseBudget.from_settings()
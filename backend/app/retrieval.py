@@ -0,0 +1,256 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Length
+from .models import Conversation
+from .stt import generate_embeddings
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def _hashing_embedding(text, dim):
+    """
+    Local embedding: signed feature hashing of word unigrams and bigrams.
+    Deterministic across processes and needs no network.
+    """
+    tokens = TOKEN_RE.findall((text or "").lower())
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    vector = np.zeros(dim, dtype=np.float32)
+    if not features:
+        return vector
+
+    hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes % dim, signs)
+    # Sublinear term frequency keeps repeated words from dominating
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    return vector
+
+
+def embed_texts(texts):
+    """
+    Embed texts with the configured engine as an (n, dim) float32 array of
+    unit vectors, at most EMBEDDING_BATCH_SIZE texts per embeddings request.
+    """
+    dim = settings.EMBEDDING_DIM
+    if settings.EMBEDDING_ENGINE == 'openai':
+        texts, batch_size = list(texts), settings.EMBEDDING_BATCH_SIZE
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors += generate_embeddings(texts[start:start + batch_size], dimensions=dim)
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(texts), dim)
+    else:
+        matrix = np.stack([_hashing_embedding(text, dim) for text in texts]) if texts else np.zeros((0, dim), dtype=np.float32)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def conversation_document(user_text, llm_response):
+    return f"{user_text or ''}\n{llm_response or ''}"
+
+
+def embed_conversations(conversations):
+    """Set the embedding of each unsaved Conversation in place."""
+    if not conversations:
+        return
+    matrix = embed_texts([conversation_document(c.user_text, c.llm_response) for c in conversations])
+    for conversation, vector in zip(conversations, matrix):
+        conversation.embedding = vector.tobytes()
+
+
+class UserVectorIndex:
+    """
+    Brute-force vector index for one user: conversation ids and unit vectors
+    kept in preallocated float32/int64 arrays that grow by doubling.
+    """
+
+    def __init__(self, dim, capacity=64):
+        self.dim = dim
+        self.size = 0
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def add(self, conversation_id, vector):
+        with self._lock:
+            if self.size == len(self._ids):
+                capacity = len(self._ids) * 2
+                self._ids = np.resize(self._ids, capacity)
+                vectors = np.empty((capacity, self.dim), dtype=np.float32)
+                vectors[:self.size] = self._vectors[:self.size]
+                self._vectors = vectors
+            self._ids[self.size] = conversation_id
+            self._vectors[self.size] = vector
+            self.size += 1
+
+    def search(self, query, k, min_score=0.0):
+        """Return [(conversation_id, score)] for the k most similar turns."""
+        with self._lock:
+            if self.size == 0 or k <= 0:
+                return []
+            scores = self._vectors[:self.size] @ query
+            ids = self._ids[:self.size]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] >= min_score]
+
+    @property
+    def nbytes(self):
+        return self._ids.nbytes + self._vectors.nbytes
+
+
+def missing_embeddings(user_id=None, cleared_through=0):
+    """Conversations without an embedding of the configured dimension."""
+    conversations = Conversation.objects.annotate(embedding_bytes=Length('embedding')).filter(
+        Q(embedding__isnull=True) | ~Q(embedding_bytes=settings.EMBEDDING_DIM * 4),
+        id__gt=cleared_through
+    )
+    if user_id is not None:
+        conversations = conversations.filter(user_id=user_id)
+    return conversations
+
+
+def backfill_embeddings(user_id=None, cleared_through=0, batch_size=None, max_batches=None):
+    """
+    Embed and save conversations missing an embedding, oldest first, in
+    batches of batch_size (EMBEDDING_BATCH_SIZE), and add them to the loaded
+    indexes. Stops after max_batches batches; returns how many were embedded.
+    """
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+    conversations = missing_embeddings(user_id, cleared_through).order_by('id')
+    done = batches = last_id = 0
+    while max_batches is None or batches < max_batches:
+        batch = list(conversations.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        embed_conversations(batch)
+        Conversation.objects.bulk_update(batch, ['embedding'])
+        vector_indexes.add_conversations(batch)
+        done += len(batch)
+        batches += 1
+        last_id = batch[-1].id
+    return done
+
+
+class VectorIndexRegistry:
+    """
+    Per-worker LRU of user vector indexes. An index is loaded from the stored
+    embeddings on first use. Turns missing an embedding are left out and the
+    user is queued for backfill_embeddings, which the conversation writer's
+    thread runs between writes (app.persistence), so loading never waits
+    for the embeddings engine.
+    """
+
+    def __init__(self, max_users=1000):
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._backfill = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, cleared_through=0):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+
+        index = self._load(user_id, cleared_through)
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep the first one
+            index = self._indexes.setdefault(user_id, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def add_conversations(self, conversations):
+        """Add freshly saved conversations to the indexes that are already loaded."""
+        for conversation in conversations:
+            if conversation.pk is None or not conversation.embedding:
+                continue
+            with self._lock:
+                index = self._indexes.get(conversation.user_id)
+            if index is not None:
+                index.add(conversation.pk, np.frombuffer(conversation.embedding, dtype=np.float32))
+
+    def discard(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+            self._backfill.pop(user_id, None)
+
+    def request_backfill(self, user_id, cleared_through=0):
+        with self._lock:
+            self._backfill[user_id] = cleared_through
+
+    def next_backfill(self):
+        """The (user_id, cleared_through) queued longest for a backfill, or None."""
+        with self._lock:
+            return self._backfill.popitem(last=False) if self._backfill else None
+
+    def _load(self, user_id, cleared_through=0):
+        dim = settings.EMBEDDING_DIM
+        index = UserVectorIndex(dim)
+        missing = False
+        rows = Conversation.objects.filter(
+            user_id=user_id, id__gt=cleared_through
+        ).order_by('id').values_list('id', 'embedding')
+        for conversation_id, embedding in rows.iterator(chunk_size=2000):
+            # Embeddings from another engine/dimension are recomputed by the backfill
+            if embedding and len(embedding) == dim * 4:
+                index.add(conversation_id, np.frombuffer(embedding, dtype=np.float32))
+            else:
+                missing = True
+
+        if missing:
+            self.request_backfill(user_id, cleared_through)
+        return index
+
+
+vector_indexes = VectorIndexRegistry(max_users=settings.RETRIEVAL_MAX_USERS)
+
+
+def retrieve_relevant_turns(user, user_text, exclude=()):
+    """
+    Return the stored turns most relevant to user_text, oldest first,
+    as dicts with 'user_text' and 'llm_response' keys. Turns equal to one in
+    exclude (e.g. the recent window already in the prompt) are skipped.
+    """
+    if not user_text or settings.RETRIEVAL_TOP_K <= 0:
+        return []
+
+    index = vector_indexes.get(user.id, user.conversations_cleared_through)
+    query = embed_texts([user_text])[0]
+    # Over-fetch so excluded and deleted turns do not shrink the result
+    hits = index.search(query, settings.RETRIEVAL_TOP_K + len(exclude), settings.RETRIEVAL_MIN_SCORE)
+    if not hits:
+        return []
+
+    # Texts are not kept in memory; rows deleted or cleared since indexing drop out here
+    conversations = Conversation.objects.visible_to(user).filter(
+        id__in=[conversation_id for conversation_id, _ in hits]
+    ).defer('embedding')
+    by_id = {conv.id: conv for conv in conversations}
+
+    seen = {(turn.get('user_text'), turn.get('llm_response')) for turn in exclude}
+    selected = []
+    for conversation_id, _ in hits:
+        conv = by_id.get(conversation_id)
+        if conv is None or (conv.user_text, conv.llm_response) in seen:
+            continue
+        seen.add((conv.user_text, conv.llm_response))
+        selected.append(conv)
+        if len(selected) == settings.RETRIEVAL_TOP_K:
+            break
+
+    return [{
+        'user_text': conv.user_text,
+        'llm_response': conv.llm_response
+    } for conv in sorted(selected, key=lambda conv: conv.id)]
@@ -0,0 +1,201 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Bit-array set membership with no false negatives and false_positive_rate positives."""
+
+    def __init__(self, capacity, false_positive_rate=0.001):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationSet:
+    """
+    Per-process Bloom filter of the JTIs in the simplejwt blacklist that
+    have not expired yet, consulted before the database on every
+    authentication. A JTI that is not in the filter is certainly not
+    blacklisted, so valid tokens never touch the blacklist tables; a filter
+    hit is confirmed with one indexed query.
+
+    Other processes' revocations are picked up by an incremental query
+    (blacklist rows past the last id seen) at most every refresh_interval
+    seconds; the filter is rebuilt from scratch when it fills up and after
+    expired tokens were pruned.
+    """
+
+    def __init__(self, capacity=100000, false_positive_rate=0.001, refresh_interval=5.0):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._filter = None
+        self._last_id = 0
+        self._refreshed_at = 0.0
+
+    def _rebuild(self):
+        # Rows added while loading are picked up by the next incremental refresh
+        last_id = BlacklistedToken.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        jtis = list(
+            BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list('token__jti', flat=True)
+        )
+        bloom = BloomFilter(max(self.capacity, len(jtis) * 2), self.false_positive_rate)
+        for jti in jtis:
+            bloom.add(jti)
+        self._filter = bloom
+        self._last_id = last_id
+        metrics.set_gauge('auth.revocation.entries', bloom.count)
+        metrics.increment('auth.revocation.rebuilds')
+
+    def _refresh(self):
+        # Compared with the filter's own capacity: a rebuild sizes it past
+        # the configured one once the blacklist is larger
+        if self._filter is None or self._filter.count >= self._filter.capacity:
+            self._rebuild()
+        else:
+            for row_id, jti in BlacklistedToken.objects.filter(
+                id__gt=self._last_id
+            ).order_by('id').values_list('id', 'token__jti'):
+                self._filter.add(jti)
+                self._last_id = row_id
+            metrics.set_gauge('auth.revocation.entries', self._filter.count)
+        self._refreshed_at = time.monotonic()
+
+    def _current(self):
+        with self._lock:
+            if self._filter is None or time.monotonic() - self._refreshed_at > self.refresh_interval:
+                self._refresh()
+            return self._filter
+
+    def invalidate(self):
+        """Rebuild on next use (e.g. after pruning removed expired entries)."""
+        with self._lock:
+            self._filter = None
+
+    def is_revoked(self, jti):
+        if not jti:
+            return False
+        if jti not in self._current():
+            metrics.increment('auth.revocation.filter_negatives')
+            return False
+
+        revoked = BlacklistedToken.objects.filter(token__jti=jti).exists()
+        metrics.increment('auth.revocation.revoked' if revoked else 'auth.revocation.false_positives')
+        return revoked
+
+    def revoke(self, token):
+        """
+        Blacklist any simplejwt token, access tokens included (simplejwt
+        itself only blacklists refresh tokens).
+        """
+        jti = token[api_settings.JTI_CLAIM]
+        outstanding, _ = OutstandingToken.objects.get_or_create(
+            jti=jti,
+            defaults={
+                'token': str(token),
+                'expires_at': datetime_from_epoch(token['exp']),
+            }
+        )
+        BlacklistedToken.objects.get_or_create(token=outstanding)
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+
+def prune_expired_tokens(batch_size=1000, pause=0.0):
+    """
+    Delete expired tokens from the simplejwt outstanding/blacklist tables in
+    batches (flushexpiredtokens does it in a single statement). Returns the
+    number of outstanding tokens deleted.
+    """
+    now = timezone.now()
+    deleted = 0
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lte=now)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        BlacklistedToken.objects.filter(token_id__in=ids).delete()
+        deleted += OutstandingToken.objects.filter(id__in=ids).delete()[1].get(OutstandingToken._meta.label, 0)
+        if pause:
+            time.sleep(pause)
+
+    if deleted:
+        revocation_set.invalidate()
+        logger.info(f"Pruned {deleted} expired tokens")
+    metrics.increment('auth.tokens_pruned', deleted)
+    return deleted
+
+
+class TokenPruner:
+    """Background thread that runs prune_expired_tokens every interval seconds."""
+
+    def __init__(self, interval=3600.0, batch_size=1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name='token-pruner', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                prune_expired_tokens(self.batch_size, pause=0.05)
+            except Exception as e:
+                logger.error(f"Token pruning failed: {e}")
+            finally:
+                close_old_connections()
+
+
+revocation_set = RevocationSet(
+    capacity=settings.TOKEN_REVOCATION_CAPACITY,
+    refresh_interval=settings.TOKEN_REVOCATION_REFRESH_SECONDS
+)
+
+token_pruner = TokenPruner(
+    interval=settings.TOKEN_PRUNE_INTERVAL_SECONDS,
+    batch_size=settings.TOKEN_PRUNE_BATCH_SIZE
+)
@@ -0,0 +1,194 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerFull(RuntimeError):
+    """A user already has the maximum number of calls waiting."""
+
+
+class _Call:
+    __slots__ = ('func', 'args', 'kwargs', 'cost', 'future', 'enqueued_at', 'user_class')
+
+    def __init__(self, func, args, kwargs, cost, future, user_class):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cost = cost
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.user_class = user_class
+
+
+class _UserQueue:
+    __slots__ = ('key', 'weight', 'calls', 'deficit', 'running')
+
+    def __init__(self, key, weight):
+        self.key = key
+        self.weight = weight
+        self.calls = deque()
+        self.deficit = 0.0
+        self.running = 0
+
+    @property
+    def outstanding(self):
+        return len(self.calls) + self.running
+
+
+class FairScheduler:
+    """
+    Per-worker scheduler of blocking upstream calls (STT, LLM, TTS).
+
+    Every user has a queue; a bounded pool of slots threads runs the calls,
+    and free slots are handed out by deficit round-robin over the users with
+    queued work: each turn a user's deficit grows by quantum * weight and
+    its calls run while their cost fits in it. A user flooding the worker
+    only lengthens their own queue, so light users wait for at most about
+    one round of the active users.
+
+    Metrics are kept per user class: 'light', 'heavy' (heavy_after or more
+    calls outstanding when the call was queued) and 'staff'.
+    scheduler.queue_depth.<class> and scheduler.running gauges,
+    scheduler.wait_seconds.<class> summaries and scheduler.rejected.<class>
+    counters.
+
+    Runs on the event loop of the worker; only the calls themselves run on
+    the pool threads.
+    """
+
+    def __init__(self, slots=16, quantum=1.0, staff_weight=2.0, heavy_after=2, max_queued_per_user=8):
+        self.slots = slots
+        self.quantum = quantum
+        self.staff_weight = staff_weight
+        self.heavy_after = heavy_after
+        self.max_queued_per_user = max_queued_per_user
+        self._executor = None
+        self._queues = {}
+        # Users with queued calls, in round-robin order
+        self._active = deque()
+        self._running = 0
+        self._depth = {'light': 0, 'heavy': 0, 'staff': 0}
+
+    def _queue_for(self, user):
+        key = f'user:{user.id}' if user is not None else 'anonymous'
+        queue = self._queues.get(key)
+        if queue is None:
+            weight = self.staff_weight if getattr(user, 'is_staff', False) else 1.0
+            queue = self._queues[key] = _UserQueue(key, weight)
+        return queue
+
+    def _user_class(self, user, queue):
+        if getattr(user, 'is_staff', False):
+            return 'staff'
+        return 'heavy' if queue.outstanding >= self.heavy_after else 'light'
+
+    async def run(self, user, func, *args, cost=1.0, **kwargs):
+        """Run func(*args, **kwargs) on an upstream slot in the user's turn and return its result."""
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix='upstream-slot')
+
+        queue = self._queue_for(user)
+        user_class = self._user_class(user, queue)
+        if len(queue.calls) >= self.max_queued_per_user:
+            metrics.increment(f'scheduler.rejected.{user_class}')
+            raise SchedulerFull('Too many requests in progress, try again shortly')
+
+        call = _Call(func, args, kwargs, cost, loop.create_future(), user_class)
+        if not queue.calls:
+            self._active.append(queue)
+        queue.calls.append(call)
+        self._set_depth(user_class, 1)
+        self._dispatch()
+
+        try:
+            return await call.future
+        except asyncio.CancelledError:
+            # Given up while still queued: drop the call so it never takes a slot
+            if call in queue.calls:
+                queue.calls.remove(call)
+                self._set_depth(user_class, -1)
+                self._forget_if_idle(queue)
+            raise
+
+    def _set_depth(self, user_class, delta):
+        self._depth[user_class] += delta
+        metrics.set_gauge(f'scheduler.queue_depth.{user_class}', self._depth[user_class])
+
+    def _forget_if_idle(self, queue):
+        if not queue.calls:
+            if queue in self._active:
+                self._active.remove(queue)
+            queue.deficit = 0.0
+            if not queue.running:
+                self._queues.pop(queue.key, None)
+
+    def _dispatch(self):
+        """Hand free slots to queued calls in deficit round-robin order."""
+        while self._running < self.slots and self._active:
+            queue = self._active[0]
+            call = queue.calls[0]
+            if call.cost > queue.deficit:
+                # Not enough credit yet: top up and move on to the next user
+                queue.deficit += self.quantum * queue.weight
+                self._active.rotate(-1)
+                continue
+
+            queue.calls.popleft()
+            queue.deficit -= call.cost
+            self._set_depth(call.user_class, -1)
+            if not queue.calls:
+                self._active.popleft()
+                queue.deficit = 0.0
+            self._start(queue, call)
+
+    def _start(self, queue, call):
+        loop = asyncio.get_running_loop()
+        metrics.observe(f'scheduler.wait_seconds.{call.user_class}', time.monotonic() - call.enqueued_at)
+        self._running += 1
+        queue.running += 1
+        metrics.set_gauge('scheduler.running', self._running)
+
+        work = loop.run_in_executor(self._executor, lambda: call.func(*call.args, **call.kwargs))
+
+        def finished(work):
+            self._running -= 1
+            queue.running -= 1
+            metrics.set_gauge('scheduler.running', self._running)
+            self._forget_if_idle(queue)
+            # Read the outcome even when the caller is gone (barge-in cancels
+            # it), or asyncio logs "Future exception was never retrieved"
+            error = None if work.cancelled() else work.exception()
+            if not call.future.done():
+                if work.cancelled():
+                    call.future.cancel()
+                elif error is not None:
+                    call.future.set_exception(error)
+                else:
+                    call.future.set_result(work.result())
+            self._dispatch()
+
+        work.add_done_callback(finished)
+
+    def snapshot(self):
+        return {
+            'slots': self.slots,
+            'running': self._running,
+            'active_users': len(self._active),
+            'queue_depth': dict(self._depth),
+        }
+
+
+upstream_scheduler = FairScheduler(
+    slots=settings.SCHEDULER_SLOTS,
+    quantum=settings.SCHEDULER_QUANTUM,
+    staff_weight=settings.SCHEDULER_STAFF_WEIGHT,
+    heavy_after=settings.SCHEDULER_HEAVY_AFTER,
+    max_queued_per_user=settings.SCHEDULER_MAX_QUEUED_PER_USER
+)
@@ -0,0 +1,58 @@
+import re
+from django.db import connection
+from django.db.models import Q
+from .models import Conversation
+
+# Matches the full-text indexes created in migrations/0003_conversation_search_index.py
+SQLITE_SEARCH_SQL = """
+    SELECT c.*
+    FROM app_conversation_fts
+    JOIN app_conversation c ON c.id = app_conversation_fts.rowid
+    WHERE app_conversation_fts MATCH %s AND c.user_id = %s AND c.id > %s
+    ORDER BY app_conversation_fts.rank
+    LIMIT %s
+"""
+
+POSTGRES_DOCUMENT = "to_tsvector('english', coalesce(user_text, '') || ' ' || coalesce(llm_response, ''))"
+
+POSTGRES_SEARCH_SQL = f"""
+    SELECT *
+    FROM app_conversation
+    WHERE {POSTGRES_DOCUMENT} @@ websearch_to_tsquery('english', %s) AND user_id = %s AND id > %s
+    ORDER BY ts_rank({POSTGRES_DOCUMENT}, websearch_to_tsquery('english', %s)) DESC, created_at DESC
+    LIMIT %s
+"""
+
+
+def _fts5_query(query):
+    """
+    Turn free text into a safe FTS5 query: every word becomes a quoted
+    prefix term so user input can never be parsed as FTS5 syntax.
+    """
+    terms = re.findall(r"\w+", query)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_conversations(user, query, limit=20):
+    """
+    Full-text search over a user's conversations, best matches first.
+    Uses FTS5 on SQLite and a tsvector GIN index on PostgreSQL.
+    """
+    if not query or not query.strip():
+        return []
+
+    if connection.vendor == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            return []
+        return list(Conversation.objects.raw(SQLITE_SEARCH_SQL, [match, user.id, user.conversations_cleared_through, limit]))
+
+    if connection.vendor == 'postgresql':
+        return list(Conversation.objects.raw(POSTGRES_SEARCH_SQL, [query, user.id, user.conversations_cleared_through, query, limit]))
+
+    # Unindexed fallback for other backends
+    return list(
+        Conversation.objects.visible_to(user)
+        .filter(Q(user_text__icontains=query) | Q(llm_response__icontains=query))
+        .order_by('-created_at')[:limit]
+    )
@@ -0,0 +1,146 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from django.conf import settings
+from .audio import AudioBuffer
+from .speculation import PartialTranscriptTracker
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionSession:
+    """
+    State of one websocket connection, kept compact because it is held for
+    every open socket whether or not the user is speaking.
+
+    Audio buffers allocate nothing until the first chunk arrives, are capped
+    at max_audio_bytes and can be released again while the connection idles;
+    history is a fixed-size ring of the latest turns.
+    """
+
+    __slots__ = (
+        'user', 'utterance_task', 'cancel_token', 'history', 'history_size',
+        'speculation', 'partials', 'recording', 'spare_buffer', 'last_activity', 'codec',
+        'pending_inference'
+    )
+
+    def __init__(self, history_size=3, stable_partials=2, max_audio_bytes=None):
+        self.user = None
+        # In-flight utterance; a newer one, a 'cancel' message or a disconnect aborts it
+        self.utterance_task = None
+        self.cancel_token = None
+        # Recent turns, loaded once on first use and then kept up to date
+        # locally so the LLM sees turns whose database write is still queued
+        self.history = None
+        self.history_size = history_size
+        # Speculative LLM request started from partial transcripts (opt-in)
+        self.speculation = None
+        self.partials = PartialTranscriptTracker(stable_partials)
+        # Double-buffered audio: chunks of the next utterance are appended to
+        # `recording` while a worker thread reads the other buffer
+        self.recording = AudioBuffer(capacity=0, max_bytes=max_audio_bytes)
+        self.spare_buffer = AudioBuffer(capacity=0, max_bytes=max_audio_bytes)
+        self.last_activity = time.monotonic()
+        # Message format negotiated on connect (app.messages)
+        self.codec = None
+        # Utterances sent to the inference tier: utterance id -> future of the transcript
+        self.pending_inference = None
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def idle_seconds(self, now=None):
+        return (now if now is not None else time.monotonic()) - self.last_activity
+
+    @property
+    def busy(self):
+        """An utterance or speculation is still being processed."""
+        return (
+            (self.utterance_task is not None and not self.utterance_task.done())
+            or self.speculation is not None
+        )
+
+    def load_history(self, turns):
+        self.history = deque(turns, maxlen=self.history_size)
+
+    def swap_buffers(self):
+        """Hand the recorded buffer to the pipeline and record into the other one."""
+        audio_buffer = self.recording
+        self.recording, self.spare_buffer = self.spare_buffer, audio_buffer
+        self.recording.clear()
+        return audio_buffer
+
+    def release_buffers(self):
+        """Return the audio buffers' memory while the connection is idle."""
+        self.recording.release()
+        self.spare_buffer.release()
+
+    def memory_bytes(self):
+        """Approximate bytes held by the audio buffers."""
+        return self.recording.capacity + self.spare_buffer.capacity
+
+
+class IdleReaper:
+    """
+    One task per worker that sweeps the open connections: buffers of
+    connections idle for release_after seconds are released, and connections
+    idle for timeout seconds are closed. Connections with an utterance in
+    flight are left alone.
+    """
+
+    def __init__(self, timeout=600.0, release_after=60.0, interval=30.0, close_code=4008):
+        self.timeout = timeout
+        self.release_after = release_after
+        self.interval = interval
+        self.close_code = close_code
+        self._consumers = set()
+        self._task = None
+
+    def register(self, consumer):
+        self._consumers.add(consumer)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def unregister(self, consumer):
+        self._consumers.discard(consumer)
+
+    def __len__(self):
+        return len(self._consumers)
+
+    async def sweep(self):
+        """Release or close idle connections; returns how many were closed."""
+        now = time.monotonic()
+        closed = 0
+        for consumer in list(self._consumers):
+            session = consumer.session
+            if session.busy:
+                continue
+            idle = session.idle_seconds(now)
+            if self.timeout and idle >= self.timeout:
+                self._consumers.discard(consumer)
+                logger.info(f"Closing websocket idle for {idle:.0f}s")
+                try:
+                    await consumer.close(code=self.close_code)
+                except Exception as e:
+                    logger.warning(f"Error closing idle websocket: {e}")
+                closed += 1
+            elif idle >= self.release_after and session.memory_bytes():
+                session.release_buffers()
+        return closed
+
+    async def _run(self):
+        while self._consumers:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Idle sweep failed: {e}")
+        self._task = None
+
+
+idle_reaper = IdleReaper(
+    timeout=settings.WS_IDLE_TIMEOUT_SECONDS,
+    release_after=settings.WS_IDLE_RELEASE_SECONDS,
+    interval=settings.WS_IDLE_SWEEP_SECONDS
+)
@@ -0,0 +1,79 @@
+import re
+import time
+
+NON_WORD_RE = re.compile(r"[^\w\s]")
+TERMINAL_PUNCTUATION = ('.', '?', '!')
+
+
+def normalize_transcript(text):
+    """Lowercase, drop punctuation and collapse whitespace for comparisons."""
+    return " ".join(NON_WORD_RE.sub(" ", (text or "").lower()).split())
+
+
+class PartialTranscriptTracker:
+    """
+    Decides when a partial transcript is worth speculating on: it must be
+    stable (unchanged for stable_partials consecutive updates, or flagged
+    stable by the client) and the endpoint must be likely (client hint or
+    terminal punctuation).
+    """
+
+    __slots__ = ('stable_partials', '_key', '_repeats')
+
+    def __init__(self, stable_partials=2):
+        self.stable_partials = stable_partials
+        self._key = ""
+        self._repeats = 0
+
+    def update(self, text, stable=False, endpoint_likely=False):
+        key = normalize_transcript(text)
+        if not key:
+            self.reset()
+            return False
+
+        if key == self._key:
+            self._repeats += 1
+        else:
+            self._key = key
+            self._repeats = 1
+
+        is_stable = stable or self._repeats >= self.stable_partials
+        is_endpoint = endpoint_likely or text.rstrip().endswith(TERMINAL_PUNCTUATION)
+        return is_stable and is_endpoint
+
+    def reset(self):
+        self._key = ""
+        self._repeats = 0
+
+
+class Speculation:
+    """An LLM request started from a partial transcript before the final one arrived."""
+
+    def __init__(self, text, task, cancel_token):
+        self.text = text
+        self.key = normalize_transcript(text)
+        self.task = task
+        self.cancel_token = cancel_token
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        task.add_done_callback(self._mark_finished)
+
+    def _mark_finished(self, task):
+        self.finished_at = time.monotonic()
+
+    def matches(self, text):
+        return self.key == normalize_transcript(text)
+
+    def latency_saved(self, final_ready_at):
+        """
+        Seconds the reply arrived earlier than if the LLM had started once the
+        final transcript was ready (assuming the same LLM duration).
+        """
+        finished_at = self.finished_at or time.monotonic()
+        llm_duration = finished_at - self.started_at
+        return max(0.0, llm_duration - max(0.0, finished_at - final_ready_at))
+
+    def cancel(self):
+        self.cancel_token.cancel()
+        if not self.task.done():
+            self.task.cancel()
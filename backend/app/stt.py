@@ -1,30 +1,61 @@
-import openai
-import io
 import os
+import time
 import base64
-import tempfile
-from groq import Groq
-import speech_recognition as sr
-from pydub import AudioSegment
+import importlib
 from dotenv import load_dotenv
+from django.conf import settings
+from .cancellation import UtteranceCancelled
+from .llm_router import LLMRouter, Provider
+from .metrics import metrics
+from .response_budget import response_budget, last_sentence_end, trim_to_sentence
+from .upstream import groq_client, openai_client, google_speech_url
+from .audio import BufferReader, decode_audio, transcode_to_flac, normalize_pcm, to_audio_data, split_on_silence
+from .formats import FORMATS, input_format, plan_conversion, wav_header
+from concurrent.futures import ThreadPoolExecutor
 load_dotenv()
 
-def speech_to_text(audio_base64: str) -> str:
+# Long recordings are split at pauses and the segments transcribed
+# concurrently on a pool shared by every request of this worker
+_segment_executor = ThreadPoolExecutor(
+    max_workers=settings.STT_SEGMENT_WORKERS,
+    thread_name_prefix="stt-segment"
+)
+
+def _audio_view(audio) -> memoryview:
+    """Accept base64 text (JSON protocol) or any bytes-like object as a memoryview."""
+    if isinstance(audio, str):
+        return memoryview(base64.b64decode(audio))
+    return memoryview(audio)
+
+def speech_to_text(audio, pcm_format=None) -> str:
     """
-    Convert base64-encoded audio into text using OpenAI Whisper API.
+    Convert audio (base64 string or bytes-like) into text using OpenAI Whisper API.
+    Formats Whisper accepts are uploaded as is under a matching filename;
+    raw PCM (pcm_format) only gets a WAV header and anything else is
+    transcoded to FLAC.
     """
-    if not audio_base64:
+    if not audio:
         return None
-    
-    # Decode base64 to bytes
-    audio_bytes = base64.b64decode(audio_base64)
 
-    # Wrap bytes in a file-like object
-    audio_file = io.BytesIO(audio_bytes)
-    audio_file.name = "audio.mp3"  # Whisper needs a filename (mp3/wav)
+    view = _audio_view(audio)
+    fmt = input_format(view, pcm_format)
+    conversion = plan_conversion(fmt, 'whisper')
+    metrics.increment(f'audio.conversion.whisper.{conversion}')
+
+    if conversion == 'passthrough':
+        payload, extension = view, FORMATS[fmt][0]
+    elif conversion == 'wrap':
+        header = wav_header(len(view), pcm_format.sample_rate, pcm_format.channels)
+        payload, extension = header + bytes(view), 'wav'
+    else:
+        payload, extension = transcode_to_flac(view, fmt), 'flac'
+
+    # Wrap the bytes in a file-like object without copying them; Whisper
+    # detects the format from the filename
+    audio_file = BufferReader(payload, name=f"audio.{extension}")
 
     # Transcribe
-    transcript = openai.audio.transcriptions.create(
+    transcript = openai_client().audio.transcriptions.create(
         model="whisper-1",
         file=audio_file
     )
@@ -37,8 +68,8 @@ def generate_response(user_text: str) -> str:
     """
     if not user_text:
         return None
-    
-    response = openai.chat.completions.create(
+
+    response = openai_client().chat.completions.create(
         model="gpt-4o-mini",
         messages=[
             {"role": "system", "content": "You are a helpful assistant that can answer questions and help with tasks."},
@@ -49,15 +80,84 @@ def generate_response(user_text: str) -> str:
     return response.choices[0].message.content
 
 
-def generate_response_groq(user_text: str) -> str:
+def _collect_stream(stream, cancel_token=None, budget=None) -> str:
+    """
+    Accumulate a streamed chat completion into a single string.
+    Cancelling the token closes the stream, which aborts the upstream request.
+    With a ResponseBudget, the stream is stopped at the first sentence
+    boundary past the budget's word count.
+    """
+    if cancel_token is not None:
+        cancel_token.on_cancel(stream.close)
+
+    parts = []
+    words = 0
+    finish_reason = None
+    try:
+        for chunk in stream:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if not choice.delta.content:
+                continue
+
+            parts.append(choice.delta.content)
+            if budget is None:
+                continue
+
+            # Whitespace count is a cheap running estimate of the word count
+            words += sum(1 for c in choice.delta.content if c.isspace())
+            if words >= budget.words:
+                text = "".join(parts)
+                end = last_sentence_end(text)
+                if end:
+                    # Enough to say: stop here, closing the stream ends the generation
+                    metrics.increment('llm.budget_stops')
+                    return text[:end]
+    except UtteranceCancelled:
+        raise
+    except Exception:
+        # Closing the stream from another thread surfaces as a read error here
+        if cancel_token is not None and cancel_token.cancelled:
+            raise UtteranceCancelled()
+        raise
+    finally:
+        stream.close()
+
+    text = "".join(parts)
+    if finish_reason == "length":
+        # Hit the token cap mid-sentence; do not speak half a sentence
+        metrics.increment('llm.budget_truncations')
+        text = trim_to_sentence(text)
+    return text
+
+def generate_embeddings(texts: list, dimensions: int = 256) -> list:
+    """
+    Embed a batch of texts using OpenAI text-embedding-3-small.
+    Returns one list of floats per input text.
+    """
+    if not texts:
+        return []
+
+    response = openai_client().embeddings.create(
+        model="text-embedding-3-small",
+        input=texts,
+        dimensions=dimensions
+    )
+
+    return [item.embedding for item in response.data]
+
+def generate_response_groq(user_text: str, cancel_token=None) -> str:
     """
     Generate a response using OpenAI gpt-oss-20b.
     """
     if not user_text:
         return None
-    
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    response = client.chat.completions.create(
+
+    response = groq_client().chat.completions.create(
         model="openai/gpt-oss-20b",
         messages=[
             {"role": "system", "content": """
@@ -68,28 +168,28 @@ Keep your responses short and concise and maintain a professional tone.
             {"role": "user", "content": user_text}
         ],
         temperature=0.5,
-        max_completion_tokens=8192,
+        max_completion_tokens=response_budget.max_completion_tokens(reasoning=True),
         top_p=1,
         reasoning_effort="low",
-        stream=False,
+        stream=True,
         stop=None
     )
 
-    return response.choices[0].message.content
+    return _collect_stream(response, cancel_token, budget=response_budget)
 
-def generate_response_with_history(user_text: str, conversation_history: list) -> str:
+def generate_response_with_history(user_text: str, conversation_history: list, cancel_token=None) -> str:
     """
-    Generate a response using OpenAI gpt-oss-20b with conversation history context.
+    Generate a response with conversation history context, routed to the
+    fastest configured provider (Groq gpt-oss-20b, OpenAI gpt-4o-mini).
     
     Args:
         user_text: Current user input
         conversation_history: List of previous conversations with 'user_text' and 'llm_response' keys
+        cancel_token: Optional CancelToken; cancelling it aborts the upstream request
     """
     if not user_text:
         return None
-    
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    
+
     # Build messages with conversation history
     messages = [
         {"role": "system", "content": """
@@ -101,10 +201,9 @@ Remember previous discussions and build upon them naturally.
         """}
     ]
     
-    # Add conversation history (limit to last 10 conversations to avoid token limits)
-    recent_history = conversation_history[-10:] if len(conversation_history) > 10 else conversation_history
-    
-    for conv in recent_history:
+    # Add conversation history: already bounded by the retrieval settings
+    # (RETRIEVAL_TOP_K relevant turns followed by RETRIEVAL_RECENT_TURNS recent ones)
+    for conv in conversation_history:
         if conv.get('user_text'):
             messages.append({"role": "user", "content": conv['user_text']})
         if conv.get('llm_response'):
@@ -112,75 +211,210 @@ Remember previous discussions and build upon them naturally.
     
     # Add current user input
     messages.append({"role": "user", "content": user_text})
-    
-    response = client.chat.completions.create(
+
+    # The router sends the request to the currently fastest provider
+    return llm_router.complete(messages, cancel_token=cancel_token)
+
+def complete_groq(messages: list, cancel_token=None) -> str:
+    """
+    Chat completion provider backed by Groq openai/gpt-oss-20b.
+    """
+    response = groq_client().chat.completions.create(
         model="openai/gpt-oss-20b",
         messages=messages,
         temperature=0.5,
-        max_completion_tokens=8192,
+        max_completion_tokens=response_budget.max_completion_tokens(reasoning=True),
         top_p=1,
         reasoning_effort="low",
-        stream=False,
+        stream=True,
         stop=None
     )
 
-    return response.choices[0].message.content
+    return _collect_stream(response, cancel_token, budget=response_budget)
+
+def complete_openai(messages: list, cancel_token=None) -> str:
+    """
+    Chat completion provider backed by OpenAI gpt-4o-mini.
+    """
+    response = openai_client().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0.5,
+        max_completion_tokens=response_budget.max_completion_tokens(),
+        stream=True
+    )
+
+    return _collect_stream(response, cancel_token, budget=response_budget)
+
+# Providers the router may use, enabled only when their API key is configured
+LLM_PROVIDERS = {
+    "groq": (complete_groq, "GROQ_API_KEY"),
+    "openai": (complete_openai, "OPENAI_API_KEY"),
+}
+
+def build_llm_router() -> LLMRouter:
+    """
+    Build the router from the LLM_PROVIDERS, LLM_HEDGE and
+    LLM_HEDGE_MIN_DELAY settings.
+    """
+    providers = [
+        Provider(name, LLM_PROVIDERS[name][0])
+        for name in settings.LLM_PROVIDERS
+        if name in LLM_PROVIDERS and os.getenv(LLM_PROVIDERS[name][1])
+    ]
+    if not providers:
+        # No key for any of them: use the listed providers anyway (Groq if
+        # none is listed) so errors surface as before, and readiness probes
+        # the providers this deployment asked for
+        providers = [
+            Provider(name, LLM_PROVIDERS[name][0]) for name in settings.LLM_PROVIDERS if name in LLM_PROVIDERS
+        ] or [Provider("groq", complete_groq)]
+
+    return LLMRouter(
+        providers,
+        hedge=settings.LLM_HEDGE,
+        hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY
+    )
 
-def speech_to_text_google(audio_base64: str) -> str:
+llm_router = build_llm_router()
+
+# Modules each engine needs. They are imported on first use rather than at
+# module import (openai alone takes about half a second), so warm_up() can
+# preload just the engines this deployment uses.
+ENGINE_MODULES = {
+    "google": ("speech_recognition",),
+    "whisper": ("openai",),
+    "groq": ("groq",),
+    "openai": ("openai",),
+    "gtts": ("gtts",),
+}
+
+def configured_engines() -> list:
+    """Engines this worker will use: Google STT, the routed LLM providers and, if enabled, OpenAI embeddings and TTS."""
+    engines = ["google"]
+    engines += [provider.name for provider in llm_router.providers]
+    if settings.EMBEDDING_ENGINE == "openai":
+        engines.append("openai")
+    if settings.TTS_ENABLED:
+        engines.append(settings.TTS_ENGINE)
+    return list(dict.fromkeys(engines))
+
+def warm_up(engines=None) -> dict:
+    """
+    Import the modules of the given engines (default: configured_engines())
+    ahead of the first request. Returns the seconds spent per engine.
+    """
+    timings = {}
+    for engine in engines or configured_engines():
+        start = time.perf_counter()
+        for module in ENGINE_MODULES.get(engine, ()):
+            importlib.import_module(module)
+        timings[engine] = time.perf_counter() - start
+        metrics.set_gauge(f"startup.warm_up_seconds.{engine}", round(timings[engine], 4))
+    return timings
+
+def speech_to_text_google(audio, cancel_token=None, pcm_format=None) -> str:
     """
-    Convert base64-encoded audio into text using free Google Web Speech API.
+    Convert audio into text using free Google Web Speech API.
     (Note: Requires internet, but no API key)
+
+    Args:
+        audio: base64 string, or raw bytes / read-only memoryview from an AudioBuffer
+        cancel_token: Optional CancelToken checked before each upstream request
+        pcm_format: PcmFormat when the client sent headerless PCM
     """
-    if not audio_base64:
+    if not audio:
         return None
 
-    # Decode base64 to bytes
-    audio_bytes = base64.b64decode(audio_base64)
+    import speech_recognition as sr
 
-    # Create temporary files for processing
-    temp_input_file = None
-    temp_wav_file = None
-    
     try:
-        # Save the original audio (likely WebM) to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_input:
-            temp_input.write(audio_bytes)
-            temp_input_file = temp_input.name
-
-        # Convert WebM to WAV using pydub
-        audio_segment = AudioSegment.from_file(temp_input_file, format="webm")
-        
-        # Create temporary WAV file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_wav:
-            temp_wav_file = temp_wav.name
-        
-        # Export as WAV
-        audio_segment.export(temp_wav_file, format="wav")
-
-        # Use speech_recognition with the converted WAV file
-        recognizer = sr.Recognizer()
-        with sr.AudioFile(temp_wav_file) as source:
-            audio = recognizer.record(source)  # Read entire audio file
-
-        # Use free Google Web Speech API
-        text = recognizer.recognize_google(audio)
-        return text
-        
+        return transcribe_google(audio, cancel_token, pcm_format=pcm_format)
+    except UtteranceCancelled:
+        raise
     except sr.UnknownValueError:
         return "Could not understand audio"
     except sr.RequestError as e:
         return f"Google Speech Recognition error: {e}"
     except Exception as e:
         return f"Audio processing error: {e}"
-    finally:
-        # Clean up temporary files
-        if temp_input_file and os.path.exists(temp_input_file):
-            try:
-                os.unlink(temp_input_file)
-            except:
-                pass
-        if temp_wav_file and os.path.exists(temp_wav_file):
-            try:
-                os.unlink(temp_wav_file)
-            except:
-                pass
\ No newline at end of file
+
+def transcribe_google(audio, cancel_token=None, executor=None, pcm_format=None) -> str:
+    """
+    Transcribe audio with the Google Web Speech API, raising on failure
+    (sr.UnknownValueError when no speech was recognized) instead of
+    returning an error string. Long recordings are split at pauses and the
+    segments transcribed concurrently on executor (default: the shared
+    segment pool).
+    """
+    import speech_recognition as sr
+
+    # WAV and raw PCM are read in place; other formats are decoded by ffmpeg
+    view = _audio_view(audio)
+    fmt = input_format(view, pcm_format)
+    metrics.increment(f'audio.conversion.google.{plan_conversion(fmt, "google")}')
+    pcm, sample_width, channels, frame_rate = decode_audio(view, fmt, pcm_format)
+
+    # Downmix and resample to 16 kHz mono 16-bit; browsers often record
+    # 48 kHz stereo, several times more data than recognition needs
+    pcm = normalize_pcm(pcm, sample_width, channels, frame_rate)
+
+    # Skip the upstream request if the utterance was dropped while converting
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    segments = split_on_silence(pcm, max_segment_seconds=settings.STT_MAX_SEGMENT_SECONDS)
+    if len(segments) > 1:
+        return transcribe_segments_google(segments, cancel_token, executor=executor)
+
+    # Use free Google Web Speech API
+    recognizer = sr.Recognizer()
+    return recognizer.recognize_google(to_audio_data(pcm), endpoint=google_speech_url())
+
+def _recognize_segment_google(pcm, cancel_token=None) -> str:
+    """Transcribe one segment; a segment without speech yields an empty string."""
+    import speech_recognition as sr
+
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    try:
+        return sr.Recognizer().recognize_google(to_audio_data(pcm), endpoint=google_speech_url())
+    except sr.UnknownValueError:
+        return ""
+
+def transcribe_segments_google(segments: list, cancel_token=None, executor=None) -> str:
+    """
+    Transcribe ordered PCM segments of one long recording concurrently and
+    stitch the texts back together in order. Wall-clock time follows the
+    slowest segment rather than the total duration.
+    """
+    executor = executor or _segment_executor
+    futures = [executor.submit(_recognize_segment_google, pcm, cancel_token) for pcm in segments]
+    try:
+        texts = [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+    text = stitch_transcripts(texts)
+    if not text:
+        import speech_recognition as sr
+        raise sr.UnknownValueError()
+    return text
+
+def stitch_transcripts(texts: list) -> str:
+    """
+    Join segment transcripts, dropping words repeated at a boundary because
+    consecutive segments overlap.
+    """
+    words = []
+    for text in texts:
+        next_words = text.split()
+        # Longest suffix of what we have that is a prefix of the next segment
+        for size in range(min(len(words), len(next_words), 8), 0, -1):
+            if [w.lower() for w in words[-size:]] == [w.lower() for w in next_words[:size]]:
+                next_words = next_words[size:]
+                break
+        words.extend(next_words)
+    return " ".join(words)
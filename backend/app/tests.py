@@ -1,3 +1,557 @@
-from django.test import TestCase
+import gc
+import base64
+import os
+import json
+import time
+import asyncio
+import threading
+from datetime import timedelta
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from channels.testing import WebsocketCommunicator
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
+from rest_framework_simplejwt.tokens import AccessToken
+from . import upstream
+from .consumers import AudioConsumer
+from .evaluation import Fixture, evaluate_engine
+from .cassette import Cassette, CassetteServer, request_key
+from .cancellation import CancelToken, UtteranceCancelled
+from .llm_router import LLMRouter, Provider
+from .models import User, Conversation, TranscriptionJob
+from .persistence import ConversationWriter
+from .profiler import SamplingProfiler
+from .purge import clear_conversations
+from .retrieval import VectorIndexRegistry, backfill_embeddings
+from .revocation import RevocationSet
+from .scheduler import FairScheduler
+from .search import search_conversations
+from .stt import build_llm_router, generate_response_with_history
+from .transcription import ENGINES, TranscriptionWorkerPool
 
-# Create your tests here.
+
+class UtteranceCancellationTests(TransactionTestCase):
+    """
+    The transcript of each utterance is its audio. The answer to 'first'
+    arrives only after the utterance was cancelled, like a response that
+    was already on its way, so only the consumer can keep it from the user.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email='talker@example.com', name='Talker')
+        self.writer = ConversationWriter(batch_size=100, flush_interval=60)
+        self.llm_started = threading.Event()
+        self.llm_finished = threading.Event()
+        for patcher in (
+            mock.patch('app.consumers.conversation_writer', self.writer),
+            mock.patch('app.consumers.speech_to_text_google', self.transcribe),
+            mock.patch('app.consumers.generate_response_with_history', self.answer),
+            mock.patch.object(AudioConsumer, 'get_conversation_history', mock.AsyncMock(return_value=[])),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.writer.close(timeout=1)
+
+    @staticmethod
+    def transcribe(audio, cancel_token=None, pcm_format=None):
+        return bytes(audio).decode()
+
+    def answer(self, user_text, history, cancel_token=None):
+        if user_text == 'first':
+            self.llm_started.set()
+            try:
+                while not cancel_token.cancelled:
+                    time.sleep(0.01)
+            finally:
+                self.llm_finished.set()
+        return f'answer to {user_text}'
+
+    async def connect(self):
+        token = await asyncio.to_thread(lambda: str(AccessToken.for_user(self.user)))
+        communicator = WebsocketCommunicator(AudioConsumer.as_asgi(), f'/ws/audio/?token={token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_established')
+        return communicator
+
+    async def say(self, communicator, text):
+        await communicator.send_json_to({'type': 'audio_data', 'audio_data': base64.b64encode(text.encode()).decode()})
+
+    def written_turns(self):
+        self.assertTrue(self.writer.flush())
+        return list(Conversation.objects.values_list('user_text', 'llm_response'))
+
+    async def test_barge_in_drops_the_superseded_reply(self):
+        communicator = await self.connect()
+        await self.say(communicator, 'first')
+        self.assertTrue(await asyncio.to_thread(self.llm_started.wait, 5))
+
+        await self.say(communicator, 'second')
+        reply = await communicator.receive_json_from(timeout=5)
+        self.assertEqual((reply['text'], reply['llm_response']), ('second', 'answer to second'))
+        self.assertTrue(await asyncio.to_thread(self.llm_finished.wait, 5))
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.disconnect()
+
+        self.assertEqual(await asyncio.to_thread(self.written_turns), [('second', 'answer to second')])
+
+    async def test_disconnect_drops_the_in_flight_reply(self):
+        communicator = await self.connect()
+        await self.say(communicator, 'first')
+        self.assertTrue(await asyncio.to_thread(self.llm_started.wait, 5))
+
+        await communicator.disconnect()
+        self.assertTrue(await asyncio.to_thread(self.llm_finished.wait, 5))
+
+        self.assertEqual(await asyncio.to_thread(self.written_turns), [])
+
+
+# SQLite checks foreign keys when the transaction commits, so the writer's
+# failures only show up outside TestCase's wrapping transaction
+class ConversationWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.writer = ConversationWriter(batch_size=100, flush_interval=60, retry_backoff=0.01, max_backoff=0.01)
+        self.user = User.objects.create(email='kept@example.com', name='Kept')
+
+    def tearDown(self):
+        self.writer.close(timeout=1)
+
+    def test_bad_row_is_dropped_and_the_rest_of_the_batch_written(self):
+        gone = User.objects.create(email='gone@example.com', name='Gone')
+        self.writer.enqueue(gone, 'hello', 'hi')
+        self.writer.enqueue(self.user, 'how are you', 'fine')
+        User.objects.filter(id=gone.id).delete()
+
+        self.assertTrue(self.writer.flush())
+        self.assertEqual(self.writer.pending_count(), 0)
+        self.assertEqual(
+            list(Conversation.objects.values_list('user_id', 'user_text')),
+            [(self.user.id, 'how are you')]
+        )
+
+    def test_clearing_conversations_drops_the_users_queued_turns(self):
+        other = User.objects.create(email='other@example.com', name='Other')
+        self.writer.enqueue(self.user, 'hello', 'hi')
+        self.writer.enqueue(other, 'hello', 'hi')
+
+        with mock.patch('app.purge.conversation_writer', self.writer), \
+                mock.patch.object(self.writer, 'flush', side_effect=AssertionError('flushed in the request')):
+            purge = clear_conversations(self.user)
+
+        self.assertEqual(purge.total, 0)
+        self.assertEqual(self.writer.pending_count(), 1)
+
+    def test_turns_queued_before_a_clear_are_not_written_by_any_writer(self):
+        # Another worker's writer, and a batch this one already took for writing
+        elsewhere = ConversationWriter(batch_size=100, flush_interval=60)
+        self.addCleanup(elsewhere.close, timeout=1)
+        elsewhere.enqueue(self.user, 'before, elsewhere', 'hi')
+        self.writer.enqueue(self.user, 'before, taken', 'hi')
+        with self.writer._cond:
+            taken = self.writer._take_batch()
+
+        with mock.patch('app.purge.conversation_writer', self.writer):
+            clear_conversations(self.user)
+        elsewhere.enqueue(self.user, 'after', 'hi')
+
+        self.assertTrue(self.writer._write(taken))
+        self.assertTrue(elsewhere.flush())
+        self.assertEqual(list(Conversation.objects.values_list('user_text', flat=True)), ['after'])
+
+    def test_flush_gives_up_on_transient_errors(self):
+        self.writer.enqueue(self.user, 'hello', 'hi')
+        with mock.patch.object(Conversation.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            self.assertFalse(self.writer.flush(retries=2))
+        self.assertEqual(self.writer.pending_count(), 1)
+
+        self.assertTrue(self.writer.flush())
+        self.assertEqual(Conversation.objects.filter(user=self.user).count(), 1)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='searcher@example.com', name='Searcher')
+
+    def say(self, user_text, llm_response='', user=None):
+        return Conversation.objects.create(user=user or self.user, user_text=user_text, llm_response=llm_response)
+
+    def search(self, query):
+        return [conversation.user_text for conversation in search_conversations(self.user, query)]
+
+    def test_best_matches_first(self):
+        self.say('After a long day at work I walked the dog and read about the python in the park zoo')
+        self.say('Python questions', 'Python is a language; Python code is readable')
+        self.say('Python', user=User.objects.create(email='other@example.com', name='Other'))
+
+        self.assertEqual(self.search('python'), [
+            'Python questions',
+            'After a long day at work I walked the dog and read about the python in the park zoo',
+        ])
+        self.assertEqual(self.search('python language'), ['Python questions'])
+
+    def test_words_match_as_prefixes(self):
+        self.say('How do I configure nginx?')
+        self.assertEqual(self.search('config'), ['How do I configure nginx?'])
+        self.assertEqual(self.search('nginxconf'), [])
+
+    def test_quotes_and_operators_are_searched_as_words(self):
+        self.say('Is it "NEAR" or near?', 'Either: NOT AND OR are just words here')
+        for query in ('"near', 'near OR', 'NOT near*', 'near) AND (', 'NEAR(near', '-near ^near :near'):
+            self.assertEqual(self.search(query), ['Is it "NEAR" or near?'], query)
+        self.assertEqual(self.search('"*" ( )'), [])
+
+    def test_edited_text_is_reindexed(self):
+        conversation = self.say('I like tea')
+        Conversation.objects.filter(id=conversation.id).update(user_text='I like coffee')
+        self.assertEqual(self.search('tea'), [])
+        self.assertEqual(self.search('coffee'), ['I like coffee'])
+
+
+@override_settings(EMBEDDING_ENGINE='openai', EMBEDDING_DIM=8, EMBEDDING_BATCH_SIZE=2)
+class RetrievalTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='rememberer@example.com', name='Rememberer')
+        for i in range(5):
+            Conversation.objects.create(user=self.user, user_text=f'question {i}', llm_response=f'answer {i}')
+        self.requests = []
+        patcher = mock.patch('app.retrieval.generate_embeddings', self.generate_embeddings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def generate_embeddings(self, texts, dimensions):
+        self.requests.append(len(texts))
+        return [[1.0] * dimensions for _ in texts]
+
+    def test_loading_an_index_queues_the_backfill_instead_of_embedding(self):
+        registry = VectorIndexRegistry()
+        self.assertEqual(registry.get(self.user.id).size, 0)
+        self.assertEqual(self.requests, [])
+        self.assertEqual(registry.next_backfill(), (self.user.id, 0))
+        self.assertIsNone(registry.next_backfill())
+
+    def test_backfill_embeds_in_bounded_batches(self):
+        self.assertEqual(backfill_embeddings(self.user.id, max_batches=1), 2)
+        self.assertEqual(backfill_embeddings(self.user.id), 3)
+        self.assertEqual(self.requests, [2, 2, 1])
+        self.assertEqual(VectorIndexRegistry().get(self.user.id).size, 5)
+
+    def test_every_retrieved_turn_reaches_the_prompt(self):
+        history = [{'user_text': f'question {i}', 'llm_response': f'answer {i}'} for i in range(12)]
+        with mock.patch('app.stt.llm_router') as router:
+            generate_response_with_history('and now?', history)
+        messages = router.complete.call_args.args[0]
+        self.assertEqual([m['content'] for m in messages if m['role'] == 'user'][0], 'question 0')
+        self.assertEqual(len(messages), 1 + 2 * len(history) + 1)
+
+
+class FakeProvider(Provider):
+    """Answers after delay seconds (or raises error), stopping early when cancelled."""
+
+    def __init__(self, name, delay=0.0, error=None):
+        super().__init__(name, self._complete)
+        self.delay = delay
+        self.error = error
+        self.tokens = []
+
+    def _complete(self, messages, cancel_token=None):
+        self.tokens.append(cancel_token)
+        done = threading.Event()
+        cancel_token.on_cancel(done.set)
+        done.wait(self.delay)
+        cancel_token.raise_if_cancelled()
+        if self.error:
+            raise self.error
+        return f'{self.name}: {messages[-1]["content"]}'
+
+
+class LLMRouterTests(SimpleTestCase):
+    messages = [{'role': 'user', 'content': 'hello'}]
+
+    def test_fails_over_to_the_next_provider(self):
+        broken = FakeProvider('broken', error=RuntimeError('503'))
+        router = LLMRouter([broken, FakeProvider('backup')])
+
+        self.assertEqual(router.complete(self.messages), 'backup: hello')
+        self.assertGreater(router.stats['broken'].error_rate, 0)
+        # The failed provider now ranks last
+        self.assertEqual([provider.name for provider in router.ranked()], ['backup', 'broken'])
+
+    def test_raises_the_last_error_when_every_provider_fails(self):
+        router = LLMRouter([FakeProvider('a', error=RuntimeError('a down')), FakeProvider('b', error=RuntimeError('b down'))])
+        with self.assertRaisesMessage(RuntimeError, 'b down'):
+            router.complete(self.messages)
+
+    def test_hedges_after_the_p95_delay_and_cancels_the_loser(self):
+        slow, fast = FakeProvider('slow', delay=5.0), FakeProvider('fast', delay=0.01)
+        router = LLMRouter([slow, fast], hedge=True, hedge_min_delay=0.05)
+        for _ in range(10):
+            router.stats['slow'].record_success(0.2)
+            router.stats['fast'].record_success(0.5)
+        self.assertEqual(router.hedge_delay(slow), 0.2)
+
+        start = time.monotonic()
+        answer = router.complete(self.messages)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(answer, 'fast: hello')
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 2.0)
+        self.assertTrue(slow.tokens[0].cancelled)
+
+    def test_no_hedge_when_the_primary_answers_in_time(self):
+        primary, secondary = FakeProvider('primary', delay=0.01), FakeProvider('secondary')
+        router = LLMRouter([primary, secondary], hedge=True, hedge_min_delay=1.0)
+
+        self.assertEqual(router.complete(self.messages), 'primary: hello')
+        self.assertEqual(secondary.tokens, [])
+
+    def test_cancel_token_aborts_the_request(self):
+        provider = FakeProvider('slow', delay=5.0)
+        router = LLMRouter([provider, FakeProvider('backup')])
+        token = CancelToken()
+        threading.Timer(0.05, token.cancel).start()
+
+        start = time.monotonic()
+        with self.assertRaises(UtteranceCancelled):
+            router.complete(self.messages, cancel_token=token)
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertTrue(provider.tokens[0].cancelled)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Local stand-in for a provider: every request gets an empty model list."""
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        body = json.dumps({'object': 'list', 'data': []}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class UpstreamTests(SimpleTestCase):
+    def monitor(self, probes):
+        monitor = upstream.UpstreamMonitor(timeout=1.0)
+        patcher = mock.patch.dict(upstream.PROBES, probes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        monitor.statuses = {name: upstream.UpstreamStatus(name, role) for name, (role, _) in probes.items()}
+        return monitor
+
+    def test_ready_needs_one_reachable_upstream_per_role(self):
+        def down(timeout):
+            raise ConnectionError('unreachable')
+
+        monitor = self.monitor({
+            'google': ('stt', lambda timeout: None),
+            'groq': ('llm', down),
+            'openai': ('llm', lambda timeout: None),
+        })
+        self.assertFalse(monitor.ready())
+        monitor.probe_all()
+        self.assertTrue(monitor.ready())
+        self.assertEqual(monitor.snapshot()['groq']['error'], 'ConnectionError: unreachable')
+
+        upstream.PROBES['openai'] = ('llm', down)
+        monitor.probe_all()
+        self.assertFalse(monitor.ready())
+
+    def test_probes_go_to_the_stand_in_endpoint(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        previous = upstream.set_endpoints(openai=f'{url}/v1', google=f'{url}/google')
+        self.addCleanup(upstream.set_endpoints, **previous)
+        StandInHandler.paths.clear()
+        with mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'}):
+            upstream.probe_openai(timeout=2)
+        upstream.probe_google(timeout=2)
+
+        self.assertEqual(StandInHandler.paths, ['/v1/models', '/google'])
+
+    def test_router_uses_the_listed_providers_with_a_key(self):
+        with mock.patch.dict(os.environ, {'GROQ_API_KEY': '', 'OPENAI_API_KEY': 'test'}):
+            self.assertEqual([provider.name for provider in build_llm_router().providers], ['openai'])
+
+    @override_settings(LLM_PROVIDERS=['openai'])
+    def test_router_without_keys_keeps_the_listed_providers(self):
+        with mock.patch.dict(os.environ, {'GROQ_API_KEY': '', 'OPENAI_API_KEY': ''}):
+            self.assertEqual([provider.name for provider in build_llm_router().providers], ['openai'])
+
+
+class CassetteTests(SimpleTestCase):
+    def test_request_key_ignores_json_order_but_not_the_token_budget(self):
+        key = lambda body: request_key('POST', '/openai/chat/completions', 'application/json', body)
+        self.assertEqual(key(b'{"model": "m", "max_tokens": 64}'), key(b'{"max_tokens": 64, "model": "m"}'))
+        self.assertNotEqual(key(b'{"model": "m", "max_tokens": 64}'), key(b'{"model": "m", "max_tokens": 128}'))
+
+    @override_settings(UPSTREAM_MAX_RETRIES=0)
+    def test_missing_recording_is_requested_once_and_counted_once(self):
+        cassette = Cassette('unused.json')
+        lookup = mock.patch.object(cassette, 'get', wraps=cassette.get)
+        with CassetteServer(cassette), lookup as get, mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'replay'}):
+            for _ in range(2):
+                with self.assertRaises(Exception):
+                    upstream.openai_client().models.list()
+
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(cassette.misses, 1)
+
+
+class EvaluationTests(SimpleTestCase):
+    def test_memory_is_measured_with_one_extra_call(self):
+        fixtures = [Fixture(f'clip{i}.wav', b'x' * (i + 1), f'words {i}', 1.0) for i in range(3)]
+        calls = []
+
+        result = evaluate_engine('fake', 'stt', lambda audio: calls.append(audio) or 'words', fixtures)
+
+        # Warm-up, one timed call per fixture, then the largest fixture traced
+        self.assertEqual(calls, [b'x', b'x', b'xx', b'xxx', b'xxx'])
+        self.assertEqual(result['runs'], 3)
+        self.assertIsNotNone(result['peak_memory_mib'])
+
+
+class TranscriptionWorkerPoolTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='batch@example.com', name='Batch')
+        self.pool = TranscriptionWorkerPool(workers=1, stale_after=0.3, max_attempts=1)
+
+    def queue(self, engine):
+        TranscriptionJob.objects.create(user=self.user, engine=engine, audio=b'audio', size=5)
+        return self.pool.claim_next()
+
+    def test_long_job_keeps_its_lease(self):
+        statuses = []
+
+        def slow(audio, executor):
+            time.sleep(0.6)
+            # Past stale_after since the claim: without the heartbeat this requeues the job
+            self.pool.requeue_stale()
+            statuses.append(TranscriptionJob.objects.get(id=job.id).status)
+            return 'done'
+
+        with mock.patch.dict(ENGINES, {'slow': slow}):
+            job = self.queue('slow')
+            self.pool.process(job)
+
+        self.assertEqual(statuses, [TranscriptionJob.RUNNING])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.text, job.attempts), (TranscriptionJob.DONE, 'done', 1))
+
+    def test_heartbeat_closes_its_connection(self):
+        with mock.patch.dict(ENGINES, {'slow': lambda audio, executor: time.sleep(0.2) or 'done'}), \
+                mock.patch('app.transcription.connection') as heartbeat_connection:
+            self.pool.process(self.queue('slow'))
+
+        heartbeat_connection.close.assert_called_once_with()
+
+    def test_failed_job_drops_its_audio(self):
+        def broken(audio, executor):
+            raise ValueError('not audio')
+
+        with mock.patch.dict(ENGINES, {'broken': broken}):
+            job = self.queue('broken')
+            self.pool.process(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, TranscriptionJob.FAILED)
+        self.assertIsNone(job.audio)
+
+
+class FairSchedulerTests(SimpleTestCase):
+    def test_failure_after_the_caller_gave_up_is_not_reported_as_unretrieved(self):
+        scheduler = FairScheduler(slots=1)
+        started, release = threading.Event(), threading.Event()
+
+        def interrupted():
+            started.set()
+            release.wait(2)
+            raise UtteranceCancelled()
+
+        async def barge_in():
+            loop = asyncio.get_running_loop()
+            unhandled = []
+            loop.set_exception_handler(lambda loop, context: unhandled.append(context['message']))
+
+            call = asyncio.ensure_future(scheduler.run(SimpleNamespace(id=1, is_staff=False), interrupted))
+            await loop.run_in_executor(None, started.wait, 2)
+            call.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await call
+            release.set()
+            while scheduler.snapshot()['running']:
+                await asyncio.sleep(0.01)
+            gc.collect()
+            return unhandled
+
+        self.assertEqual(asyncio.run(barge_in()), [])
+
+
+class RevocationSetTests(TestCase):
+    def blacklist(self, count):
+        expires_at = timezone.now() + timedelta(hours=1)
+        for _ in range(count):
+            index = OutstandingToken.objects.count()
+            token = OutstandingToken.objects.create(jti=f'jti-{index}', token=f'token-{index}', expires_at=expires_at)
+            BlacklistedToken.objects.create(token=token)
+
+    def test_refresh_past_the_configured_capacity_is_incremental(self):
+        self.blacklist(5)
+        revocation = RevocationSet(capacity=2, refresh_interval=0)
+
+        with mock.patch.object(revocation, '_rebuild', wraps=revocation._rebuild) as rebuild:
+            self.assertTrue(revocation.is_revoked('jti-0'))
+            self.blacklist(1)
+            self.assertTrue(revocation.is_revoked('jti-5'))
+            self.assertFalse(revocation.is_revoked('not-revoked'))
+
+        self.assertEqual(rebuild.call_count, 1)
+
+
+class SamplingProfilerTests(SimpleTestCase):
+    def profile(self, work, include_idle=False):
+        profiler = SamplingProfiler()
+        profiler.start(seconds=5, interval=0.005, include_idle=include_idle)
+        try:
+            work()
+        finally:
+            profiler.stop()
+        while profiler.running:
+            time.sleep(0.01)
+        return profiler.result()
+
+    def test_routed_llm_call_is_tagged_llm(self):
+        router = LLMRouter([FakeProvider('groq', delay=0.2)])
+        # The provider waits like a streaming HTTP read, so count idle frames too
+        result = self.profile(lambda: router.complete([{'role': 'user', 'content': 'hi'}]), include_idle=True)
+
+        self.assertGreater(result['stages'].get('llm', 0), 0)
+        self.assertIn('llm_router.LLMRouter._attempt', result['collapsed'])
+
+    def test_provider_function_sets_the_stage(self):
+        def complete_groq():
+            deadline = time.monotonic() + 0.2
+            while time.monotonic() < deadline:
+                pass
+
+        def work():
+            thread = threading.Thread(target=complete_groq, name='some-thread')
+            thread.start()
+            thread.join()
+
+        result = self.profile(work)
+        self.assertGreater(result['stages'].get('llm', 0), 0)
@@ -0,0 +1,221 @@
+import time
+import logging
+import subprocess
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+from .models import TranscriptionJob
+from .metrics import metrics
+from .stt import transcribe_google, speech_to_text
+
+logger = logging.getLogger(__name__)
+
+def _transcribe_google(audio, executor):
+    import speech_recognition as sr
+    try:
+        return transcribe_google(audio, executor=executor)
+    except sr.UnknownValueError:
+        # A recording without recognizable speech is a result, not a failure
+        return ''
+
+
+# Engines a job can ask for; each takes the raw upload bytes
+ENGINES = {
+    'google': _transcribe_google,
+    'whisper': lambda audio, executor: speech_to_text(audio),
+}
+
+
+def job_as_dict(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'engine': job.engine,
+        'filename': job.filename,
+        'size': job.size,
+        'text': job.text,
+        'error': job.error,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class TranscriptionWorkerPool:
+    """
+    Threads that process queued TranscriptionJob rows.
+
+    Jobs live in the database, so any number of processes can run a pool
+    (web workers in-process, or dedicated ones via
+    `manage.py run_transcription_workers`). A job is claimed with a
+    conditional UPDATE, so each is processed once. While a job runs its
+    started_at is refreshed every stale_after / 3 seconds; jobs whose
+    started_at is older than stale_after (their worker died) are queued
+    again, up to max_attempts in total. The pool uses its own threads and segment
+    executor, never the websocket event loop or the interactive STT pool.
+    """
+
+    def __init__(self, workers=2, poll_interval=2.0, stale_after=900.0, max_attempts=3):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self._wake = threading.Condition()
+        self._pending_wakeups = 0
+        self._stop = threading.Event()
+        self._threads = []
+        self._segment_executor = None
+
+    def start(self):
+        if self._threads or self.workers <= 0:
+            return
+        self._segment_executor = ThreadPoolExecutor(
+            max_workers=self.workers * 2,
+            thread_name_prefix='transcription-segment'
+        )
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'transcription-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """A job was queued: wake an idle worker instead of waiting for the next poll."""
+        with self._wake:
+            self._pending_wakeups += 1
+            self._wake.notify()
+
+    def run_forever(self):
+        """Run the pool in the foreground (management command)."""
+        self.start()
+        try:
+            while not self._stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def requeue_stale(self):
+        cutoff = timezone.now() - timedelta(seconds=self.stale_after)
+        stale = TranscriptionJob.objects.filter(status=TranscriptionJob.RUNNING, started_at__lt=cutoff)
+        failed = stale.filter(attempts__gte=self.max_attempts).update(
+            status=TranscriptionJob.FAILED,
+            error='Worker stopped while processing the job',
+            audio=None,
+            finished_at=timezone.now()
+        )
+        requeued = stale.update(status=TranscriptionJob.QUEUED)
+        if failed or requeued:
+            logger.warning(f"Requeued {requeued} and failed {failed} stale transcription jobs")
+
+    def claim_next(self):
+        """Mark the oldest queued job as running for this worker and return it, or None."""
+        candidates = TranscriptionJob.objects.filter(
+            status=TranscriptionJob.QUEUED
+        ).order_by('id').values_list('id', flat=True)[:self.workers * 2]
+
+        for job_id in candidates:
+            claimed = TranscriptionJob.objects.filter(id=job_id, status=TranscriptionJob.QUEUED).update(
+                status=TranscriptionJob.RUNNING,
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1
+            )
+            if claimed:
+                return TranscriptionJob.objects.get(id=job_id)
+        return None
+
+    def process(self, job):
+        engine = ENGINES.get(job.engine, ENGINES['google'])
+        metrics.observe('transcription.queue_wait_seconds', (job.started_at - job.created_at).total_seconds())
+        start = time.monotonic()
+        processing = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job.id, processing), name='transcription-heartbeat', daemon=True
+        )
+        heartbeat.start()
+        try:
+            text = engine(bytes(job.audio), self._segment_executor)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}".rstrip(': ')
+            retry = job.attempts < self.max_attempts and not _is_permanent(e)
+            update = {'status': TranscriptionJob.QUEUED, 'error': error, 'finished_at': None}
+            if not retry:
+                # Nothing will read the upload again
+                update.update(status=TranscriptionJob.FAILED, audio=None, finished_at=timezone.now())
+            TranscriptionJob.objects.filter(id=job.id).update(**update)
+            metrics.increment('transcription.jobs.retried' if retry else 'transcription.jobs.failed')
+            logger.warning(f"Transcription job {job.id} failed (attempt {job.attempts}): {error}")
+            return
+        finally:
+            processing.set()
+            heartbeat.join()
+
+        TranscriptionJob.objects.filter(id=job.id).update(
+            status=TranscriptionJob.DONE,
+            text=text or '',
+            error=None,
+            audio=None,
+            finished_at=timezone.now()
+        )
+        metrics.increment('transcription.jobs.done')
+        metrics.observe('transcription.job_seconds', time.monotonic() - start)
+
+    def _heartbeat(self, job_id, done):
+        """Keep a long job's lease fresh so requeue_stale does not hand it to another worker."""
+        while not done.wait(self.stale_after / 3):
+            try:
+                TranscriptionJob.objects.filter(id=job_id, status=TranscriptionJob.RUNNING).update(
+                    started_at=timezone.now()
+                )
+            except Exception as e:
+                logger.warning(f"Could not refresh transcription job {job_id}: {e}")
+        # The thread ends here; close_old_connections() would keep the
+        # connection open for DB_CONN_MAX_AGE, with nobody left to reuse it
+        connection.close()
+
+    def _run(self):
+        last_stale_check = 0.0
+        while not self._stop.is_set():
+            job = None
+            try:
+                if time.monotonic() - last_stale_check > self.poll_interval * 10:
+                    last_stale_check = time.monotonic()
+                    self.requeue_stale()
+                job = self.claim_next()
+                if job is not None:
+                    self.process(job)
+            except Exception as e:
+                logger.error(f"Transcription worker error: {e}")
+            finally:
+                close_old_connections()
+
+            if job is None:
+                with self._wake:
+                    if not self._pending_wakeups:
+                        self._wake.wait(self.poll_interval)
+                    self._pending_wakeups = max(0, self._pending_wakeups - 1)
+
+
+def _is_permanent(error):
+    """Errors that retrying the same audio cannot fix (undecodable audio)."""
+    return isinstance(error, (ValueError, subprocess.CalledProcessError))
+
+
+transcription_pool = TranscriptionWorkerPool(
+    workers=settings.TRANSCRIPTION_WORKERS,
+    poll_interval=settings.TRANSCRIPTION_POLL_INTERVAL,
+    max_attempts=settings.TRANSCRIPTION_MAX_ATTEMPTS
+)
@@ -0,0 +1,274 @@
+import os
+import io
+import mmap
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def synthesize_gtts(text, voice):
+    """MP3 speech for text from Google Translate's TTS (gTTS); voice is the language code."""
+    from gtts import gTTS
+
+    audio_data = io.BytesIO()
+    gTTS(text=text, lang=voice).write_to_fp(audio_data)
+    return audio_data.getvalue()
+
+
+# Speech engines: name -> (synthesize(text, voice) -> bytes, audio format)
+TTS_ENGINES = {
+    'gtts': (synthesize_gtts, 'mp3'),
+}
+
+
+def cache_key(text, voice, engine, audio_format):
+    """Content address of synthesized speech: equal inputs always give equal audio."""
+    digest = hashlib.sha256()
+    for part in (engine, voice, audio_format, text):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class TTSCache:
+    """
+    Two-tier LRU cache of synthesized audio keyed by cache_key().
+
+    The memory tier holds up to memory_bytes of recent clips (clips larger
+    than an eighth of it are not kept in memory). The disk tier keeps up to
+    disk_bytes in directory, one file per clip written atomically, and
+    serves hits as read-only memory maps so a clip is streamed straight from
+    the page cache without being read into the heap. Several worker
+    processes can share the directory; each evicts by its own view of it
+    and treats a file another process removed as a miss.
+
+    Concurrent misses for the same key are synthesized once.
+    """
+
+    def __init__(self, memory_bytes=16 * 1024 * 1024, directory=None, disk_bytes=512 * 1024 * 1024):
+        self.memory_bytes = memory_bytes
+        self.memory_item_bytes = memory_bytes // 8
+        self.directory = directory
+        self.disk_bytes = disk_bytes if directory else 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = None
+        self._disk_size = 0
+        self._inflight = {}
+        self._hits = 0
+        self._lookups = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_disk_index(self):
+        """Index the files already in the directory, least recently used first."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    # Left behind by a writer that died
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name, stat.st_size))
+        entries.sort()
+        self._disk = OrderedDict((name, size) for _, name, size in entries)
+        self._disk_size = sum(self._disk.values())
+
+    def _record_lookup(self, tier):
+        self._lookups += 1
+        if tier:
+            self._hits += 1
+            metrics.increment(f'tts.cache.hits.{tier}')
+        else:
+            metrics.increment('tts.cache.misses')
+        metrics.set_gauge('tts.cache.hit_rate', round(self._hits / self._lookups, 4))
+
+    def _remember(self, key, data):
+        """Add a clip to the memory tier (caller holds the lock)."""
+        if len(data) > self.memory_item_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            metrics.increment('tts.cache.evictions.memory')
+        metrics.set_gauge('tts.cache.memory_bytes', self._memory_size)
+
+    def _open_disk(self, key):
+        """Memory-map a cached file, or None when it is not on disk (caller holds the lock)."""
+        if not self.disk_bytes:
+            return None
+        if self._disk is None:
+            self._load_disk_index()
+        if key not in self._disk:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as audio_file:
+                mapped = mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)
+        except (OSError, ValueError):
+            # Evicted by another process (or empty)
+            self._disk_size -= self._disk.pop(key)
+            return None
+        self._disk.move_to_end(key)
+        return memoryview(mapped)
+
+    def get(self, key):
+        """Cached audio for key (bytes or a read-only memoryview of a file map), or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._record_lookup('memory')
+                return data
+
+            data = self._open_disk(key)
+            if data is not None:
+                if len(data) <= self.memory_item_bytes:
+                    # Small, recently wanted clips are promoted to the memory tier
+                    data = bytes(data)
+                    self._remember(key, data)
+                self._record_lookup('disk')
+                return data
+
+            self._record_lookup(None)
+            return None
+
+    def put(self, key, data):
+        data = bytes(data)
+        with self._lock:
+            self._remember(key, data)
+        if self.disk_bytes and len(data) <= self.disk_bytes:
+            self._write_disk(key, data)
+
+    def _write_disk(self, key, data):
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as audio_file:
+                audio_file.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write TTS cache file {path}: {e}")
+            return
+
+        with self._lock:
+            if self._disk is None:
+                self._load_disk_index()
+            self._disk_size += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            while self._disk_size > self.disk_bytes:
+                evicted, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                try:
+                    os.unlink(self._path(evicted))
+                except OSError:
+                    pass
+                metrics.increment('tts.cache.evictions.disk')
+            metrics.set_gauge('tts.cache.disk_bytes', self._disk_size)
+
+    def get_or_create(self, key, create):
+        """
+        Cached audio for key, calling create() on a miss. Returns
+        (audio, cached). Callers missing the same key wait for the first one.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data, True
+
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                data = self._memory.get(key)
+            if data is None:
+                data = self.get(key)
+            if data is not None:
+                metrics.increment('tts.cache.coalesced')
+                return data, True
+
+        try:
+            start = time.monotonic()
+            data = create()
+            metrics.observe('tts.synthesize_seconds', time.monotonic() - start)
+            self.put(key, data)
+            return data, False
+        finally:
+            if owner:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+        metrics.set_gauge('tts.cache.memory_bytes', 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hit_rate': round(self._hits / self._lookups, 4) if self._lookups else 0.0,
+                'lookups': self._lookups,
+                'memory_items': len(self._memory),
+                'memory_bytes': self._memory_size,
+                'disk_items': len(self._disk) if self._disk is not None else None,
+                'disk_bytes': self._disk_size,
+            }
+
+
+def text_to_speech(text, voice=None, engine=None, cache=None):
+    """
+    Speech audio for text as (audio, audio_format, cached). audio is bytes
+    or a read-only memoryview; identical requests are served from the cache.
+    """
+    voice = voice or settings.TTS_VOICE
+    engine = engine or settings.TTS_ENGINE
+    cache = cache or tts_cache
+    synthesize, audio_format = TTS_ENGINES[engine]
+    key = cache_key(text, voice, engine, audio_format)
+    audio, cached = cache.get_or_create(key, lambda: synthesize(text, voice))
+    return audio, audio_format, cached
+
+
+def text_to_speech_base64(text, lang="en"):
+    """Base64 MP3 speech for text (the notebook prototype, now cached)."""
+    if not text:
+        return None
+    audio, _, _ = text_to_speech(text, voice=lang)
+    return base64.b64encode(audio).decode("utf-8")
+
+
+tts_cache = TTSCache(
+    memory_bytes=settings.TTS_MEMORY_CACHE_BYTES,
+    directory=settings.TTS_CACHE_DIR or None,
+    disk_bytes=settings.TTS_DISK_CACHE_BYTES
+)
@@ -0,0 +1,235 @@
+import os
+import time
+import logging
+import threading
+import urllib.error
+import urllib.request
+from django.conf import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Endpoints replaced at runtime with set_endpoints(), over the settings
+_endpoint_overrides = {}
+
+
+def _http_client():
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_SECONDS
+        ),
+        timeout=settings.UPSTREAM_TIMEOUT_SECONDS
+    )
+
+
+def _shared_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def groq_client():
+    """Groq client shared by every request of this worker, over one connection pool."""
+    def factory():
+        from groq import Groq
+        return Groq(
+            api_key=os.getenv("GROQ_API_KEY"), base_url=endpoint("groq"),
+            max_retries=settings.UPSTREAM_MAX_RETRIES, http_client=_http_client()
+        )
+    return _shared_client("groq", factory)
+
+
+def openai_client():
+    """OpenAI client shared by every request of this worker, over one connection pool."""
+    def factory():
+        from openai import OpenAI
+        return OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"), base_url=endpoint("openai"),
+            max_retries=settings.UPSTREAM_MAX_RETRIES, http_client=_http_client()
+        )
+    return _shared_client("openai", factory)
+
+
+def endpoint(name):
+    """URL of a provider ("groq", "openai" or "google"); None means the SDK default."""
+    if name in _endpoint_overrides:
+        return _endpoint_overrides[name]
+    return {
+        "groq": settings.GROQ_BASE_URL,
+        "openai": settings.OPENAI_BASE_URL,
+        "google": settings.GOOGLE_SPEECH_URL,
+    }[name]
+
+
+def google_speech_url():
+    return endpoint("google")
+
+
+def set_endpoints(**endpoints):
+    """
+    Point this process at other provider endpoints (a stand-in, or the
+    record/replay server of `manage.py bench_engines`), e.g.
+    set_endpoints(groq=url); None goes back to the setting. Pooled clients
+    are rebuilt on next use. Returns the previous overrides, which can be
+    passed back to undo the change.
+    """
+    with _clients_lock:
+        previous = {name: _endpoint_overrides.get(name) for name in endpoints}
+        for name, url in endpoints.items():
+            if url is None:
+                _endpoint_overrides.pop(name, None)
+            else:
+                _endpoint_overrides[name] = url
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+    return previous
+
+
+def probe_groq(timeout):
+    groq_client().with_options(timeout=timeout, max_retries=0).models.list()
+
+
+def probe_openai(timeout):
+    openai_client().with_options(timeout=timeout, max_retries=0).models.list()
+
+
+def probe_google(timeout):
+    """
+    The Web Speech endpoint has no health check and speech_recognition opens
+    a new connection per request, so any HTTP answer counts as reachable;
+    this also keeps the DNS entry warm.
+    """
+    try:
+        urllib.request.urlopen(google_speech_url(), timeout=timeout).close()
+    except urllib.error.HTTPError:
+        pass
+
+
+# Probe and role of each engine name used by app.stt.configured_engines()
+PROBES = {
+    "google": ("stt", probe_google),
+    "groq": ("llm", probe_groq),
+    "openai": ("llm", probe_openai),
+}
+
+
+class UpstreamStatus:
+    """Result of the latest probe of one upstream."""
+
+    def __init__(self, name, role):
+        self.name = name
+        self.role = role
+        self.healthy = None
+        self.latency = None
+        self.error = None
+        self.checked_at = None
+
+    def as_dict(self):
+        return {
+            'role': self.role,
+            'healthy': self.healthy,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'error': self.error,
+            'checked_seconds_ago': round(time.monotonic() - self.checked_at, 1) if self.checked_at else None,
+        }
+
+
+class UpstreamMonitor:
+    """
+    Background prober for the configured upstreams.
+
+    The first round runs as soon as the monitor starts, which opens and
+    pools the provider connections before the first utterance; later rounds
+    every interval seconds keep them warm and track reachability for the
+    readiness endpoint.
+    """
+
+    def __init__(self, interval=20.0, timeout=5.0):
+        self.interval = interval
+        self.timeout = timeout
+        self.statuses = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, engines):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.statuses = {
+                name: UpstreamStatus(name, PROBES[name][0]) for name in engines if name in PROBES
+            }
+            self._thread = threading.Thread(target=self._run, name='upstream-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def probe_all(self):
+        """Probe every upstream once, concurrently, and wait for the results."""
+        threads = [
+            threading.Thread(target=self.probe, args=(name,), name=f'upstream-probe-{name}', daemon=True)
+            for name in self.statuses
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(self.timeout + 1)
+
+    def probe(self, name):
+        status = self.statuses[name]
+        start = time.monotonic()
+        try:
+            PROBES[name][1](self.timeout)
+        except Exception as e:
+            healthy, error = False, f"{type(e).__name__}: {e}"
+        else:
+            healthy, error = True, None
+        elapsed = time.monotonic() - start
+
+        if status.healthy is not False and not healthy:
+            logger.warning(f"Upstream {name} unreachable: {error}")
+        elif status.healthy is False and healthy:
+            logger.info(f"Upstream {name} reachable again")
+        status.healthy, status.error, status.latency, status.checked_at = healthy, error, elapsed, time.monotonic()
+        metrics.set_gauge(f'upstream.healthy.{name}', int(healthy))
+        metrics.observe(f'upstream.probe_seconds.{name}', elapsed)
+
+    def ready(self):
+        """True once every role (stt, llm) has at least one reachable upstream."""
+        statuses = list(self.statuses.values())
+        roles = {status.role for status in statuses}
+        return bool(roles) and all(
+            any(status.healthy for status in statuses if status.role == role) for role in roles
+        )
+
+    def snapshot(self):
+        return {name: status.as_dict() for name, status in self.statuses.items()}
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.interval)
+
+
+upstream_monitor = UpstreamMonitor(
+    interval=settings.UPSTREAM_PROBE_INTERVAL,
+    timeout=settings.UPSTREAM_PROBE_TIMEOUT
+)
@@ -4,7 +4,14 @@ from .views import (
     LoginView,
     LogoutView,
     UserConversationsView,
+    ConversationSearchView,
     ClearConversationsView,
+    MetricsView,
+    ProfileView,
+    TranscriptionListView,
+    TranscriptionDetailView,
+    LivenessView,
+    ReadinessView,
     protected_endpoint_example
 )
 
@@ -13,6 +20,13 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('conversations/', UserConversationsView.as_view(), name='user_conversations'),
+    path('conversations/search/', ConversationSearchView.as_view(), name='search_conversations'),
     path('conversations/clear/', ClearConversationsView.as_view(), name='clear_conversations'),
+    path('transcriptions/', TranscriptionListView.as_view(), name='transcriptions'),
+    path('transcriptions/<int:job_id>/', TranscriptionDetailView.as_view(), name='transcription_detail'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('profile/', ProfileView.as_view(), name='profile'),
+    path('health/live/', LivenessView.as_view(), name='health_live'),
+    path('health/ready/', ReadinessView.as_view(), name='health_ready'),
     path('protected-example/', protected_endpoint_example, name='protected_example'),
 ]
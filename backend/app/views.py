@@ -1,14 +1,27 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.core.exceptions import ValidationError
-from .models import User, Conversation
+from .models import User, Conversation, TranscriptionJob, ConversationPurge
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.http import JsonResponse
 from .auth_utils import jwt_required
+from .search import search_conversations
+from .metrics import metrics
+from .upstream import upstream_monitor
+from .transcription import ENGINES, job_as_dict, transcription_pool
+from .purge import clear_conversations, purge_as_dict
+from .revocation import revocation_set
+from .archive import archive_cutoff, archived_turns, search_archived
+from .profiler import profiler
+from django.http import HttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from datetime import datetime, time as dt_time
+from django.conf import settings
 import json
 
 class RegisterView(APIView):
@@ -111,6 +124,9 @@ class LogoutView(APIView):
             if refresh_token:
                 token = RefreshToken(refresh_token)
                 token.blacklist()
+            # The access token of this request stops working too, not only at expiry
+            if request.auth is not None:
+                revocation_set.revoke(request.auth)
             
             return Response({
                 'message': 'Logout successful'
@@ -121,6 +137,22 @@ class LogoutView(APIView):
                 'error': 'Logout failed'
             }, status=status.HTTP_400_BAD_REQUEST)
 
+def _wants_archive(request):
+    return request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+def _parse_since(value):
+    """An ISO datetime or date (midnight) as an aware datetime, or None when invalid"""
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = datetime.combine(day, dt_time.min) if day else None
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
 class UserConversationsView(APIView):
     """Get user conversations - requires authentication"""
     permission_classes = [IsAuthenticated]
@@ -135,8 +167,18 @@ class UserConversationsView(APIView):
                     'error': 'User not authenticated'
                 }, status=status.HTTP_401_UNAUTHORIZED)
             
+            since = request.query_params.get('since')
+            if since:
+                since = _parse_since(since)
+                if since is None:
+                    return Response({
+                        'error': 'since must be an ISO date or datetime'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            
             # Get user's conversations
-            conversations = Conversation.objects.filter(user=user).order_by('-created_at')
+            conversations = Conversation.objects.visible_to(user).defer('embedding').order_by('-created_at')
+            if since:
+                conversations = conversations.filter(created_at__gte=since)
             
             conversation_data = [{
                 'id': conv.id,
@@ -145,6 +187,10 @@ class UserConversationsView(APIView):
                 'created_at': conv.created_at.isoformat(),
             } for conv in conversations]
             
+            # Older turns live in the archive; read it when they are asked for
+            if _wants_archive(request) or (since and since < archive_cutoff()):
+                conversation_data += list(archived_turns(user, since=since or None))
+            
             return Response({
                 'conversations': conversation_data
             }, status=status.HTTP_200_OK)
@@ -154,6 +200,55 @@ class UserConversationsView(APIView):
                 'error': 'An error occurred while fetching conversations'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ConversationSearchView(APIView):
+    """Full-text search over user conversations - requires authentication"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            user = request.user
+
+            if not user or not user.is_authenticated:
+                return Response({
+                    'error': 'User not authenticated'
+                }, status=status.HTTP_401_UNAUTHORIZED)
+
+            query = request.query_params.get('q', '').strip()
+            if not query:
+                return Response({
+                    'error': 'Query parameter q is required'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+            except ValueError:
+                return Response({
+                    'error': 'limit must be an integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            conversations = search_conversations(user, query, limit=limit)
+
+            conversation_data = [{
+                'id': conv.id,
+                'user_text': conv.user_text,
+                'llm_response': conv.llm_response,
+                'created_at': conv.created_at.isoformat(),
+            } for conv in conversations]
+
+            # The archive is not indexed; scan it only when asked to
+            if _wants_archive(request):
+                conversation_data += search_archived(user, query, limit=limit - len(conversation_data))
+
+            return Response({
+                'query': query,
+                'conversations': conversation_data
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            return Response({
+                'error': 'An error occurred while searching conversations'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class ClearConversationsView(APIView):
     """Clear user conversations - requires authentication"""
     permission_classes = [IsAuthenticated]
@@ -168,18 +263,173 @@ class ClearConversationsView(APIView):
                     'error': 'User not authenticated'
                 }, status=status.HTTP_401_UNAUTHORIZED)
             
-            # Delete user's conversations
-            deleted_count = Conversation.objects.filter(user=user).delete()[0]
+            # Hide the conversations now; they are deleted in the background
+            purge = clear_conversations(user)
             
             return Response({
-                'message': f'Successfully cleared {deleted_count} conversations'
-            }, status=status.HTTP_200_OK)
+                'message': f'Successfully cleared {purge.total} conversations',
+                'purge': purge_as_dict(purge)
+            }, status=status.HTTP_202_ACCEPTED)
             
         except Exception as e:
             return Response({
                 'error': 'An error occurred while clearing conversations'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def get(self, request):
+        """Progress of the user's latest clears"""
+        purges = ConversationPurge.objects.filter(user=request.user).order_by('-id')[:10]
+        return Response({
+            'purges': [purge_as_dict(purge) for purge in purges]
+        }, status=status.HTTP_200_OK)
+
+class MetricsView(APIView):
+    """In-process metrics of this worker - admin only"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot(), status=status.HTTP_200_OK)
+
+class ProfileView(APIView):
+    """
+    Sampling profiler of this worker - admin only.
+    POST starts a profile of ?seconds= (default 10); GET returns the current
+    or last one, as collapsed stacks with ?output=collapsed.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        try:
+            seconds = float(request.query_params.get('seconds', 10))
+            interval_ms = float(request.query_params.get('interval_ms', 5))
+        except ValueError:
+            return Response({
+                'error': 'seconds and interval_ms must be numbers'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not 0 < seconds <= settings.PROFILER_MAX_SECONDS or not 1 <= interval_ms <= 1000:
+            return Response({
+                'error': f'seconds must be in (0, {settings.PROFILER_MAX_SECONDS}] and interval_ms in [1, 1000]'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        include_idle = request.query_params.get('include_idle', '').lower() in ('1', 'true', 'yes')
+        if not profiler.start(seconds, interval=interval_ms / 1000, include_idle=include_idle):
+            return Response({
+                'error': 'A profile is already running on this worker'
+            }, status=status.HTTP_409_CONFLICT)
+
+        return Response(profiler.result(collapsed=False), status=status.HTTP_202_ACCEPTED)
+
+    def get(self, request):
+        result = profiler.result()
+        if result is None:
+            return Response({
+                'error': 'No profile has been taken on this worker'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        if request.query_params.get('output') == 'collapsed':
+            return HttpResponse(result['collapsed'], content_type='text/plain')
+        return Response(result, status=status.HTTP_200_OK)
+
+class TranscriptionListView(APIView):
+    """Queue uploaded recordings for batch transcription - requires authentication"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        uploads = request.FILES.getlist('audio')
+        if not uploads:
+            return Response({
+                'error': 'Upload one or more files in the audio field'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        engine = request.data.get('engine', 'google')
+        if engine not in ENGINES:
+            return Response({
+                'error': f"engine must be one of: {', '.join(ENGINES)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        for upload in uploads:
+            if upload.size > settings.TRANSCRIPTION_MAX_UPLOAD_BYTES:
+                return Response({
+                    'error': f'{upload.name} exceeds {settings.TRANSCRIPTION_MAX_UPLOAD_BYTES} bytes'
+                }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        try:
+            jobs = [TranscriptionJob.objects.create(
+                user=request.user,
+                engine=engine,
+                filename=upload.name[:255],
+                content_type=(upload.content_type or '')[:100],
+                size=upload.size,
+                audio=upload.read()
+            ) for upload in uploads]
+        except Exception as e:
+            return Response({
+                'error': 'An error occurred while queueing transcriptions'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        for _ in jobs:
+            transcription_pool.notify()
+
+        return Response({
+            'jobs': [job_as_dict(job) for job in jobs]
+        }, status=status.HTTP_202_ACCEPTED)
+
+    def get(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 200)
+        except ValueError:
+            return Response({
+                'error': 'limit must be an integer'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        jobs = TranscriptionJob.objects.filter(user=request.user).defer('audio').order_by('-created_at')[:limit]
+        return Response({
+            'jobs': [job_as_dict(job) for job in jobs]
+        }, status=status.HTTP_200_OK)
+
+class TranscriptionDetailView(APIView):
+    """Status and result of one batch transcription job - requires authentication"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = TranscriptionJob.objects.filter(id=job_id, user=request.user).defer('audio').first()
+        if job is None:
+            return Response({
+                'error': 'Transcription job not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(job_as_dict(job), status=status.HTTP_200_OK)
+
+class LivenessView(APIView):
+    """Liveness probe: the worker is serving and its upstream monitor is running"""
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        if settings.UPSTREAM_MONITOR and not upstream_monitor.running:
+            return Response({
+                'status': 'unhealthy',
+                'error': 'Upstream monitor is not running'
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response({'status': 'ok'}, status=status.HTTP_200_OK)
+
+class ReadinessView(APIView):
+    """Readiness probe: fails until an STT and an LLM upstream are reachable"""
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        if not settings.UPSTREAM_MONITOR:
+            return Response({'status': 'ok', 'upstreams': {}}, status=status.HTTP_200_OK)
+
+        ready = upstream_monitor.ready()
+        return Response({
+            'status': 'ok' if ready else 'unavailable',
+            'upstreams': upstream_monitor.snapshot()
+        }, status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
 # Example of using the custom JWT decorator for non-DRF views
 @csrf_exempt
 @require_http_methods(["GET"])
@@ -194,7 +444,7 @@ def protected_endpoint_example(request):
         user = request.user
         
         # Get user's conversation count
-        conversation_count = Conversation.objects.filter(user=user).count()
+        conversation_count = Conversation.objects.visible_to(user).count()
         
         return JsonResponse({
             'message': f'Hello {user.name}!',
@@ -0,0 +1,49 @@
+import time
+import logging
+from asgiref.sync import async_to_sync
+from channels.consumer import SyncConsumer
+from .metrics import metrics
+from .formats import PcmFormat
+from .stt import speech_to_text_google
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceWorker(SyncConsumer):
+    """
+    Channel-layer consumer for the inference tier, run with
+    `python manage.py runworker voice-inference` (settings.INFERENCE_CHANNEL).
+
+    AudioConsumer sends it one transcribe.utterance message per utterance;
+    the transcript goes back to the socket that asked through its
+    reply_channel as an inference.transcript message. Each worker process
+    handles one utterance at a time, so inference capacity scales with the
+    number of worker processes, independently of the socket servers.
+    """
+
+    def transcribe_utterance(self, message):
+        reply = {
+            'type': 'inference.transcript',
+            'utterance_id': message['utterance_id'],
+            'text': None,
+            'error': None,
+        }
+
+        # The socket has given up on it (timeout, barge-in) while it was queued
+        if message.get('deadline') and time.time() > message['deadline']:
+            metrics.increment('inference.expired')
+            return
+
+        start = time.monotonic()
+        try:
+            pcm_format = PcmFormat.from_message(message.get('pcm_format') or {})
+            reply['text'] = speech_to_text_google(message['audio'], pcm_format=pcm_format)
+        except Exception as e:
+            logger.error(f"Inference failed for utterance {message['utterance_id']}: {e}")
+            reply['error'] = str(e)
+            metrics.increment('inference.errors')
+        elapsed = time.monotonic() - start
+        metrics.observe('inference.transcribe_seconds', elapsed)
+        reply['worker_seconds'] = round(elapsed, 4)
+
+        async_to_sync(self.channel_layer.send)(message['reply_channel'], reply)
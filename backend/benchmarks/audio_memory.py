@@ -0,0 +1,138 @@
+"""
+Memory benchmark of the incoming-audio path for many concurrent users.
+
+Compares the previous path (whole utterance as one base64 JSON message,
+b64decode, temporary file, pydub decode, normalize) with the buffer path
+(binary frames appended to a reused AudioBuffer, WAV parsed in place from a
+read-only view, normalize). Each path runs in its own subprocess so peak
+RSS is not shared. All simulated users hold an utterance at once; after a
+warm-up round, tracemalloc reports the peak of new allocations for one
+round of utterances.
+
+WAV payloads are used so no ffmpeg is needed.
+
+    python benchmarks/audio_memory.py
+    python benchmarks/audio_memory.py --users 200 --seconds 10
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+FRAME_BYTES = 16 * 1024
+
+
+def wav_payload(seconds, rate, channels):
+    rng = np.random.default_rng(0)
+    samples = (rng.standard_normal(int(seconds * rate * channels)) * 1000).astype(np.int16)
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return out.getvalue()
+
+
+def receive_legacy(payload):
+    """What the consumer held per user: the JSON text and the decoded bytes."""
+    message = json.dumps({'type': 'audio_data', 'audio_data': base64.b64encode(payload).decode()})
+    return message, base64.b64decode(json.loads(message)['audio_data'])
+
+
+def process_legacy(received):
+    from pydub import AudioSegment
+    from audio_preprocess import normalize_segment
+
+    _, audio_bytes = received
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
+        temp_file.write(audio_bytes)
+        path = temp_file.name
+    try:
+        return normalize_segment(AudioSegment.from_file(path, format='wav'))
+    finally:
+        os.unlink(path)
+
+
+def receive_buffer(payload, buffer):
+    buffer.clear()
+    view = memoryview(payload)
+    for start in range(0, len(view), FRAME_BYTES):
+        buffer.append(view[start:start + FRAME_BYTES])
+    return buffer
+
+
+def process_buffer(buffer):
+    from app.audio import decode_audio, normalize_pcm
+
+    with buffer.reading() as audio:
+        return normalize_pcm(*decode_audio(audio))
+
+
+def utterance_round(path, payload, buffers):
+    """Every user sends an utterance, then all of them are processed while still held."""
+    if path == 'buffer':
+        received = [receive_buffer(payload, buffer) for buffer in buffers]
+        return received, [process_buffer(buffer) for buffer in received]
+    received = [receive_legacy(payload) for _ in buffers]
+    return received, [process_legacy(item) for item in received]
+
+
+def run_path(path, users, payload):
+    from app.audio import AudioBuffer
+
+    buffers = [AudioBuffer() for _ in range(users)]
+    # The first round grows the per-connection buffers; measure a later one
+    utterance_round(path, payload, buffers)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = utterance_round(path, payload, buffers)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'path': path, 'peak': peak, 'seconds': elapsed, 'rss_mib': peak_rss}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--rate', type=int, default=48000)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--child', choices=['legacy', 'buffer'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    payload = wav_payload(args.seconds, args.rate, args.channels)
+    if args.child:
+        run_path(args.child, args.users, payload)
+        return
+
+    print(f"{args.users} users, {len(payload) / 1024:.0f} KiB WAV utterance each")
+    for path in ('legacy', 'buffer'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', path, '--users', str(args.users),
+             '--seconds', str(args.seconds), '--rate', str(args.rate), '--channels', str(args.channels)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{path:<7} new allocations (peak) {result['peak'] / 2**20:7.1f} MiB"
+              f"   peak RSS {result['rss_mib']:7.1f} MiB   {result['seconds'] * 1000 / args.users:6.1f} ms/user")
+
+
+if __name__ == '__main__':
+    main()
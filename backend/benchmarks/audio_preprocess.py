@@ -0,0 +1,111 @@
+"""
+Benchmark of the STT preprocessing stage in app/audio.py.
+
+Compares the previous path (export the decoded audio as WAV at the source
+rate/channels, read it back with sr.AudioFile) with the normalized path
+(NumPy downmix + resample to 16 kHz mono 16-bit, sr.AudioData in memory).
+Reports the WAV and FLAC payload sizes (recognize_google uploads FLAC) and
+the preprocessing time. With --live it also times the Google Web Speech
+round trip for both payloads (requires network and a speech recording).
+
+    python benchmarks/audio_preprocess.py
+    python benchmarks/audio_preprocess.py --seconds 30 --rate 44100
+    python benchmarks/audio_preprocess.py --live recording.webm
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import speech_recognition as sr
+from pydub import AudioSegment
+
+from app.audio import SAMPLE_DTYPES, TARGET_SAMPLE_WIDTH, normalize_pcm, to_audio_data
+
+
+def normalize_segment(segment):
+    """The previous request path: a pydub AudioSegment to 16 kHz mono 16-bit PCM bytes."""
+    if segment.sample_width not in SAMPLE_DTYPES:
+        segment = segment.set_sample_width(TARGET_SAMPLE_WIDTH)
+
+    return normalize_pcm(segment.raw_data, segment.sample_width, segment.channels, segment.frame_rate)
+
+
+def synthetic_segment(seconds, rate, channels):
+    """Speech-like test signal: a few harmonics with syllable-rate amplitude modulation plus noise."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t)) ** 2
+    signal = 0.2 * voice * envelope + 0.01 * rng.standard_normal(len(t))
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    interleaved = np.repeat(pcm[:, None], channels, axis=1).tobytes()
+    return AudioSegment(data=interleaved, sample_width=2, frame_rate=rate, channels=channels)
+
+
+def legacy_path(segment):
+    wav = io.BytesIO()
+    segment.export(wav, format="wav")
+    wav_bytes = wav.getvalue()
+    wav.seek(0)
+    with sr.AudioFile(wav) as source:
+        audio = sr.Recognizer().record(source)
+    return wav_bytes, audio
+
+
+def normalized_path(segment):
+    pcm = normalize_segment(segment)
+    audio = to_audio_data(pcm)
+    return audio.get_wav_data(), audio
+
+
+def measure(name, path, segment, repeats, live):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        wav_bytes, audio = path(segment)
+    elapsed = (time.perf_counter() - start) / repeats
+
+    flac_bytes = audio.get_flac_data(
+        convert_rate=None if audio.sample_rate >= 8000 else 8000, convert_width=2
+    )
+    line = (f"{name:<11} wav {len(wav_bytes) / 1024:8.1f} KiB   flac upload {len(flac_bytes) / 1024:8.1f} KiB"
+            f"   preprocess {elapsed * 1000:7.1f} ms")
+
+    if live:
+        start = time.perf_counter()
+        try:
+            sr.Recognizer().recognize_google(audio)
+        except (sr.UnknownValueError, sr.RequestError):
+            pass
+        line += f"   google round trip {(time.perf_counter() - start) * 1000:7.0f} ms"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--rate', type=int, default=48000)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--live', metavar='FILE', help='recording to send to Google for round-trip timing')
+    args = parser.parse_args()
+
+    if args.live:
+        segment = AudioSegment.from_file(args.live)
+    else:
+        segment = synthetic_segment(args.seconds, args.rate, args.channels)
+    print(f"input: {segment.duration_seconds:.1f}s, {segment.frame_rate} Hz, "
+          f"{segment.channels} ch, {segment.sample_width * 8}-bit")
+
+    measure('legacy', legacy_path, segment, args.repeats, bool(args.live))
+    measure('normalized', normalized_path, segment, args.repeats, bool(args.live))
+
+
+if __name__ == '__main__':
+    main()
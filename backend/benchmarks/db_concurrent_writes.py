@@ -0,0 +1,115 @@
+"""
+Concurrent-write benchmark for the database profiles in main/settings.py.
+
+Spawns several writer processes that insert Conversation rows at the same
+time, the way multiple Daphne workers would, and reports throughput, latency
+percentiles and lock errors. The profile is chosen with the same environment
+variables as the application, e.g.:
+
+    # SQLite, default rollback journal (baseline)
+    SQLITE_JOURNAL_MODE=DELETE SQLITE_PATH=/tmp/bench.sqlite3 python benchmarks/db_concurrent_writes.py
+
+    # SQLite, WAL profile
+    SQLITE_PATH=/tmp/bench.sqlite3 python benchmarks/db_concurrent_writes.py
+
+    # PostgreSQL with and without the connection pool
+    DB_ENGINE=postgres DB_NAME=bench python benchmarks/db_concurrent_writes.py
+    DB_ENGINE=postgres DB_NAME=bench DB_POOL=false python benchmarks/db_concurrent_writes.py
+
+Run it against a scratch database: it migrates the target and deletes the
+rows it wrote when done.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
+
+import django
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def writer(worker_id, rows, user_id):
+    """Insert rows one transaction at a time and time each insert."""
+    django.setup()
+    from django.db import OperationalError, connection
+    from app.models import Conversation
+
+    latencies = []
+    errors = 0
+    for i in range(rows):
+        start = time.perf_counter()
+        try:
+            Conversation.objects.create(
+                user_id=user_id,
+                user_text=f"bench worker {worker_id} row {i}",
+                llm_response="benchmark response " * 10
+            )
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            # "database is locked" on SQLite once busy_timeout is exceeded
+            errors += 1
+    connection.close()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8, help='concurrent writer processes')
+    parser.add_argument('--rows', type=int, default=250, help='rows inserted by each writer')
+    args = parser.parse_args()
+
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connection
+    from app.models import Conversation, User
+
+    call_command('migrate', verbosity=0)
+    user, _ = User.objects.get_or_create(email='bench-writes@example.com', defaults={'name': 'bench'})
+    connection.close()
+
+    database = settings.DATABASES['default']
+    options = database.get('OPTIONS', {})
+    print(f"engine:  {database['ENGINE']}")
+    print(f"options: {options.get('init_command') or options.get('pool') or {}}")
+    print(f"conn_max_age: {database.get('CONN_MAX_AGE', 0)}")
+    print(f"writers: {args.workers} x {args.rows} rows")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(writer, i, args.rows, user.id) for i in range(args.workers)]
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+
+    latencies = [lat for result in results for lat in result[0]]
+    errors = sum(result[1] for result in results)
+
+    print(f"elapsed: {elapsed:.2f}s")
+    print(f"written: {len(latencies)} rows, {len(latencies) / elapsed:.0f} rows/s")
+    print(f"errors:  {errors}")
+    print(
+        "latency: p50 {:.1f}ms  p95 {:.1f}ms  p99 {:.1f}ms  max {:.1f}ms".format(
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000,
+            max(latencies, default=0) * 1000,
+        )
+    )
+
+    Conversation.objects.filter(user=user).delete()
+    user.delete()
+
+
+if __name__ == '__main__':
+    main()
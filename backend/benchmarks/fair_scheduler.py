@@ -0,0 +1,101 @@
+"""
+Offline benchmark of app.scheduler.FairScheduler against a plain FIFO pool.
+
+A few heavy users each fire a burst of calls while light users send one
+call at a time; every call sleeps for a fixed upstream latency. Latency of
+the light users' calls is compared between a shared FIFO thread pool (what
+sync_to_async does) and the fair-share scheduler with the same number of
+slots:
+
+    python benchmarks/fair_scheduler.py
+    python benchmarks/fair_scheduler.py --heavy-users 4 --burst 40 --slots 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
+
+import django
+django.setup()
+
+from app.metrics import metrics
+from app.scheduler import FairScheduler
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def upstream_call(latency):
+    time.sleep(latency)
+
+
+async def workload(submit, args):
+    light_latencies = []
+    heavy_latencies = []
+
+    async def timed(user, bucket):
+        start = time.perf_counter()
+        await submit(user, upstream_call, args.latency)
+        bucket.append(time.perf_counter() - start)
+
+    async def heavy(user):
+        await asyncio.gather(*(timed(user, heavy_latencies) for _ in range(args.burst)))
+
+    async def light(user):
+        for _ in range(args.light_calls):
+            await timed(user, light_latencies)
+            await asyncio.sleep(args.latency)
+
+    heavy_users = [SimpleNamespace(id=index, is_staff=False) for index in range(args.heavy_users)]
+    light_users = [SimpleNamespace(id=1000 + index, is_staff=False) for index in range(args.light_users)]
+    start = time.perf_counter()
+    await asyncio.gather(*(heavy(user) for user in heavy_users), *(light(user) for user in light_users))
+    return light_latencies, heavy_latencies, time.perf_counter() - start
+
+
+def report(name, light_latencies, heavy_latencies, elapsed):
+    print(f"{name}:")
+    print(f"  light p50 {percentile(light_latencies, 50) * 1000:7.1f} ms  "
+          f"p95 {percentile(light_latencies, 95) * 1000:7.1f} ms  max {max(light_latencies) * 1000:7.1f} ms")
+    print(f"  heavy p50 {percentile(heavy_latencies, 50) * 1000:7.1f} ms  "
+          f"p95 {percentile(heavy_latencies, 95) * 1000:7.1f} ms  max {max(heavy_latencies) * 1000:7.1f} ms")
+    print(f"  total {elapsed:.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slots', type=int, default=4)
+    parser.add_argument('--heavy-users', type=int, default=2)
+    parser.add_argument('--burst', type=int, default=24)
+    parser.add_argument('--light-users', type=int, default=4)
+    parser.add_argument('--light-calls', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    executor = ThreadPoolExecutor(max_workers=args.slots)
+
+    async def fifo(user, func, *call_args):
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *call_args)
+
+    report('FIFO pool', *asyncio.run(workload(fifo, args)))
+
+    metrics.reset()
+    scheduler = FairScheduler(slots=args.slots, max_queued_per_user=args.burst)
+    report('fair scheduler', *asyncio.run(workload(scheduler.run, args)))
+    summaries = metrics.snapshot()['summaries']
+    for user_class in ('light', 'heavy'):
+        wait = summaries.get(f'scheduler.wait_seconds.{user_class}')
+        if wait:
+            print(f"  scheduler.wait_seconds.{user_class}: p95 {wait['p95'] * 1000:.1f} ms over {wait['count']} calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Cold-start report for a worker: how long importing the ASGI app takes and
+where the time goes, from `python -X importtime` in a fresh interpreter.
+
+Prints the total, the slowest modules by cumulative time and whether the
+engine SDKs were imported during startup. With --warm-up it also times
+app.stt.warm_up() for the configured engines.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --top 30 --warm-up
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENGINE_SDKS = ('openai', 'groq', 'speech_recognition', 'pydub')
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import main.asgi
+loaded = time.perf_counter() - start
+engines = [m for m in %(sdks)r if m in sys.modules]
+timings = {}
+if %(warm_up)r:
+    from app.stt import warm_up
+    timings = warm_up()
+print(json.dumps({'seconds': loaded, 'warm_up': timings, 'engines': engines}))
+"""
+
+
+def parse_importtime(stderr):
+    """(cumulative_us, self_us, depth, module) for each line of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((int(cumulative_us), int(self_us), len(indent) // 2, module))
+    return rows
+
+
+def children_of(rows, parent):
+    """Direct imports of a top-level module (-X importtime prints children before their parent)."""
+    pending = []
+    for row in rows:
+        if row[2] == 1:
+            pending.append(row)
+        elif row[2] == 0:
+            if row[3] == parent:
+                return pending
+            pending = []
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--warm-up', action='store_true', help='also time warm_up() of the configured engines')
+    args = parser.parse_args()
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='main.settings', ENGINE_WARMUP='off',
+               PYTHONPATH=BACKEND, PYTHONDONTWRITEBYTECODE='1')
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD % {'warm_up': args.warm_up, 'sdks': ENGINE_SDKS}],
+        cwd=BACKEND, env=env, capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - start
+    child = json.loads(result.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(result.stderr)
+
+    print(f"interpreter + import main.asgi: {wall * 1000:.0f} ms wall, main.asgi {child['seconds'] * 1000:.0f} ms")
+    print(f"modules imported: {len(rows)}")
+    print(f"engine SDKs imported at startup: {', '.join(child['engines']) or 'none'}")
+
+    print("\nslowest imports under main.asgi (cumulative):")
+    for cumulative_us, self_us, _, module in sorted(children_of(rows, 'main.asgi'), reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+    print("\nslowest modules (self):")
+    for self_us, cumulative_us, module in sorted(((r[1], r[0], r[3]) for r in rows), reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {module}")
+
+    if child['warm_up']:
+        print("\nwarm_up():")
+        for engine, seconds in child['warm_up'].items():
+            print(f"  {seconds * 1000:8.1f} ms  {engine}")
+
+
+if __name__ == '__main__':
+    main()
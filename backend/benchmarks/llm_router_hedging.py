@@ -0,0 +1,99 @@
+"""
+Offline benchmark of app.llm_router.LLMRouter with fake providers.
+
+Each fake provider sleeps for a latency drawn from its own distribution
+(with occasional slow outliers and errors) instead of calling an API, so
+routing, failover and hedging can be compared without network access:
+
+    python benchmarks/llm_router_hedging.py
+    python benchmarks/llm_router_hedging.py --requests 500 --outlier-rate 0.1
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.cancellation import UtteranceCancelled
+from app.llm_router import LLMRouter, Provider
+from app.metrics import metrics
+
+
+def fake_provider(name, median, outlier_rate, outlier_latency, error_rate, rng):
+    """A provider whose latency is lognormal around median with slow outliers."""
+    def complete(messages, cancel_token=None):
+        latency = rng.lognormvariate(0, 0.25) * median
+        if rng.random() < outlier_rate:
+            latency = outlier_latency
+        deadline = time.monotonic() + latency
+        while time.monotonic() < deadline:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise UtteranceCancelled()
+            time.sleep(0.005)
+        if rng.random() < error_rate:
+            raise RuntimeError(f"{name} returned 503")
+        return f"answer from {name}"
+    return Provider(name, complete)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(hedge, args):
+    rng = random.Random(args.seed)
+    metrics.reset()
+    router = LLMRouter(
+        [
+            fake_provider('fast-but-spiky', 0.15, args.outlier_rate, 1.5, args.error_rate, rng),
+            fake_provider('steady', 0.25, 0.0, 0.0, 0.0, rng),
+        ],
+        hedge=hedge,
+        hedge_min_delay=args.hedge_min_delay,
+        reprobe_after=args.reprobe_after
+    )
+
+    latencies = []
+    for _ in range(args.requests):
+        start = time.monotonic()
+        router.complete([{"role": "user", "content": "hello"}])
+        latencies.append(time.monotonic() - start)
+
+    counters = metrics.snapshot()['counters']
+    print(f"hedge={hedge}")
+    print(
+        "  latency: p50 {:.0f}ms  p95 {:.0f}ms  p99 {:.0f}ms  max {:.0f}ms".format(
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000,
+            max(latencies) * 1000,
+        )
+    )
+    print("  requests: " + ", ".join(
+        f"{name.split('.')[-1]}={int(value)}" for name, value in sorted(counters.items()) if name.startswith('llm.requests.')
+    ))
+    print(f"  hedges={int(counters.get('llm.hedges', 0))} hedge_wins={int(counters.get('llm.hedge_wins', 0))} "
+          f"failovers={int(counters.get('llm.failovers', 0))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--outlier-rate', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--hedge-min-delay', type=float, default=0.2)
+    parser.add_argument('--reprobe-after', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    run(False, args)
+    run(True, args)
+
+
+if __name__ == '__main__':
+    main()
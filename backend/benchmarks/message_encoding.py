@@ -0,0 +1,66 @@
+"""
+Encode/decode cost of websocket messages per codec in app.messages.
+
+Times a stream of small delta-sized messages, a full transcription reply,
+the pre-encoded static messages against building and encoding the dict
+each time, and decoding inbound audio_chunk messages (base64 in JSON vs
+raw bytes in MessagePack).
+
+    python benchmarks/message_encoding.py
+    python benchmarks/message_encoding.py --messages 50000
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
+
+import django
+
+django.setup()
+
+from app.messages import CODECS, STATIC_MESSAGES
+
+
+def per_call(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--chunk-kib', type=int, default=16)
+    args = parser.parse_args()
+
+    delta = {'type': 'llm_delta', 'text': 'Drink plenty of water ', 'seq': 42}
+    reply = {
+        'type': 'transcription',
+        'text': 'What should I do about a mild headache that started this morning?',
+        'llm_response': 'Rest in a quiet room, drink water and consider an over-the-counter pain reliever. ' * 4,
+        'timestamp': 1760000000000,
+    }
+    chunk = os.urandom(args.chunk_kib * 1024)
+
+    print(f"{'codec':<8} {'delta enc':>10} {'reply enc':>10} {'static':>9} {'rebuild':>9} {'chunk dec':>10}  (us/message)")
+    for name, codec in CODECS.items():
+        static = STATIC_MESSAGES['recording_started']
+        if codec.binary:
+            inbound = codec.encode({'type': 'audio_chunk', 'audio_data': chunk})
+        else:
+            inbound = codec.encode({'type': 'audio_chunk', 'audio_data': base64.b64encode(chunk).decode()})
+        print(f"{name:<8} "
+              f"{per_call(lambda: codec.encode(delta), args.messages):10.2f} "
+              f"{per_call(lambda: codec.encode(reply), args.messages):10.2f} "
+              f"{per_call(lambda: codec.static('recording_started'), args.messages):9.2f} "
+              f"{per_call(lambda: codec.encode(dict(static)), args.messages):9.2f} "
+              f"{per_call(lambda: codec.decode(inbound), args.messages // 10):10.2f}")
+
+
+if __name__ == '__main__':
+    main()
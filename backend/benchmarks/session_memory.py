@@ -0,0 +1,75 @@
+"""
+Memory held by idle websocket connections (AudioConsumer + ConnectionSession).
+
+Builds N consumers the way Channels does for each socket and measures the
+Python heap with tracemalloc in three states: just connected, after one
+utterance of --utterance-kib (both audio buffers have grown), and after the
+idle reaper released the buffers. Reported per connection and for N.
+
+    python benchmarks/session_memory.py
+    python benchmarks/session_memory.py --connections 10000 --utterance-kib 200
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
+
+import django
+
+django.setup()
+
+from app.consumers import AudioConsumer
+
+
+def measure(label, connections, baseline):
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    print(f"{label:<22} {used / len(connections):10.0f} B/connection   "
+          f"{used / 2**20:9.1f} MiB for {len(connections)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--utterance-kib', type=int, default=100)
+    args = parser.parse_args()
+
+    chunk = bytes(16 * 1024)
+    chunks = max(1, args.utterance_kib // 16)
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    connections = []
+    for index in range(args.connections):
+        consumer = AudioConsumer()
+        consumer.scope = {'type': 'websocket', 'path': '/ws/audio/', 'query_string': b''}
+        consumer.channel_name = f'specific.{index}'
+        consumer.session.load_history([])
+        connections.append(consumer)
+    measure('connected', connections, baseline)
+
+    for consumer in connections:
+        # One utterance recorded and handed off, the next one recorded into the other buffer
+        session = consumer.session
+        for _ in range(chunks):
+            session.recording.append(chunk)
+        session.swap_buffers()
+        for _ in range(chunks):
+            session.recording.append(chunk)
+        session.recording.clear()
+        session.history.append({'user_text': 'x' * 60, 'llm_response': 'y' * 300})
+    measure('after one utterance', connections, baseline)
+
+    for consumer in connections:
+        consumer.session.release_buffers()
+    measure('idle, buffers released', connections, baseline)
+
+
+if __name__ == '__main__':
+    main()
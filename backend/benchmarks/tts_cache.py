@@ -0,0 +1,94 @@
+"""
+Offline benchmark of app.tts.TTSCache.
+
+A fake engine stands in for gTTS: it sleeps for a fixed synthesis latency
+and returns a clip of the given size. Requests are drawn from a Zipf-like
+distribution over a set of answers (a few common phrases repeat a lot),
+and time to the first audio byte is compared with and without the cache:
+
+    python benchmarks/tts_cache.py
+    python benchmarks/tts_cache.py --requests 2000 --phrases 500 --memory-mib 2
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
+
+import django
+django.setup()
+
+from app.metrics import metrics
+from app.tts import TTSCache, TTS_ENGINES, text_to_speech
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--phrases', type=int, default=200)
+    parser.add_argument('--synthesis-ms', type=float, default=300.0)
+    parser.add_argument('--clip-kib', type=int, default=40)
+    parser.add_argument('--memory-mib', type=float, default=1.0)
+    parser.add_argument('--disk-mib', type=float, default=64.0)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    def fake_synthesize(text, voice):
+        time.sleep(args.synthesis_ms / 1000)
+        return os.urandom(args.clip_kib * 1024)
+
+    TTS_ENGINES['fake'] = (fake_synthesize, 'mp3')
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) for rank in range(args.phrases)]
+    texts = rng.choices([f'answer number {i}' for i in range(args.phrases)], weights, k=args.requests)
+
+    directory = tempfile.mkdtemp(prefix='tts-cache-')
+    try:
+        cache = TTSCache(
+            memory_bytes=int(args.memory_mib * 1024 * 1024),
+            directory=directory,
+            disk_bytes=int(args.disk_mib * 1024 * 1024)
+        )
+        metrics.reset()
+        latencies = []
+        for text in texts:
+            start = time.perf_counter()
+            audio, _, _ = text_to_speech(text, voice='en', engine='fake', cache=cache)
+            audio[:1]
+            latencies.append(time.perf_counter() - start)
+
+        counters = metrics.snapshot()['counters']
+        print(f"{args.requests} requests over {args.phrases} phrases, {args.clip_kib} KiB clips, "
+              f"{args.synthesis_ms:.0f} ms synthesis")
+        print(f"  uncached: every request {args.synthesis_ms:.1f} ms")
+        print(f"  cached:   p50 {percentile(latencies, 50) * 1000:.3f} ms, "
+              f"p95 {percentile(latencies, 95) * 1000:.3f} ms, "
+              f"total {sum(latencies):.1f} s vs {args.requests * args.synthesis_ms / 1000:.1f} s")
+        print(f"  hits: memory {counters.get('tts.cache.hits.memory', 0):.0f}, "
+              f"disk {counters.get('tts.cache.hits.disk', 0):.0f}, "
+              f"misses {counters.get('tts.cache.misses', 0):.0f}")
+        print(f"  {cache.stats()}")
+
+        # A fresh process (empty memory tier) serving from the shared directory
+        cold = TTSCache(memory_bytes=0, directory=directory, disk_bytes=int(args.disk_mib * 1024 * 1024))
+        start = time.perf_counter()
+        for text in texts[:100]:
+            audio, _, cached = text_to_speech(text, voice='en', engine='fake', cache=cold)
+            audio[:1]
+        print(f"  new worker, disk tier only: {(time.perf_counter() - start) / 100 * 1000:.3f} ms per request")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,27 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
+import logging
+import threading
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ProtocolTypeRouter, URLRouter, ChannelNameRouter
 from channels.auth import AuthMiddlewareStack
 from django.urls import path, re_path
-from app.consumers import AudioConsumer
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
 
+# Set up Django before importing anything that touches models
 django_asgi_app = get_asgi_application()
 
+from django.conf import settings
+from app.consumers import AudioConsumer
+from app.workers import InferenceWorker
+from app.stt import warm_up, configured_engines
+from app.upstream import upstream_monitor
+from app.transcription import transcription_pool
+from app.purge import conversation_purger
+from app.revocation import token_pruner
+
 websocket_urlpatterns = [
     path('ws/audio/', AudioConsumer.as_asgi()),
     path('ws/chat/', AudioConsumer.as_asgi()),  # Alias for audio endpoint
@@ -28,4 +39,37 @@ application = ProtocolTypeRouter({
     'websocket': AuthMiddlewareStack(
         URLRouter(websocket_urlpatterns)
     ),
-})
\ No newline at end of file
+    # Background workers: python manage.py runworker voice-inference
+    'channel': ChannelNameRouter({
+        settings.INFERENCE_CHANNEL: InferenceWorker.as_asgi(),
+    }),
+})
+
+if settings.INFERENCE_OFFLOAD and settings.CHANNEL_LAYER == 'memory':
+    logging.getLogger(__name__).warning(
+        "INFERENCE_OFFLOAD needs CHANNEL_LAYER=redis; the in-memory layer only reaches workers in this process"
+    )
+
+# Background threads belong to the web processes; runworker processes
+# (PROCESS_ROLE=worker) only serve their channels
+if settings.PROCESS_ROLE == 'web':
+    # Preload the configured engine SDKs so the first utterance does not pay for the imports
+    if settings.ENGINE_WARMUP == 'sync':
+        warm_up()
+    elif settings.ENGINE_WARMUP == 'background':
+        threading.Thread(target=warm_up, name='engine-warm-up', daemon=True).start()
+
+    # Open pooled connections to the upstreams now and keep probing them
+    if settings.UPSTREAM_MONITOR:
+        upstream_monitor.start(configured_engines())
+
+    # Batch transcription jobs run on their own threads, outside the event loop
+    if settings.TRANSCRIPTION_IN_PROCESS:
+        transcription_pool.start()
+
+    # Cleared conversations are deleted in the background, in small batches
+    if settings.PURGE_IN_PROCESS:
+        conversation_purger.start()
+
+    # Expired refresh/revoked tokens are removed from the blacklist tables periodically
+    token_pruner.start()
@@ -12,6 +12,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+from dotenv import load_dotenv
+
+# Outside docker-compose (which passes .env as the environment), read .env here
+load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,11 +55,38 @@ INSTALLED_APPS = [
 ASGI_APPLICATION = 'main.asgi.application'
 
 # In-memory channel layer (no Redis needed for local dev)
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+# CHANNEL_LAYER is "memory" (single process) or "redis", which is needed to
+# offload inference to separate worker processes
+CHANNEL_LAYER = os.getenv("CHANNEL_LAYER", "memory")
+if CHANNEL_LAYER == "redis":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [os.getenv("REDIS_URL", "redis://localhost:6379/0")],
+                "capacity": int(os.getenv("CHANNEL_LAYER_CAPACITY", "200")),
+                "expiry": 60,
+            },
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
+    }
+
+# Inference tier: with INFERENCE_OFFLOAD, AudioConsumer sends utterances to
+# INFERENCE_CHANNEL on the channel layer, served by
+# `python manage.py runworker voice-inference` processes (app.workers).
+INFERENCE_OFFLOAD = os.getenv("INFERENCE_OFFLOAD", "false").lower() == "true"
+
+# What this process serves. Only "web" processes start the background
+# threads of main.asgi (engine warm-up, upstream monitor, transcription pool,
+# purger, token pruner); `manage.py runworker` switches itself to "worker".
+PROCESS_ROLE = os.getenv("PROCESS_ROLE", "web")
+INFERENCE_CHANNEL = os.getenv("INFERENCE_CHANNEL", "voice-inference")
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", "60"))
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
@@ -91,12 +122,207 @@ WSGI_APPLICATION = 'main.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE selects the profile: "sqlite" (default, single node) or "postgres".
+
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite").lower()
+
+if DB_ENGINE == "postgres":
+    # Connection pooling (psycopg_pool) and persistent connections are mutually
+    # exclusive in Django, so CONN_MAX_AGE only applies when the pool is off.
+    DB_POOL = os.getenv("DB_POOL", "true").lower() == "true"
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv("DB_NAME", "speech_to_speech"),
+            'USER': os.getenv("DB_USER", "postgres"),
+            'PASSWORD': os.getenv("DB_PASSWORD", ""),
+            'HOST': os.getenv("DB_HOST", "localhost"),
+            'PORT': os.getenv("DB_PORT", "5432"),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE", "60")),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+                    'max_size': int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+                    'timeout': float(os.getenv("DB_POOL_TIMEOUT", "10")),
+                },
+            } if DB_POOL else {},
+        }
     }
-}
+else:
+    # WAL lets readers run alongside the single writer, busy_timeout makes
+    # concurrent writers wait for the lock instead of failing immediately,
+    # and IMMEDIATE transactions take the write lock up front so they do not
+    # deadlock when upgrading from a read lock.
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv("SQLITE_PATH", BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'init_command': (
+                    f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE};"
+                    f"PRAGMA synchronous={SQLITE_SYNCHRONOUS};"
+                    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};"
+                ),
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# Conversation turns are written behind the reply by app.persistence.ConversationWriter,
+# flushed with bulk_create once this many rows are queued or after the interval (seconds)
+CONVERSATION_WRITE_BATCH_SIZE = int(os.getenv("CONVERSATION_WRITE_BATCH_SIZE", "100"))
+CONVERSATION_WRITE_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_WRITE_FLUSH_INTERVAL", "1.0"))
+
+# Semantic retrieval of past turns (app.retrieval). The prompt gets the
+# RETRIEVAL_TOP_K most relevant stored turns plus the RETRIEVAL_RECENT_TURNS latest ones.
+# EMBEDDING_ENGINE is "hashing" (local, no network) or "openai".
+EMBEDDING_ENGINE = os.getenv("EMBEDDING_ENGINE", "hashing")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_RECENT_TURNS = int(os.getenv("RETRIEVAL_RECENT_TURNS", "3"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.2"))
+RETRIEVAL_MAX_USERS = int(os.getenv("RETRIEVAL_MAX_USERS", "1000"))
+# Texts per embeddings request. Stored turns without an embedding (older
+# history, another engine) are embedded in batches of this size by the
+# conversation writer's thread, or all at once by `manage.py backfill_embeddings`.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+# Speculative LLM kickoff: start generating on a stable partial transcript at a
+# likely endpoint and keep the answer if the final transcript matches
+SPECULATIVE_LLM = os.getenv("SPECULATIVE_LLM", "false").lower() == "true"
+SPECULATIVE_STABLE_PARTIALS = int(os.getenv("SPECULATIVE_STABLE_PARTIALS", "2"))
+
+# LLM providers the router (app.llm_router) may use, in preference order;
+# each is enabled only when its API key is set. With LLM_HEDGE, a request
+# slower than the provider's p95 (at least LLM_HEDGE_MIN_DELAY seconds) is
+# raced against the next provider.
+LLM_PROVIDERS = [name.strip() for name in os.getenv("LLM_PROVIDERS", "groq,openai").split(",") if name.strip()]
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+
+# Spoken answer length (app.response_budget): about RESPONSE_TARGET_SECONDS
+# of speech at RESPONSE_WORDS_PER_SECOND, capped in tokens at
+# RESPONSE_TOKENS_PER_WORD per word plus RESPONSE_REASONING_TOKENS for
+# reasoning models
+RESPONSE_TARGET_SECONDS = float(os.getenv("RESPONSE_TARGET_SECONDS", "20"))
+RESPONSE_WORDS_PER_SECOND = float(os.getenv("RESPONSE_WORDS_PER_SECOND", "2.5"))
+RESPONSE_TOKENS_PER_WORD = float(os.getenv("RESPONSE_TOKENS_PER_WORD", "1.4"))
+RESPONSE_REASONING_TOKENS = int(os.getenv("RESPONSE_REASONING_TOKENS", "512"))
+
+# Google STT of long audio: split at pauses into segments of at most
+# STT_MAX_SEGMENT_SECONDS, recognized STT_SEGMENT_WORKERS at a time
+STT_MAX_SEGMENT_SECONDS = float(os.getenv("STT_MAX_SEGMENT_SECONDS", "25"))
+STT_SEGMENT_WORKERS = int(os.getenv("STT_SEGMENT_WORKERS", "4"))
+
+# Engine SDKs (openai, groq, speech_recognition) are imported lazily. When the
+# ASGI app loads, the configured ones are preloaded: "background" (default)
+# in a thread so the worker accepts connections immediately, "sync" before
+# serving, or "off" to import on first use.
+ENGINE_WARMUP = os.getenv("ENGINE_WARMUP", "background").lower()
+
+# Probe the configured upstreams (app.upstream) from a background thread of
+# each ASGI worker. The probes open and keep warm the pooled provider
+# connections and drive /api/health/ready/.
+UPSTREAM_MONITOR = os.getenv("UPSTREAM_MONITOR", "true").lower() == "true"
+UPSTREAM_PROBE_INTERVAL = float(os.getenv("UPSTREAM_PROBE_INTERVAL", "20"))
+UPSTREAM_PROBE_TIMEOUT = float(os.getenv("UPSTREAM_PROBE_TIMEOUT", "5"))
+
+# Provider endpoints; point them at local stand-ins for testing. Each
+# provider gets a pool of UPSTREAM_MAX_CONNECTIONS connections, idle ones
+# kept for UPSTREAM_KEEPALIVE_SECONDS (longer than the probe interval, so
+# the probes keep at least one TLS connection open between utterances).
+# The Groq and OpenAI clients retry a failed request UPSTREAM_MAX_RETRIES times.
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+GOOGLE_SPEECH_URL = os.getenv("GOOGLE_SPEECH_URL", "http://www.google.com/speech-api/v2/recognize")
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32"))
+UPSTREAM_KEEPALIVE_SECONDS = float(os.getenv("UPSTREAM_KEEPALIVE_SECONDS", "90"))
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "60"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+
+# Per-connection limits (app.session). Audio buffers are released after
+# WS_IDLE_RELEASE_SECONDS without activity and the socket is closed (code 4008)
+# after WS_IDLE_TIMEOUT_SECONDS (0 disables closing); the reaper runs every
+# WS_IDLE_SWEEP_SECONDS.
+AUDIO_MAX_UTTERANCE_BYTES = int(os.getenv("AUDIO_MAX_UTTERANCE_BYTES", str(32 * 1024 * 1024)))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "900"))
+WS_IDLE_RELEASE_SECONDS = float(os.getenv("WS_IDLE_RELEASE_SECONDS", "60"))
+WS_IDLE_SWEEP_SECONDS = float(os.getenv("WS_IDLE_SWEEP_SECONDS", "30"))
+
+# Websocket message format when the client does not ask for one with
+# ?format= or an sts.<format> subprotocol: "orjson" (JSON text frames, falls
+# back to the standard library when orjson is not installed), "json" or
+# "msgpack" (binary frames)
+WS_MESSAGE_FORMAT = os.getenv("WS_MESSAGE_FORMAT", "orjson")
+
+# Batch transcription (app.transcription). Jobs are queued in the database
+# and processed by TRANSCRIPTION_WORKERS threads per pool; a pool runs in
+# each ASGI worker when TRANSCRIPTION_IN_PROCESS is set, and in dedicated
+# processes with `manage.py run_transcription_workers`.
+TRANSCRIPTION_WORKERS = int(os.getenv("TRANSCRIPTION_WORKERS", "2"))
+TRANSCRIPTION_IN_PROCESS = os.getenv("TRANSCRIPTION_IN_PROCESS", "true").lower() == "true"
+TRANSCRIPTION_POLL_INTERVAL = float(os.getenv("TRANSCRIPTION_POLL_INTERVAL", "2"))
+TRANSCRIPTION_MAX_ATTEMPTS = int(os.getenv("TRANSCRIPTION_MAX_ATTEMPTS", "3"))
+TRANSCRIPTION_MAX_UPLOAD_BYTES = int(os.getenv("TRANSCRIPTION_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+# Server-side speech for LLM answers (app.tts). Off by default, the browser
+# speaks the text itself. Synthesized clips are cached by content: up to
+# TTS_MEMORY_CACHE_BYTES in each worker and TTS_DISK_CACHE_BYTES in
+# TTS_CACHE_DIR, which worker processes can share (empty disables the disk tier).
+TTS_ENABLED = os.getenv("TTS_ENABLED", "false").lower() == "true"
+TTS_ENGINE = os.getenv("TTS_ENGINE", "gtts")
+TTS_VOICE = os.getenv("TTS_VOICE", "en")
+TTS_MEMORY_CACHE_BYTES = int(os.getenv("TTS_MEMORY_CACHE_BYTES", str(16 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", str(BASE_DIR / "tts_cache"))
+TTS_DISK_CACHE_BYTES = int(os.getenv("TTS_DISK_CACHE_BYTES", str(512 * 1024 * 1024)))
+TTS_STREAM_CHUNK_BYTES = int(os.getenv("TTS_STREAM_CHUNK_BYTES", str(32 * 1024)))
+
+# Fair-share scheduling of upstream calls (app.scheduler): SCHEDULER_SLOTS
+# threads per worker run STT/LLM/TTS calls, handed out to users by deficit
+# round-robin. Staff get SCHEDULER_STAFF_WEIGHT times the share of other
+# users; a user with SCHEDULER_HEAVY_AFTER calls outstanding counts as heavy
+# in the metrics, and calls beyond SCHEDULER_MAX_QUEUED_PER_USER waiting
+# are rejected.
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", "16"))
+SCHEDULER_QUANTUM = float(os.getenv("SCHEDULER_QUANTUM", "1"))
+SCHEDULER_STAFF_WEIGHT = float(os.getenv("SCHEDULER_STAFF_WEIGHT", "2"))
+SCHEDULER_HEAVY_AFTER = int(os.getenv("SCHEDULER_HEAVY_AFTER", "2"))
+SCHEDULER_MAX_QUEUED_PER_USER = int(os.getenv("SCHEDULER_MAX_QUEUED_PER_USER", "8"))
+
+# Clearing conversations hides them at once; the purger (app.purge) then
+# deletes them PURGE_BATCH_SIZE rows at a time with a pause between batches
+# so other writers get the database. It runs in each ASGI worker when
+# PURGE_IN_PROCESS is set, otherwise with `manage.py purge_conversations`.
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+PURGE_BATCH_PAUSE_SECONDS = float(os.getenv("PURGE_BATCH_PAUSE_SECONDS", "0.05"))
+PURGE_IN_PROCESS = os.getenv("PURGE_IN_PROCESS", "true").lower() == "true"
+
+# Token revocation (app.revocation). Blacklisted JTIs are kept in a Bloom
+# filter per process, refreshed from the blacklist table every
+# TOKEN_REVOCATION_REFRESH_SECONDS, so authenticating a valid token does not
+# query the blacklist. Expired tokens are pruned from the simplejwt tables
+# every TOKEN_PRUNE_INTERVAL_SECONDS (0 disables; `manage.py prune_tokens`
+# does the same once).
+TOKEN_REVOCATION_REFRESH_SECONDS = float(os.getenv("TOKEN_REVOCATION_REFRESH_SECONDS", "5"))
+TOKEN_REVOCATION_CAPACITY = int(os.getenv("TOKEN_REVOCATION_CAPACITY", "100000"))
+TOKEN_PRUNE_INTERVAL_SECONDS = float(os.getenv("TOKEN_PRUNE_INTERVAL_SECONDS", "3600"))
+TOKEN_PRUNE_BATCH_SIZE = int(os.getenv("TOKEN_PRUNE_BATCH_SIZE", "1000"))
+
+# Conversation archival (app.archive): `manage.py archive_conversations`
+# moves turns older than ARCHIVE_AFTER_DAYS out of the Conversation table
+# into zlib-compressed per-user-month segments. The history and search APIs
+# read them with ?include_archived=true (or a history ?since= older than that).
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6"))
+
+# Longest profile an admin can take with /api/profile/ (app.profiler)
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
 
 
 # Password validation
@@ -155,7 +381,7 @@ CORS_ALLOW_CREDENTIALS = True
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.auth_utils.RevocationCheckingJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',